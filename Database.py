@@ -1,19 +1,378 @@
 #Database Connection Settings
+# Settings come from environment variables, then from an optional config file
+# (DB_CONFIG, default database.ini next to this module), then from the defaults
+# below. Nothing connects until a connection is first borrowed.
+import configparser
+import itertools
+import os
+import threading
+import time
+from contextlib import contextmanager
+
 import psycopg2
+from psycopg2 import extensions
+
+import instrumentation
+from instrumentation import InstrumentedCursor
+from records import RecordCursor
+
+CONFIG_FILE = os.environ.get("DB_CONFIG", os.path.join(os.path.dirname(os.path.abspath(__file__)), "database.ini"))
+
+DEFAULTS = {
+    "database": {
+        "dsn": "",
+        "host": "localhost",
+        "dbname": "ecommerce",
+        "user": "postgres",
+        "password": "1234",
+        "port": "5432",
+        "connect_timeout": "10",
+        "itersize": "2000",                # rows per round trip for streaming cursors
+    },
+    "pool": {
+        "min_size": "1",
+        "max_size": "10",
+        "checkout_timeout": "30",          # seconds to wait for a free connection
+        "health_check_interval": "30",     # ping connections idle for longer than this
+        "warmup": "0",
+    },
+    "cache": {
+        "enabled": "1",
+        "backend": "memory",               # memory, or sqlite to share between processes
+        "path": "",                        # sqlite file; default .query_cache.sqlite3 here
+        "ttl": "60",                       # seconds
+        "max_bytes": "33554432",
+    },
+    "instrumentation": {
+        "enabled": "1",
+        "slow_ms": "250",                  # statements slower than this go to the slow log
+        "slow_log": "",                    # file; stderr when unset
+        "export_path": "",                 # JSON snapshot of the query stats, rewritten periodically
+        "export_url": "",                  # or POSTed here
+        "export_interval": "60",           # seconds
+    },
+    "profiling": {
+        "enabled": "0",                    # profile every app rerun (also a sidebar checkbox)
+        "dump_dir": "",                    # write each profiled rerun here as a .prof file
+    },
+}
+
+ENV_VARS = {
+    ("database", "dsn"): "DATABASE_URL",
+    ("database", "host"): "DB_HOST",
+    ("database", "dbname"): "DB_NAME",
+    ("database", "user"): "DB_USER",
+    ("database", "password"): "DB_PASSWORD",
+    ("database", "port"): "DB_PORT",
+    ("database", "connect_timeout"): "DB_CONNECT_TIMEOUT",
+    ("database", "itersize"): "DB_ITERSIZE",
+    ("pool", "min_size"): "DB_POOL_MIN",
+    ("pool", "max_size"): "DB_POOL_MAX",
+    ("pool", "checkout_timeout"): "DB_CHECKOUT_TIMEOUT",
+    ("pool", "health_check_interval"): "DB_HEALTH_CHECK_INTERVAL",
+    ("pool", "warmup"): "DB_WARMUP",
+    ("cache", "enabled"): "QUERY_CACHE",
+    ("cache", "backend"): "QUERY_CACHE_BACKEND",
+    ("cache", "path"): "QUERY_CACHE_PATH",
+    ("cache", "ttl"): "QUERY_CACHE_TTL",
+    ("cache", "max_bytes"): "QUERY_CACHE_MAX_BYTES",
+    ("instrumentation", "enabled"): "QUERY_STATS",
+    ("instrumentation", "slow_ms"): "SLOW_QUERY_MS",
+    ("instrumentation", "slow_log"): "SLOW_QUERY_LOG",
+    ("instrumentation", "export_path"): "QUERY_STATS_EXPORT",
+    ("instrumentation", "export_url"): "QUERY_STATS_URL",
+    ("instrumentation", "export_interval"): "QUERY_STATS_INTERVAL",
+    ("profiling", "enabled"): "PROFILE_APP",
+    ("profiling", "dump_dir"): "PROFILE_DIR",
+}
+
+
+def load_settings(path=CONFIG_FILE):
+    parser = configparser.ConfigParser()
+    parser.read_dict(DEFAULTS)
+    parser.read(path)
+    settings = {section: dict(parser[section]) for section in DEFAULTS}
+    for (section, key), var in ENV_VARS.items():
+        if var in os.environ:
+            settings[section][key] = os.environ[var]
+    return settings
+
+
+settings = load_settings()
+instrumentation.configure(settings["instrumentation"])
+
+
+def connect_params():
+    # Keyword arguments for psycopg2.connect()
+    db = settings["database"]
+    if db["dsn"]:
+        return {"dsn": db["dsn"]}
+    return {
+        "host": db["host"],
+        "database": db["dbname"],
+        "user": db["user"],
+        "password": db["password"],
+        "port": db["port"],
+        "connect_timeout": int(db["connect_timeout"]),
+    }
 
 
 def connection():
-    con = psycopg2.connect(
-        host="localhost",
-        database="ecommerce",
-        user="postgres",
-        password="1234",
-        port="5432"
-    )
-
-    if con:
-        print("Connention successful")
-    else:
-        print("Connection failed")
-    return con
-conn = connection()
\ No newline at end of file
+    # Every cursor is instrumented unless another factory is asked for.
+    # psycopg2.connect raises OperationalError when it can't connect.
+    return psycopg2.connect(**connect_params(), cursor_factory=InstrumentedCursor)
+
+
+class PoolError(Exception):
+    pass
+
+
+class PoolTimeout(PoolError):
+    pass
+
+
+class ConnectionPool:
+    # Thread-safe pool: connections are borrowed with getconn() and given back
+    # with putconn(). Broken connections are replaced transparently.
+    def __init__(self, min_size=1, max_size=10, timeout=30, health_check_interval=30):
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.health_check_interval = health_check_interval
+        self._cond = threading.Condition()
+        self._idle = []            # (connection, last_used) pairs
+        self._size = 0             # idle + in use
+        self._in_use = 0
+        self._closed = False
+        self._checkouts = 0
+        self._waits = 0
+        self._timeouts = 0
+        self._reconnects = 0
+        self._checkout_time = 0.0
+        self._max_checkout_time = 0.0
+
+    def warm_up(self):
+        # Open connections up to min_size so the first requests don't pay
+        # the connect + auth handshake.
+        while True:
+            with self._cond:
+                if self._closed or self._size >= self.min_size:
+                    return
+                self._size += 1
+            try:
+                con = connection()
+            except Exception:
+                with self._cond:
+                    self._size -= 1
+                raise
+            with self._cond:
+                self._idle.append((con, time.monotonic()))
+                self._cond.notify()
+
+    def _is_healthy(self, con, last_used):
+        if con.closed:
+            return False
+        if con.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+            return False
+        if time.monotonic() - last_used < self.health_check_interval:
+            return True
+        try:
+            cur = con.cursor()
+            cur.execute('SELECT 1')
+            cur.close()
+            con.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _discard(self, con):
+        try:
+            con.close()
+        except psycopg2.Error:
+            pass
+
+    def getconn(self):
+        start = time.monotonic()
+        deadline = start + self.timeout
+        with self._cond:
+            if self._closed:
+                raise PoolError("connection pool is closed")
+            waited = False
+            while not self._idle and self._size >= self.max_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._timeouts += 1
+                    raise PoolTimeout(f"no connection available after {self.timeout}s")
+                waited = True
+                self._cond.wait(remaining)
+            if waited:
+                self._waits += 1
+            if self._idle:
+                con, last_used = self._idle.pop()
+            else:
+                con, last_used = None, None
+                self._size += 1   # reserve the slot before connecting
+            self._in_use += 1
+
+        try:
+            if con is None:
+                con = connection()
+            elif not self._is_healthy(con, last_used):
+                self._discard(con)
+                con = connection()
+                with self._cond:
+                    self._reconnects += 1
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+
+        elapsed = time.monotonic() - start
+        with self._cond:
+            self._checkouts += 1
+            self._checkout_time += elapsed
+            self._max_checkout_time = max(self._max_checkout_time, elapsed)
+        return con
+
+    def putconn(self, con, close=False):
+        if not con.closed and not close:
+            if con.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+                try:
+                    con.rollback()
+                except psycopg2.Error:
+                    close = True
+        with self._cond:
+            self._in_use -= 1
+            if con.closed or close or self._closed:
+                self._size -= 1
+                self._discard(con)
+            else:
+                self._idle.append((con, time.monotonic()))
+            self._cond.notify()
+
+    def closeall(self):
+        with self._cond:
+            self._closed = True
+            for con, _ in self._idle:
+                self._discard(con)
+            self._size -= len(self._idle)
+            self._idle = []
+            self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            return {
+                "size": self._size,
+                "in_use": self._in_use,
+                "idle": len(self._idle),
+                "max_size": self.max_size,
+                "checkouts": self._checkouts,
+                "waits": self._waits,
+                "timeouts": self._timeouts,
+                "reconnects": self._reconnects,
+                "avg_checkout_ms": (self._checkout_time / self._checkouts * 1000) if self._checkouts else 0.0,
+                "max_checkout_ms": self._max_checkout_time * 1000,
+            }
+
+
+_pool = None
+_pool_lock = threading.Lock()
+_inherited = []
+
+
+def _reset_after_fork():
+    # A forked process (multiprocessing workers) must not use the parent's
+    # connections: they share its sockets. The inherited pool is set aside,
+    # not closed (closing would end the parent's sessions), and the child
+    # opens its own on first use.
+    global _pool, _pool_lock
+    if _pool is not None:
+        _inherited.append(_pool)
+    _pool = None
+    _pool_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                opts = settings["pool"]
+                _pool = ConnectionPool(
+                    min_size=int(opts["min_size"]),
+                    max_size=int(opts["max_size"]),
+                    timeout=float(opts["checkout_timeout"]),
+                    health_check_interval=float(opts["health_check_interval"]),
+                )
+    return _pool
+
+
+@contextmanager
+def get_connection():
+    # Borrow a pooled connection for the duration of a with-block.
+    # Uncommitted work is rolled back when the block exits.
+    pool = get_pool()
+    con = pool.getconn()
+    try:
+        yield con
+    except Exception:
+        if not con.closed:
+            try:
+                con.rollback()
+            except psycopg2.Error:
+                pass
+        raise
+    finally:
+        pool.putconn(con)
+
+
+_stream_ids = itertools.count(1)
+
+
+def iter_query(query, params=None, itersize=None, record=None):
+    # Stream a query through a named (server-side) cursor, fetching itersize
+    # rows per round trip, so memory stays flat however large the result is.
+    # Rows are `record` instances when a record type is given.
+    # The pooled connection is held until the generator is exhausted or closed.
+    with get_connection() as conn:
+        cur = conn.cursor(name=f"stream_{next(_stream_ids)}", cursor_factory=RecordCursor)
+        cur.record = record
+        cur.itersize = itersize or int(settings["database"]["itersize"])
+        try:
+            cur.execute(query, params)
+            for row in cur:
+                yield row
+        finally:
+            if not conn.closed:
+                cur.close()
+
+
+def warm_up(background=False):
+    if not background:
+        get_pool().warm_up()
+        return None
+    def run():
+        try:
+            get_pool().warm_up()
+        except Exception as e:
+            print("Database warm-up failed:", e)
+    thread = threading.Thread(target=run, name="db-warmup", daemon=True)
+    thread.start()
+    return thread
+
+
+def warmup_enabled():
+    return settings["pool"]["warmup"].lower() in ("1", "true", "yes", "on")
+
+
+def pool_stats():
+    if _pool is None:
+        return {"size": 0, "in_use": 0, "idle": 0, "max_size": int(settings["pool"]["max_size"]),
+                "checkouts": 0, "waits": 0, "timeouts": 0, "reconnects": 0,
+                "avg_checkout_ms": 0.0, "max_checkout_ms": 0.0}
+    return _pool.stats()
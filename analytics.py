@@ -0,0 +1,403 @@
+# Columnar analytics over sales and sale items.
+# The two tables are extracted once into NumPy column arrays (binary COPY,
+# integer columns only: dates as days since 1970-01-01, money in cents) and
+# then kept current by id watermark: refresh() copies only rows with ids
+# above the last ones seen. Aggregations (by day, product, customer, basket
+# size, moving averages) are vectorized over the arrays and don't query
+# Postgres.
+#
+# Sales and sale items are treated as append-only, as checkout writes them.
+# Ids handed out to transactions still open at refresh time are re-checked
+# on later refreshes for GAP_TTL seconds. Updates and deletes of existing
+# rows are only picked up by load(), so headline figures (the dashboard
+# totals and trend) should come from the sales_daily rollup instead.
+#
+#   columns = get_analytics()
+#   daily = columns.daily(start_date, end_date)       # dict of arrays
+#   moving_average(daily["revenue"], 7)
+
+import io
+import struct
+import threading
+import time
+from datetime import date
+
+import numpy as np
+
+from Database import get_connection
+
+REFRESH_INTERVAL = 30.0    # seconds; get_analytics() refreshes at most this often
+CHUNK_IDS = 1000000        # id range per COPY, to bound the transfer buffer
+GAP_WINDOW = 10000         # missing ids this close to the newest are re-checked
+GAP_TTL = 300.0            # seconds before a missing id is taken as rolled back
+EPOCH = date(1970, 1, 1)
+
+# (column, Postgres type, SQL expression); every column is NOT NULL
+SALE_COLUMNS = (
+    ("id", "int4", "id"),
+    ("customer_id", "int4", "customer_id"),
+    ("day", "int4", "(date - DATE '1970-01-01')"),
+    ("total", "int8", "round(total_amount * 100)::int8"),
+)
+ITEM_COLUMNS = (
+    ("id", "int4", "id"),
+    ("sale_id", "int4", "sale_id"),
+    ("product_id", "int4", "product_id"),
+    ("quantity", "int4", "quantity"),
+    ("price", "int8", "round(price * 100)::int8"),
+)
+
+_SIGNATURE = b"PGCOPY\n\xff\r\n\x00"
+_NATIVE = {"int4": np.int32, "int8": np.int64}
+
+
+def _day(value):
+    return None if value is None else (value - EPOCH).days
+
+
+def _read_copy(cur, table, columns, where, params):
+    # Rows of `table` matching `where`, as a dict of column arrays, through a
+    # binary COPY: with fixed-width integer fields every row has the same
+    # layout and the buffer is read as one structured array.
+    select = ", ".join(f"{expression}::{pgtype}" for _, pgtype, expression in columns)
+    query = cur.mogrify(f"COPY (SELECT {select} FROM {table} WHERE {where} ORDER BY id) TO STDOUT (FORMAT binary)",
+                        params).decode()
+    buffer = io.BytesIO()
+    cur.copy_expert(query, buffer)
+    data = buffer.getbuffer()
+    if bytes(data[:11]) != _SIGNATURE:
+        raise ValueError("unexpected COPY output")
+    start = 19 + struct.unpack_from(">i", data, 15)[0]
+    end = len(data) - 2     # file trailer
+    fields = [("fields", ">i2")]
+    for name, pgtype, _ in columns:
+        fields += [(f"{name}_length", ">i4"), (name, ">i4" if pgtype == "int4" else ">i8")]
+    row = np.dtype(fields)
+    if (end - start) % row.itemsize:
+        raise ValueError("unexpected COPY row layout")
+    rows = np.frombuffer(data, row, count=(end - start) // row.itemsize, offset=start)
+    result = {name: rows[name].astype(_NATIVE[pgtype]) for name, pgtype, _ in columns}
+    del rows, data
+    return result
+
+
+class _Table:
+    # Growable column arrays; capacity doubles so appends are amortized O(1)
+    def __init__(self, columns):
+        self.dtypes = {name: _NATIVE[pgtype] for name, pgtype, _ in columns}
+        self.arrays = {name: np.empty(0, dtype) for name, dtype in self.dtypes.items()}
+        self.size = 0
+        self.max_id = 0
+
+    def append(self, block):
+        count = len(block["id"])
+        if not count:
+            return
+        needed = self.size + count
+        for name, array in self.arrays.items():
+            if needed > len(array):
+                grown = np.empty(max(needed, 2 * len(array), 1024), self.dtypes[name])
+                grown[:self.size] = array[:self.size]
+                self.arrays[name] = array = grown
+            array[self.size:needed] = block[name]
+        self.size = needed
+        self.max_id = max(self.max_id, int(block["id"].max()))
+
+    def __getitem__(self, name):
+        return self.arrays[name][:self.size]
+
+
+class SalesColumns:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.sales = _Table(SALE_COLUMNS)
+        self.items = _Table(ITEM_COLUMNS)
+        self._gaps = {"sales": {}, "sale_items": {}}    # table -> {missing id: first seen}
+        self._derived = None
+        self._refreshed_at = 0.0
+
+    @classmethod
+    def from_arrays(cls, sales, items):
+        # sales / items: dicts of column arrays (see SALE_COLUMNS, ITEM_COLUMNS)
+        columns = cls()
+        columns.sales.append(sales)
+        columns.items.append(items)
+        return columns
+
+    # ---------- loading ----------
+
+    def load(self):
+        # Full extract, replacing what is held
+        fresh = SalesColumns()
+        fresh.refresh(force=True)
+        with self._lock:
+            self.sales, self.items, self._gaps = fresh.sales, fresh.items, fresh._gaps
+            self._derived = None
+            self._refreshed_at = fresh._refreshed_at
+
+    def refresh(self, force=False):
+        # Append sales and items added since the last load or refresh.
+        # Returns the number of new rows.
+        if not force and time.monotonic() - self._refreshed_at < REFRESH_INTERVAL:
+            return 0
+        with self._lock:
+            with get_connection() as conn:
+                cur = conn.cursor()
+                # One snapshot for both tables, so every item's sale is present
+                cur.execute('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ READ ONLY')
+                cur.execute('''SELECT (SELECT COALESCE(MAX(id), 0) FROM sales),
+                                      (SELECT COALESCE(MAX(id), 0) FROM sale_items)''')
+                max_sale_id, max_item_id = cur.fetchone()
+                added = self._fetch(cur, "sales", SALE_COLUMNS, self.sales, max_sale_id)
+                added += self._fetch(cur, "sale_items", ITEM_COLUMNS, self.items, max_item_id)
+                conn.commit()
+                cur.close()
+            if added:
+                self._derived = None
+            self._refreshed_at = time.monotonic()
+            return added
+
+    def _fetch(self, cur, name, columns, table, max_id):
+        added = 0
+        now = time.monotonic()
+        gaps = self._gaps[name]
+        for missing_id, seen in list(gaps.items()):
+            if now - seen > GAP_TTL:
+                del gaps[missing_id]
+        if gaps:
+            block = _read_copy(cur, name, columns, 'id = ANY(%s)', (sorted(gaps),))
+            for found_id in block["id"].tolist():
+                del gaps[found_id]
+            table.append(block)
+            added += len(block["id"])
+
+        low = table.max_id
+        while low < max_id:
+            high = min(low + CHUNK_IDS, max_id)
+            block = _read_copy(cur, name, columns, 'id > %s AND id <= %s', (low, high))
+            table.append(block)
+            added += len(block["id"])
+            # Ids missing near the top may belong to transactions still open
+            window = max(low, max_id - GAP_WINDOW)
+            if high > window and len(block["id"]) < high - low:
+                present = np.zeros(high - window, bool)
+                ids = block["id"]
+                present[ids[ids > window] - window - 1] = True
+                for missing_id in (np.flatnonzero(~present) + window + 1).tolist():
+                    gaps.setdefault(missing_id, now)
+            low = high
+        table.max_id = max(table.max_id, max_id)
+        return added
+
+    # ---------- derived columns ----------
+
+    def _columns(self):
+        # Per-item sale position, day, customer and line revenue; rebuilt
+        # after rows are added
+        if self._derived is None:
+            sale_ids = self.sales["id"]
+            position = np.full(self.sales.max_id + 1, -1, np.int32)
+            position[sale_ids] = np.arange(len(sale_ids), dtype=np.int32)
+            item_sale_ids = self.items["sale_id"]
+            item_sale = np.full(len(item_sale_ids), -1, np.int32)
+            known = item_sale_ids < len(position)
+            item_sale[known] = position[item_sale_ids[known]]
+            valid = item_sale >= 0
+            if valid.any():
+                item_sale[~valid] = 0      # masked out by item_valid
+                day = self.sales["day"][item_sale]
+            else:
+                item_sale[:] = 0
+                day = np.zeros(len(item_sale), np.int32)
+            self._derived = {
+                "item_sale": item_sale,
+                "item_valid": valid,
+                "item_day": day,
+                "item_revenue": self.items["quantity"].astype(np.int64) * self.items["price"],
+            }
+        return self._derived
+
+    def _sale_mask(self, start_date, end_date):
+        day = self.sales["day"]
+        mask = np.ones(len(day), bool)
+        if start_date is not None:
+            mask &= day >= _day(start_date)
+        if end_date is not None:
+            mask &= day <= _day(end_date)
+        return mask
+
+    def _item_mask(self, start_date, end_date):
+        derived = self._columns()
+        day = derived["item_day"]
+        mask = derived["item_valid"].copy()
+        if start_date is not None:
+            mask &= day >= _day(start_date)
+        if end_date is not None:
+            mask &= day <= _day(end_date)
+        return mask
+
+    # ---------- aggregations ----------
+
+    def summary(self, start_date=None, end_date=None):
+        # (sale count, revenue in cents, items sold)
+        with self._lock:
+            sales = self._sale_mask(start_date, end_date)
+            items = self._item_mask(start_date, end_date)
+            return (int(sales.sum()), int(self.sales["total"][sales].sum()),
+                    int(self.items["quantity"][items].sum(dtype=np.int64)))
+
+    def daily(self, start_date=None, end_date=None):
+        # Days with sales, with their sale count, revenue (cents), items sold
+        # and distinct customers
+        with self._lock:
+            sales = self._sale_mask(start_date, end_date)
+            day = self.sales["day"][sales]
+            if not len(day):
+                return {"day": np.empty(0, "datetime64[D]"), "sale_count": np.empty(0, np.int64),
+                        "revenue": np.empty(0, np.int64), "items_sold": np.empty(0, np.int64),
+                        "customer_count": np.empty(0, np.int64)}
+            first = int(day.min())
+            offset = day - first
+            length = int(offset.max()) + 1
+            sale_count = np.bincount(offset, minlength=length)
+            revenue = np.bincount(offset, weights=self.sales["total"][sales], minlength=length)
+
+            # Items are filtered on their sale's day, so they fall on these days too
+            items = self._item_mask(start_date, end_date)
+            items_sold = np.bincount(self._columns()["item_day"][items] - first,
+                                     weights=self.items["quantity"][items], minlength=length)
+
+            customer = self.sales["customer_id"][sales].astype(np.int64)
+            stride = int(customer.max()) + 1
+            pairs = _distinct(offset.astype(np.int64) * stride + customer)
+            customer_count = np.bincount(pairs // stride, minlength=length)
+
+            days = np.flatnonzero(sale_count)
+            return {
+                "day": (days + first).astype("datetime64[D]"),
+                "sale_count": sale_count[days],
+                "revenue": np.rint(revenue[days]).astype(np.int64),
+                "items_sold": np.rint(items_sold[days]).astype(np.int64),
+                "customer_count": customer_count[days],
+            }
+
+    def revenue_by(self, key, start_date=None, end_date=None, limit=None):
+        # Revenue (cents) grouped by "product", "customer" or "day", highest
+        # first. Product revenue is the sum of its lines; customer and day
+        # revenue the sum of sale totals. Also returns units (products) or
+        # sale counts (customers, days).
+        with self._lock:
+            if key == "product":
+                items = self._item_mask(start_date, end_date)
+                keys, _, revenue, counts = group_by(self.items["product_id"][items],
+                                                    self._columns()["item_revenue"][items],
+                                                    self.items["quantity"][items])
+                count_name = "units"
+            elif key in ("customer", "day"):
+                sales = self._sale_mask(start_date, end_date)
+                column = self.sales["customer_id" if key == "customer" else "day"][sales]
+                keys, counts, revenue = group_by(column, self.sales["total"][sales])
+                if key == "day":
+                    keys = keys.astype("datetime64[D]")
+                count_name = "sale_count"
+            else:
+                raise ValueError(f"Unknown key {key!r}; choose product, customer or day")
+            order = np.argsort(-revenue, kind="stable")[:limit]
+            return {key: keys[order], "revenue": revenue[order], count_name: counts[order]}
+
+    def top_products(self, limit=10, start_date=None, end_date=None):
+        # Best sellers by units: product_id, units, revenue (cents)
+        with self._lock:
+            items = self._item_mask(start_date, end_date)
+            keys, _, units, revenue = group_by(self.items["product_id"][items], self.items["quantity"][items],
+                                               self._columns()["item_revenue"][items])
+            order = np.lexsort((keys, -units))[:limit]
+            return {"product_id": keys[order], "units": units[order], "revenue": revenue[order]}
+
+    def basket_sizes(self, start_date=None, end_date=None, by="lines"):
+        # Distribution of basket sizes (lines or units per sale): size -> sale
+        # count, over sales with at least one item, plus summary statistics
+        if by not in ("lines", "units"):
+            raise ValueError("by must be 'lines' or 'units'")
+        with self._lock:
+            items = self._item_mask(start_date, end_date)
+            sale = self._columns()["item_sale"][items]
+            weights = None if by == "lines" else self.items["quantity"][items]
+            per_sale = np.bincount(sale, weights=weights, minlength=self.sales.size).astype(np.int64)
+            per_sale = per_sale[per_sale > 0]
+            if not len(per_sale):
+                return {"size": np.empty(0, np.int64), "sales": np.empty(0, np.int64),
+                        "mean": 0.0, "median": 0.0, "p90": 0.0}
+            distribution = np.bincount(per_sale)
+            sizes = np.flatnonzero(distribution)
+            return {"size": sizes, "sales": distribution[sizes], "mean": float(per_sale.mean()),
+                    "median": float(np.median(per_sale)), "p90": float(np.percentile(per_sale, 90))}
+
+
+def _distinct(values):
+    # Sorted distinct values (a sort and a compare; faster than np.unique)
+    ordered = np.sort(values)
+    if not len(ordered):
+        return ordered
+    return ordered[np.concatenate(([True], ordered[1:] != ordered[:-1]))]
+
+
+def group_by(keys, *values):
+    # Distinct keys (sorted), the row count of each, and the per-key sum of
+    # each values array (integer sums stay integers)
+    keys = np.asarray(keys)
+    if not len(keys):
+        return (keys, np.empty(0, np.int64)) + tuple(np.empty(0, np.int64) for _ in values)
+    dense = np.issubdtype(keys.dtype, np.integer)
+    if dense:
+        low = int(keys.min())
+        dense = int(keys.max()) - low < 4 * len(keys) + 65536
+    if dense:
+        # Dense integer keys (ids, days): one bincount slot per possible key
+        index = keys.astype(np.int64) - low
+        counts = np.bincount(index)
+        present = np.flatnonzero(counts)
+        unique = (present + low).astype(keys.dtype)
+    else:
+        order = np.argsort(keys, kind="stable")
+        ordered = keys[order]
+        first = np.concatenate(([True], ordered[1:] != ordered[:-1]))
+        unique = ordered[first]
+        index = np.empty(len(keys), np.int64)
+        index[order] = np.cumsum(first) - 1
+        counts = np.bincount(index)
+        present = slice(None)
+    sums = [counts[present]]
+    for value in values:
+        total = np.bincount(index, weights=value, minlength=len(counts))[present]
+        sums.append(np.rint(total).astype(np.int64) if np.issubdtype(np.asarray(value).dtype, np.integer) else total)
+    return (unique,) + tuple(sums)
+
+
+def moving_average(values, window):
+    # Trailing mean over the last `window` values (fewer at the start)
+    if window < 1:
+        raise ValueError("window must be at least 1")
+    values = np.asarray(values, dtype=float)
+    sums = np.concatenate(([0.0], np.cumsum(values)))
+    ends = np.arange(1, len(values) + 1)
+    starts = np.maximum(ends - window, 0)
+    return (sums[ends] - sums[starts]) / (ends - starts)
+
+
+_analytics = None
+_analytics_lock = threading.Lock()
+
+
+def get_analytics():
+    # The shared extract, loaded on first use and refreshed at most every
+    # REFRESH_INTERVAL seconds
+    global _analytics
+    with _analytics_lock:
+        if _analytics is None:
+            columns = SalesColumns()
+            columns.refresh(force=True)
+            _analytics = columns
+        else:
+            _analytics.refresh()
+    return _analytics
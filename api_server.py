@@ -0,0 +1,375 @@
+# HTTP/JSON API for POS terminals and barcode scanners.
+#
+#   python api_server.py [--host 127.0.0.1] [--port 8080]
+#
+#   GET  /health                       pool and cache stats
+#   GET  /products/<id>                one product (from the in-memory catalog)
+#   GET  /products?sku=<sku>           barcode / SKU lookup
+#   GET  /products?q=<text>&limit=20   name search (prefix, typo tolerant)
+#   GET  /products/all                 every product, streamed as a JSON array
+#   GET  /stock?ids=1,2,3              current stock levels from the database
+#   POST /checkout                     {"customer_id": 1, "lines": [[product_id, quantity], ...],
+#                                       "date": "2024-01-31"?} -> {"sale_id", "total_amount"}
+#                                      lines are charged at the catalog price
+#   GET  /bills/<sale_id>[?format=text|html]
+#   POST /batch                        {"operations": [{"op": "checkout", ...}, {"op": "product", "id": 1}, ...]}
+#                                      -> {"results": [{"status": 200, "body": ...}, ...]} in request order
+#
+# HTTP/1.1 with keep-alive, served by one asyncio event loop on the async
+# connection pool (async_db.py); size it with DB_POOL_MAX. Money is returned
+# as strings so no precision is lost.
+
+import argparse
+import asyncio
+import json
+import sys
+from datetime import date
+from decimal import Decimal
+from urllib.parse import parse_qs, urlsplit
+
+from Database import PoolTimeout
+from async_db import close_async_pool, get_async_pool, acquire
+from async_models import AsyncProduct, AsyncSale
+from billing import get_bill
+from cache import cache_stats
+from catalog import get_catalog
+from products import InsufficientStock
+from queries import STOCK_LEVELS
+
+MAX_BODY = 10 * 1024 * 1024
+MAX_BATCH = 1000
+KEEP_ALIVE_TIMEOUT = 15        # seconds an idle connection is kept open
+STREAM_PAGE_SIZE = 1000
+
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+           409: "Conflict", 411: "Length Required", 413: "Payload Too Large",
+           500: "Internal Server Error", 503: "Service Unavailable"}
+
+
+class ApiError(Exception):
+    def __init__(self, status, message, **details):
+        super().__init__(message)
+        self.status = status
+        self.body = {"error": message, **details}
+
+
+def _json_default(value):
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, date):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def dumps(value):
+    return json.dumps(value, default=_json_default, separators=(",", ":")).encode()
+
+
+def _entry(entry):
+    return {"id": entry.id, "sku": entry.sku, "name": entry.name,
+            "price": entry.price, "quantity": entry.quantity}
+
+
+def _int(value, name):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise ApiError(400, f"{name} must be an integer") from None
+
+
+async def _catalog():
+    # get_catalog() may refresh from the database; keep that off the loop
+    return await asyncio.get_running_loop().run_in_executor(None, get_catalog)
+
+
+# ---------- operations (shared by the endpoints and /batch) ----------
+
+async def op_product(params):
+    catalog = await _catalog()
+    if "id" in params:
+        entry = catalog.get(_int(params["id"], "id"))
+    elif "sku" in params:
+        entry = catalog.by_sku(str(params["sku"]))
+    else:
+        raise ApiError(400, "id or sku is required")
+    if entry is None:
+        raise ApiError(404, "product not found")
+    return _entry(entry)
+
+
+async def op_search(params):
+    catalog = await _catalog()
+    limit = min(_int(params.get("limit", 20), "limit"), 200)
+    return [_entry(entry) for entry in catalog.search(str(params.get("q", "")), limit=limit)]
+
+
+async def op_stock(params):
+    ids = params.get("ids") or []
+    if isinstance(ids, str):
+        ids = [part for part in ids.split(",") if part]
+    ids = [_int(product_id, "ids") for product_id in ids]
+    async with acquire() as conn:
+        rows = await conn.fetchall(STOCK_LEVELS, (ids,))
+    return {str(product_id): quantity for product_id, quantity in rows}
+
+
+async def op_checkout(params):
+    if "customer_id" not in params or "lines" not in params:
+        raise ApiError(400, "customer_id and lines are required")
+    # Prices are never taken from the request: checkout reads them from
+    # products in the same transaction that decrements the stock
+    lines = params["lines"]
+    if not isinstance(lines, list) or not all(isinstance(line, list) and len(line) == 2 for line in lines):
+        raise ApiError(400, "each line must be [product_id, quantity]")
+    sale_date = params.get("date")
+    try:
+        sale_date = date.fromisoformat(sale_date) if sale_date else None
+        sale_id, total_amount = await AsyncSale.checkout(_int(params["customer_id"], "customer_id"),
+                                                         lines, sale_date)
+    except InsufficientStock as e:
+        raise ApiError(409, "insufficient stock",
+                       failed=[{"product_id": product_id, "requested": requested, "available": available}
+                               for product_id, requested, available in e.failed]) from None
+    except (ValueError, TypeError) as e:
+        raise ApiError(400, str(e)) from None
+    return {"sale_id": sale_id, "total_amount": total_amount}
+
+
+async def op_bill(params):
+    sale_id = _int(params.get("sale_id"), "sale_id")
+    bill = await asyncio.get_running_loop().run_in_executor(None, get_bill, sale_id)
+    if bill is None:
+        raise ApiError(404, "sale not found")
+    fmt = params.get("format", "json")
+    if fmt in ("text", "html"):
+        return bill[fmt]
+    return {key: value for key, value in bill.items() if key not in ("text", "html")}
+
+
+OPERATIONS = {
+    "product": op_product,
+    "search": op_search,
+    "stock": op_stock,
+    "checkout": op_checkout,
+    "bill": op_bill,
+}
+
+
+async def run_operation(op, params):
+    # Returns (status, body)
+    try:
+        return 200, await OPERATIONS[op](params)
+    except ApiError as e:
+        return e.status, e.body
+    except PoolTimeout as e:
+        return 503, {"error": str(e)}
+    except Exception as e:
+        return 500, {"error": str(e)}
+
+
+async def op_batch(body):
+    operations = body.get("operations") if isinstance(body, dict) else None
+    if not isinstance(operations, list):
+        raise ApiError(400, "operations must be a list")
+    if len(operations) > MAX_BATCH:
+        raise ApiError(413, f"at most {MAX_BATCH} operations per batch")
+    for operation in operations:
+        if not isinstance(operation, dict) or operation.get("op") not in OPERATIONS:
+            raise ApiError(400, f"each operation needs an op, one of {', '.join(OPERATIONS)}")
+    # Operations run concurrently, limited by the connection pool
+    results = await asyncio.gather(*(run_operation(operation["op"], operation) for operation in operations))
+    return {"results": [{"status": status, "body": body} for status, body in results]}
+
+
+# ---------- HTTP ----------
+
+class Request:
+    def __init__(self, method, target, version, headers, body):
+        self.method = method
+        parts = urlsplit(target)
+        self.path = parts.path.rstrip("/") or "/"
+        self.query = {key: values[-1] for key, values in parse_qs(parts.query).items()}
+        self.version = version
+        self.headers = headers
+        self.body = body
+
+    def json(self):
+        try:
+            return json.loads(self.body or b"null")
+        except ValueError:
+            raise ApiError(400, "body is not valid JSON") from None
+
+    def keep_alive(self):
+        connection = self.headers.get("connection", "").lower()
+        if self.version == "HTTP/1.0":
+            return connection == "keep-alive"
+        return connection != "close"
+
+
+async def read_request(reader):
+    # Returns a Request, or None when the client closed the connection
+    line = await reader.readline()
+    if not line:
+        return None
+    try:
+        method, target, version = line.decode("latin-1").split()
+    except ValueError:
+        raise ApiError(400, "malformed request line") from None
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    if "transfer-encoding" in headers:
+        raise ApiError(411, "chunked request bodies are not supported; send Content-Length")
+    length = _int(headers.get("content-length", 0), "Content-Length")
+    if length < 0:
+        raise ApiError(400, "Content-Length must not be negative")
+    if length > MAX_BODY:
+        raise ApiError(413, "request body too large")
+    body = await reader.readexactly(length) if length else b""
+    return Request(method, target, version, headers, body)
+
+
+def _head(status, content_type, keep_alive, length=None):
+    lines = [f"HTTP/1.1 {status} {REASONS.get(status, 'Unknown')}",
+             f"Content-Type: {content_type}",
+             "Connection: " + ("keep-alive" if keep_alive else "close")]
+    lines.append(f"Content-Length: {length}" if length is not None else "Transfer-Encoding: chunked")
+    return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+
+
+async def send(writer, status, body, keep_alive, content_type=None):
+    if content_type is None:
+        payload, content_type = dumps(body), "application/json"
+    else:
+        payload = body.encode()
+    writer.write(_head(status, content_type, keep_alive, len(payload)) + payload)
+    await writer.drain()
+
+
+def _chunk(writer, data):
+    writer.write(b"%x\r\n%s\r\n" % (len(data), data))
+
+
+async def stream_products(writer, keep_alive):
+    # Page through products by id and send each page as a chunk of one JSON
+    # array, so memory stays flat however many products there are
+    writer.write(_head(200, "application/json", keep_alive))
+    try:
+        _chunk(writer, b"[")
+        after = None
+        first = True
+        while True:
+            rows, after = await AsyncProduct.get_products_page(STREAM_PAGE_SIZE, after)
+            if rows:
+                _chunk(writer, (b"" if first else b",") + b",".join(dumps(row._asdict()) for row in rows))
+                first = False
+                await writer.drain()
+            if after is None:
+                break
+        _chunk(writer, b"]")
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+    except ConnectionError:
+        raise
+    except Exception as e:
+        # The status line is already sent; dropping the connection is the
+        # only way left to tell the client the listing is incomplete
+        raise ConnectionAbortedError(str(e)) from e
+
+
+async def route(request, writer, keep_alive):
+    method, path, query = request.method, request.path, request.query
+    parts = path.strip("/").split("/")
+    if method == "GET" and path == "/health":
+        return 200, {"pool": get_async_pool().stats(), "cache": cache_stats()}
+    if method == "GET" and path == "/products/all":
+        await stream_products(writer, keep_alive)
+        return None
+    if method == "GET" and path == "/products":
+        if "sku" in query:
+            return await run_operation("product", {"sku": query["sku"]})
+        return await run_operation("search", query)
+    if method == "GET" and parts[0] == "products" and len(parts) == 2:
+        return await run_operation("product", {"id": parts[1]})
+    if method == "GET" and path == "/stock":
+        return await run_operation("stock", query)
+    if method == "GET" and parts[0] == "bills" and len(parts) == 2:
+        status, body = await run_operation("bill", {**query, "sale_id": parts[1]})
+        if status == 200 and query.get("format") in ("text", "html"):
+            return status, body, f"text/{'plain' if query['format'] == 'text' else 'html'}; charset=utf-8"
+        return status, body
+    if method == "POST" and path == "/checkout":
+        body = request.json()
+        if not isinstance(body, dict):
+            raise ApiError(400, "body must be a JSON object")
+        return await run_operation("checkout", body)
+    if method == "POST" and path == "/batch":
+        return 200, await op_batch(request.json())
+    if path in ("/health", "/products", "/stock", "/checkout", "/batch") or parts[0] in ("products", "bills"):
+        raise ApiError(405, f"{method} not allowed on {path}")
+    raise ApiError(404, f"no route for {path}")
+
+
+async def handle_connection(reader, writer):
+    try:
+        while True:
+            try:
+                request = await asyncio.wait_for(read_request(reader), KEEP_ALIVE_TIMEOUT)
+            except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+                break
+            except ApiError as e:
+                await send(writer, e.status, e.body, False)
+                break
+            if request is None:
+                break
+            keep_alive = request.keep_alive()
+            try:
+                result = await route(request, writer, keep_alive)
+            except ApiError as e:
+                result = e.status, e.body
+            except PoolTimeout as e:
+                result = 503, {"error": str(e)}
+            except ConnectionError:
+                raise
+            except Exception as e:
+                result = 500, {"error": str(e)}
+            if result is not None:
+                await send(writer, *result[:2], keep_alive, *result[2:])
+            if not keep_alive:
+                break
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+
+async def serve(host, port):
+    await get_async_pool().warm_up()
+    await _catalog()
+    server = await asyncio.start_server(handle_connection, host, port, backlog=1024)
+    print(f"Serving on http://{host}:{port}")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        await close_async_pool()
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="HTTP/JSON API for POS terminals")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    args = parser.parse_args(argv)
+    try:
+        asyncio.run(serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
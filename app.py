@@ -1,4 +1,5 @@
 import streamlit as st
+import numpy as np
 import psycopg2
 from datetime import datetime, date
 import sys
@@ -7,35 +8,91 @@ import os
 # Add the models directory to the path
 sys.path.append(os.path.join(os.path.dirname(__file__), '.'))
 
-from Database import conn
+from Database import get_connection, pool_stats, warm_up, warmup_enabled
 from customers import Customer
 from products import Product
 from sales import Sale
 from sales_items import SaleItem
+from migrations import migrate
+from billing import get_bill
+from cache import cache_stats, cached_query
+from catalog import get_catalog
+from analytics import get_analytics, moving_average
+from instrumentation import enabled as query_stats_enabled, set_page, snapshot
+from profiling import profiling_enabled, start_rerun
+
+PAGE_SIZE = 50
 
 # Initialize tables if they don't exist
 def initialize_tables():
     try:
+        if warmup_enabled():
+            warm_up()
         Customer.create_table()
         Product.create_table()
         Sale.create_table()
         SaleItem.create_table()
-        
-        # Fix sequences for all tables
-        cur = conn.cursor()
-        cur.execute("SELECT setval('customers_id_seq', (SELECT MAX(id) FROM customers))")
-        cur.execute("SELECT setval('products_id_seq', (SELECT MAX(id) FROM products))")
-        cur.execute("SELECT setval('sales_id_seq', (SELECT MAX(id) FROM sales))")
-        cur.execute("SELECT setval('sale_items_id_seq', (SELECT MAX(id) FROM sale_items))")
-        conn.commit()
-        cur.close()
-        
+        migrate()
+
         st.success("Database tables initialized successfully!")
     except Exception as e:
         st.error(f"Error initializing tables: {e}")
 
+# Fetch one keyset page of a listing and draw Previous/Next controls.
+# fetch(after) returns (rows, next_after); the cursors for the pages
+# already visited are kept in the session under key.
+def paged_rows(key, fetch):
+    state_key = f"{key}_cursors"
+    if state_key not in st.session_state:
+        st.session_state[state_key] = [None]
+    cursors = st.session_state[state_key]
+    rows, next_after = fetch(cursors[-1])
+    col1, col2, col3 = st.columns([1, 1, 6])
+    if len(cursors) > 1 and col1.button("Previous", key=f"{key}_prev"):
+        cursors.pop()
+        st.rerun()
+    if next_after is not None and col2.button("Next", key=f"{key}_next"):
+        cursors.append(next_after)
+        st.rerun()
+    col3.write(f"Page {len(cursors)}")
+    return rows
+
+# Page queries that don't belong to a model; cached until a write to one of
+# the tagged tables (or the cache TTL)
+@cached_query("customers", "products", "sales", "sale_items")
+def dashboard_counts():
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute('SELECT COUNT(*) FROM customers')
+        customer_count = cur.fetchone()[0]
+        cur.execute('SELECT COUNT(*) FROM products')
+        product_count = cur.fetchone()[0]
+        # Count sales (from the daily rollup)
+        cur.execute('SELECT COALESCE(SUM(sale_count), 0) FROM sales_daily')
+        sales_count = cur.fetchone()[0]
+        cur.close()
+    return customer_count, product_count, sales_count
+
+@cached_query("products")
+def low_stock_products(threshold=10):
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute('SELECT name, quantity FROM products WHERE quantity < %s ORDER BY quantity ASC', (threshold,))
+        rows = cur.fetchall()
+        cur.close()
+    return rows
+
 # App title and sidebar
 st.set_page_config(page_title="Smart Inventory and Billing System", layout="wide")
+
+# Opt-in rerun profiling (sidebar checkbox, or PROFILE_APP=1); mark() starts
+# the next timed section. See profiling.py.
+rerun_profile = start_rerun(enabled=st.session_state.get("profile_reruns", profiling_enabled()))
+def mark(section):
+    if rerun_profile is not None:
+        rerun_profile.mark(section)
+
+mark("Startup")
 st.title("🏪 Smart Inventory and Billing System")
 
 # Initialize tables on first run
@@ -49,6 +106,12 @@ menu_option = st.sidebar.selectbox(
     "Choose an option:",
     ["Dashboard", "Customer Management", "Product Management", "Sales Management", "Analytics & Reports"]
 )
+st.sidebar.checkbox("Profile reruns", value=profiling_enabled(), key="profile_reruns")
+# Queries run while drawing the page are attributed to it in the query stats
+set_page(menu_option)
+if rerun_profile is not None:
+    rerun_profile.label = menu_option
+mark(menu_option)
 
 # Dashboard
 if menu_option == "Dashboard":
@@ -58,43 +121,66 @@ if menu_option == "Dashboard":
     
     # Show some statistics
     try:
-        # Count customers
-        cur = conn.cursor()
-        cur.execute('SELECT COUNT(*) FROM customers')
-        customer_count = cur.fetchone()[0]
-        
-        # Count products
-        cur.execute('SELECT COUNT(*) FROM products')
-        product_count = cur.fetchone()[0]
-        
-        # Count sales
-        cur.execute('SELECT COUNT(*) FROM sales')
-        sales_count = cur.fetchone()[0]
-        
-        cur.close()
+        customer_count, product_count, sales_count = dashboard_counts()
         
         # Display metrics
         col1, col2, col3 = st.columns(3)
         col1.metric("Total Customers", customer_count)
         col2.metric("Total Products", product_count)
         col3.metric("Total Sales", sales_count)
-        
+
     except Exception as e:
         st.warning("Database statistics not available yet.")
 
+    # Connection pool metrics
+    with st.expander("Connection Pool"):
+        stats = pool_stats()
+        col1, col2, col3, col4 = st.columns(4)
+        col1.metric("In Use", f"{stats['in_use']} / {stats['max_size']}")
+        col2.metric("Idle", stats['idle'])
+        col3.metric("Waits", stats['waits'])
+        col4.metric("Avg Checkout", f"{stats['avg_checkout_ms']:.1f} ms")
+        st.write(f"Checkouts: {stats['checkouts']}, Timeouts: {stats['timeouts']}, "
+                 f"Reconnects: {stats['reconnects']}, Max Checkout: {stats['max_checkout_ms']:.1f} ms")
+
+    # Query cache metrics
+    with st.expander("Query Cache"):
+        stats = cache_stats()
+        lookups = stats['hits'] + stats['misses']
+        col1, col2, col3, col4 = st.columns(4)
+        col1.metric("Hit Rate", f"{stats['hits'] / lookups:.0%}" if lookups else "-")
+        col2.metric("Hits / Misses", f"{stats['hits']} / {stats['misses']}")
+        col3.metric("Entries", stats['entries'])
+        col4.metric("Size", f"{stats['bytes'] / 1024:.0f} / {stats['max_bytes'] / 1024:.0f} KB")
+        st.write(f"Backend: {stats['backend']}, Invalidated: {stats['invalidations']}, "
+                 f"Expired: {stats['expirations']}, Evicted: {stats['evictions']}")
+
+    # Slowest statements in this process, by total time
+    with st.expander("Query Stats"):
+        queries = snapshot()[:15]
+        if queries:
+            st.table([{"Caller": query['caller'], "Page": query['page'] or "", "Count": query['count'],
+                       "Total ms": f"{query['total_ms']:.1f}", "Avg ms": f"{query['avg_ms']:.2f}",
+                       "p95 ms": query['p95_ms'], "Max ms": f"{query['max_ms']:.1f}", "Rows": query['rows'],
+                       "SQL": query['sql'][:100]} for query in queries])
+        else:
+            st.write("No queries recorded yet.")
+
 # Customer Management
 elif menu_option == "Customer Management":
     st.header("👥 Customer Management")
     
     customer_action = st.radio("Select Action:", ["View All Customers", "Add New Customer", "Update Customer", "Delete Customer"])
+    mark(customer_action)
     
     if customer_action == "View All Customers":
         st.subheader("All Customers")
         try:
-            customers = Customer.get_all_customers()
+            sort_key = st.selectbox("Sort by", Customer.SORT_KEYS, key="customers_sort")
+            customers = paged_rows(f"customers_{sort_key}", lambda after: Customer.get_customers_page(PAGE_SIZE, after, sort_key))
             if customers:
-                for customer in customers:
-                    st.write(f"ID: {customer[0]}, Name: {customer[1]}, Contact: {customer[2]}")
+                st.table([{"ID": customer.id, "Name": customer.name, "Contact": customer.contact}
+                          for customer in customers])
             else:
                 st.info("No customers found.")
         except Exception as e:
@@ -110,13 +196,8 @@ elif menu_option == "Customer Management":
             if submitted:
                 if name and contact:
                     try:
-                        Customer.insert_customer(name, contact)
-                        st.success(f"Customer '{name}' added successfully!")
-                        # Refresh sequence
-                        cur = conn.cursor()
-                        cur.execute("SELECT setval('customers_id_seq', (SELECT MAX(id) FROM customers))")
-                        conn.commit()
-                        cur.close()
+                        customer_id = Customer.insert_customer(name, contact)
+                        st.success(f"Customer '{name}' added successfully with ID: {customer_id}")
                     except Exception as e:
                         st.error(f"Error adding customer: {e}")
                 else:
@@ -127,20 +208,17 @@ elif menu_option == "Customer Management":
         try:
             customers = Customer.get_all_customers()
             if customers:
-                customer_ids = [customer[0] for customer in customers]
-                selected_id = st.selectbox("Select Customer to Update", customer_ids)
+                customers_by_id = {customer.id: customer for customer in customers}
+                selected_id = st.selectbox("Select Customer to Update", list(customers_by_id))
                 
                 if selected_id:
-                    # Get current customer data
-                    cur = conn.cursor()
-                    cur.execute('SELECT * FROM customers WHERE id = %s', (selected_id,))
-                    customer = cur.fetchone()
-                    cur.close()
+                    # Current customer data comes from the list already loaded
+                    customer = customers_by_id.get(selected_id)
                     
                     if customer:
                         with st.form("update_customer_form"):
-                            name = st.text_input("Customer Name", value=customer[1])
-                            contact = st.text_input("Contact Information", value=customer[2])
+                            name = st.text_input("Customer Name", value=customer.name)
+                            contact = st.text_input("Contact Information", value=customer.contact)
                             submitted = st.form_submit_button("Update Customer")
                             
                             if submitted:
@@ -159,7 +237,7 @@ elif menu_option == "Customer Management":
         try:
             customers = Customer.get_all_customers()
             if customers:
-                customer_options = {f"{customer[1]} (ID: {customer[0]})": customer[0] for customer in customers}
+                customer_options = {f"{customer.name} (ID: {customer.id})": customer.id for customer in customers}
                 selected_customer = st.selectbox("Select Customer to Delete", list(customer_options.keys()))
                 
                 if st.button("Delete Customer"):
@@ -168,11 +246,6 @@ elif menu_option == "Customer Management":
                         try:
                             Customer.delete_customer(customer_id)
                             st.success(f"Customer '{selected_customer}' deleted successfully!")
-                            # Refresh sequence
-                            cur = conn.cursor()
-                            cur.execute("SELECT setval('customers_id_seq', (SELECT MAX(id) FROM customers))")
-                            conn.commit()
-                            cur.close()
                         except Exception as e:
                             st.error(f"Error deleting customer: {e}")
                     else:
@@ -187,14 +260,17 @@ elif menu_option == "Product Management":
     st.header("📦 Product Management")
     
     product_action = st.radio("Select Action:", ["View All Products", "Add New Product", "Update Product", "Delete Product"])
+    mark(product_action)
     
     if product_action == "View All Products":
         st.subheader("All Products")
         try:
-            products = Product.view_products()
+            sort_key = st.selectbox("Sort by", Product.SORT_KEYS, key="products_sort")
+            products = paged_rows(f"products_{sort_key}", lambda after: Product.get_products_page(PAGE_SIZE, after, sort_key))
             if products:
-                for product in products:
-                    st.write(f"ID: {product[0]}, Name: {product[1]}, Description: {product[2]}, Price: ${product[3]}, Quantity: {product[4]}")
+                st.table([{"ID": product.id, "Name": product.name, "Description": product.description,
+                           "Price": f"${product.price}", "Quantity": product.quantity}
+                          for product in products])
             else:
                 st.info("No products found.")
         except Exception as e:
@@ -212,13 +288,8 @@ elif menu_option == "Product Management":
             if submitted:
                 if name and price >= 0 and quantity >= 0:
                     try:
-                        Product.insert_product(name, description, price, quantity)
-                        st.success(f"Product '{name}' added successfully!")
-                        # Refresh sequence
-                        cur = conn.cursor()
-                        cur.execute("SELECT setval('products_id_seq', (SELECT MAX(id) FROM products))")
-                        conn.commit()
-                        cur.close()
+                        product_id = Product.insert_product(name, description, price, quantity)
+                        st.success(f"Product '{name}' added successfully with ID: {product_id}")
                     except Exception as e:
                         st.error(f"Error adding product: {e}")
                 else:
@@ -227,26 +298,33 @@ elif menu_option == "Product Management":
     elif product_action == "Update Product":
         st.subheader("Update Product")
         try:
-            products = Product.view_products()
-            if products:
-                product_ids = [product[0] for product in products]
-                selected_id = st.selectbox("Select Product to Update", product_ids)
+            # Pick the product from the in-memory catalog
+            catalog = get_catalog()
+            if len(catalog):
+                search = st.text_input("Search Product (name, SKU or ID)", key="update_product_search")
+                matches = catalog.search(search, limit=50)
+                product_ids = {f"{entry.name} (ID: {entry.id})": entry.id for entry in matches}
+                selected_product = st.selectbox("Select Product to Update", list(product_ids.keys()))
+                if not matches:
+                    st.info("No products match your search.")
                 
-                if selected_id:
+                if selected_product:
+                    selected_id = product_ids[selected_product]
                     # Get current product data
                     product = Product.view_product_id(selected_id)
                     
                     if product:
                         with st.form("update_product_form"):
-                            name = st.text_input("Product Name", value=product[1])
-                            description = st.text_area("Description", value=product[2])
-                            price = st.number_input("Price", min_value=0.0, step=0.01, value=float(product[3]))
-                            quantity = st.number_input("Quantity", min_value=0, step=1, value=int(product[4]))
+                            name = st.text_input("Product Name", value=product.name)
+                            description = st.text_area("Description", value=product.description)
+                            price = st.number_input("Price", min_value=0.0, step=0.01, value=float(product.price))
+                            quantity = st.number_input("Quantity", min_value=0, step=1, value=int(product.quantity))
                             submitted = st.form_submit_button("Update Product")
                             
                             if submitted:
                                 try:
                                     Product.update_product(selected_id, name, description, price, quantity)
+                                    catalog.refresh(force=True)
                                     st.success(f"Product '{name}' updated successfully!")
                                 except Exception as e:
                                     st.error(f"Error updating product: {e}")
@@ -258,22 +336,23 @@ elif menu_option == "Product Management":
     elif product_action == "Delete Product":
         st.subheader("Delete Product")
         try:
-            products = Product.view_products()
-            if products:
-                product_options = {f"{product[1]} (ID: {product[0]})": product[0] for product in products}
+            # Pick the product from the in-memory catalog
+            catalog = get_catalog()
+            if len(catalog):
+                search = st.text_input("Search Product (name, SKU or ID)", key="delete_product_search")
+                matches = catalog.search(search, limit=50)
+                product_options = {f"{entry.name} (ID: {entry.id})": entry.id for entry in matches}
                 selected_product = st.selectbox("Select Product to Delete", list(product_options.keys()))
+                if not matches:
+                    st.info("No products match your search.")
                 
                 if st.button("Delete Product"):
                     if selected_product:
                         product_id = product_options[selected_product]
                         try:
                             Product.delete_product(product_id)
+                            catalog.refresh(force=True)
                             st.success(f"Product '{selected_product}' deleted successfully!")
-                            # Refresh sequence
-                            cur = conn.cursor()
-                            cur.execute("SELECT setval('products_id_seq', (SELECT MAX(id) FROM products))")
-                            conn.commit()
-                            cur.close()
                         except Exception as e:
                             st.error(f"Error deleting product: {e}")
                     else:
@@ -288,6 +367,7 @@ elif menu_option == "Sales Management":
     st.header("💰 Sales Management")
     
     sales_action = st.radio("Select Action:", ["Create New Sale", "View All Sales", "Generate Bill"])
+    mark(sales_action)
     
     if sales_action == "Create New Sale":
         st.subheader("Create New Sale")
@@ -296,109 +376,75 @@ elif menu_option == "Sales Management":
         try:
             customers = Customer.get_all_customers()
             if customers:
-                customer_dict = {f"{customer[1]} (ID: {customer[0]})": customer[0] for customer in customers}
+                customer_dict = {f"{customer.name} (ID: {customer.id})": customer.id for customer in customers}
                 selected_customer = st.selectbox("Select Customer", list(customer_dict.keys()))
                 
                 if selected_customer:
                     customer_id = customer_dict[selected_customer]
                     
-                    # Create sale form
-                    with st.form("create_sale_form"):
-                        sale_date = st.date_input("Sale Date", date.today())
-                        submitted = st.form_submit_button("Create Sale")
-                        
-                        if submitted:
-                            try:
-                                # Insert sale
-                                cur = conn.cursor()
-                                cur.execute('''INSERT INTO sales (customer_id, date, total_amount)
-                                               VALUES (%s, %s, %s) RETURNING id''',
-                                            (customer_id, sale_date, 0.0))
-                                sale_id = cur.fetchone()[0]
-                                conn.commit()
-                                cur.close()
-                                
-                                # Refresh sequence
-                                cur = conn.cursor()
-                                cur.execute("SELECT setval('sales_id_seq', (SELECT MAX(id) FROM sales))")
-                                conn.commit()
-                                cur.close()
-                                
-                                st.success(f"Sale created successfully with ID: {sale_id}")
-                                st.session_state.new_sale_id = sale_id
-                            except Exception as e:
-                                st.error(f"Error creating sale: {e}")
-                                
-                    # Add items to sale
-                    if 'new_sale_id' in st.session_state:
-                        st.markdown("---")
-                        st.subheader("Add Items to Sale")
-                        
-                        # Get products for selection
-                        products = Product.view_products()
-                        if products:
-                            product_dict = {f"{product[1]} (ID: {product[0]})": product[0] for product in products}
-                            selected_product = st.selectbox("Select Product", list(product_dict.keys()))
-                            
-                            if selected_product:
-                                product_id = product_dict[selected_product]
-                                
-                                # Get product details for price
-                                product_details = Product.view_product_id(product_id)
-                                if product_details:
-                                    default_price = float(product_details[3])  # price
-                                    default_quantity = 1
-                                    
-                                    with st.form("add_item_form"):
-                                        quantity = st.number_input("Quantity", min_value=1, value=default_quantity)
-                                        price = st.number_input("Price per Item", min_value=0.0, value=default_price, step=0.01)
-                                        submitted_item = st.form_submit_button("Add Item to Sale")
-                                        
-                                        if submitted_item:
-                                            try:
-                                                # Add item to sale
-                                                cur = conn.cursor()
-                                                cur.execute('''INSERT INTO sale_items (sale_id, product_id, quantity, price)
-                                                               VALUES (%s, %s, %s, %s)''',
-                                                            (st.session_state.new_sale_id, product_id, quantity, price))
-                                                conn.commit()
-                                                cur.close()
-                                                
-                                                # Refresh sequence
-                                                cur = conn.cursor()
-                                                cur.execute("SELECT setval('sale_items_id_seq', (SELECT MAX(id) FROM sale_items))")
-                                                conn.commit()
-                                                cur.close()
-                                                
-                                                # Update product quantity
-                                                new_quantity = product_details[4] - quantity
-                                                Product.update_product(product_id, quantity=new_quantity)
-                                                
-                                                st.success("Item added to sale successfully!")
-                                            except Exception as e:
-                                                st.error(f"Error adding item to sale: {e}")
-                                            
-                                    # Option to finish sale
-                                    if st.button("Finish Sale"):
-                                        try:
-                                            # Calculate total amount
-                                            cur = conn.cursor()
-                                            cur.execute('SELECT SUM(quantity * price) FROM sale_items WHERE sale_id = %s', 
-                                                       (st.session_state.new_sale_id,))
-                                            total_amount = cur.fetchone()[0] or 0.0
-                                            
-                                            # Update sale with total amount
-                                            cur.execute('UPDATE sales SET total_amount = %s WHERE id = %s',
-                                                       (total_amount, st.session_state.new_sale_id))
-                                            conn.commit()
-                                            cur.close()
-                                            
-                                            st.success(f"Sale completed! Total amount: ${total_amount:.2f}")
-                                            del st.session_state.new_sale_id
-                                        except Exception as e:
-                                            st.error(f"Error finalizing sale: {e}")
-                        else:
-                            st.info("No products available. Please add products first.")
+                    sale_date = st.date_input("Sale Date", date.today())
+
+                    # The cart lives in the session; nothing is written until checkout
+                    if 'cart' not in st.session_state:
+                        st.session_state.cart = []
+
+                    st.markdown("---")
+                    st.subheader("Add Items to Sale")
+
+                    # Get products for selection from the in-memory catalog
+                    mark("Create New Sale: product search")
+                    catalog = get_catalog()
+                    if len(catalog):
+                        search = st.text_input("Search Product (name, SKU or ID)", key="product_search")
+                        matches = catalog.search(search, limit=50)
+                        product_dict = {f"{entry.name} (ID: {entry.id})": entry for entry in matches}
+                        selected_product = st.selectbox("Select Product", list(product_dict.keys()))
+                        if not matches:
+                            st.info("No products match your search.")
+
+                        if selected_product:
+                            product_details = product_dict[selected_product]
+                            default_price = float(product_details.price)
+                            default_quantity = 1
+
+                            with st.form("add_item_form"):
+                                st.write(f"In stock: {product_details.quantity}")
+                                quantity = st.number_input("Quantity", min_value=1, value=default_quantity)
+                                price = st.number_input("Price per Item", min_value=0.0, value=default_price, step=0.01)
+                                submitted_item = st.form_submit_button("Add Item to Sale")
+
+                                if submitted_item:
+                                    st.session_state.cart.append({"product_id": product_details.id,
+                                                                  "name": product_details.name,
+                                                                  "quantity": int(quantity),
+                                                                  "price": price})
+                                    st.success("Item added to cart.")
+
+                        mark("Create New Sale: cart")
+                        if st.session_state.cart:
+                            st.table([{"Product": line["name"], "Quantity": line["quantity"],
+                                       "Price": f"${line['price']:.2f}",
+                                       "Total": f"${line['quantity'] * line['price']:.2f}"}
+                                      for line in st.session_state.cart])
+
+                            col1, col2 = st.columns(2)
+                            # Option to finish sale
+                            if col1.button("Finish Sale"):
+                                try:
+                                    sale_id, total_amount = Sale.checkout(
+                                        customer_id,
+                                        [(line["product_id"], line["quantity"], line["price"])
+                                         for line in st.session_state.cart],
+                                        sale_date)
+                                    st.session_state.cart = []
+                                    st.success(f"Sale {sale_id} completed! Total amount: ${total_amount:.2f}")
+                                except Exception as e:
+                                    st.error(f"Error finalizing sale: {e}")
+                            if col2.button("Clear Cart"):
+                                st.session_state.cart = []
+                                st.rerun()
+                    else:
+                        st.info("No products available. Please add products first.")
                 else:
                     st.info("Please select a customer.")
             else:
@@ -409,16 +455,12 @@ elif menu_option == "Sales Management":
     elif sales_action == "View All Sales":
         st.subheader("All Sales")
         try:
-            cur = conn.cursor()
-            cur.execute('''SELECT s.id, c.name, s.date, s.total_amount 
-                          FROM sales s JOIN customers c ON s.customer_id = c.id 
-                          ORDER BY s.date DESC''')
-            sales = cur.fetchall()
-            cur.close()
-            
+            sort_key = st.selectbox("Sort by", Sale.SORT_KEYS, index=Sale.SORT_KEYS.index("date"), key="sales_sort")
+            sales = paged_rows(f"sales_{sort_key}", lambda after: Sale.get_sales_page(PAGE_SIZE, after, sort_key, True))
             if sales:
-                for sale in sales:
-                    st.write(f"Sale ID: {sale[0]}, Customer: {sale[1]}, Date: {sale[2]}, Total: ${sale[3]:.2f}")
+                st.table([{"Sale ID": sale.id, "Customer": sale.customer, "Date": str(sale.date),
+                           "Total": f"${sale.total_amount:.2f}"}
+                          for sale in sales])
             else:
                 st.info("No sales found.")
         except Exception as e:
@@ -427,50 +469,26 @@ elif menu_option == "Sales Management":
     elif sales_action == "Generate Bill":
         st.subheader("Generate Bill")
         try:
-            # Get sales for selection
-            cur = conn.cursor()
-            cur.execute('SELECT id FROM sales ORDER BY id DESC')
-            sales = cur.fetchall()
-            cur.close()
+            # Sales for selection, newest first, one page at a time
+            sales = paged_rows("bill_sales", lambda after: Sale.get_sales_page(PAGE_SIZE, after, "id", True))
             
             if sales:
-                sale_ids = [sale[0] for sale in sales]
-                selected_sale_id = st.selectbox("Select Sale ID", sale_ids)
+                sale_options = {f"{sale.id} - {sale.customer} ({sale.date})": sale.id for sale in sales}
+                selected_sale_id = sale_options[st.selectbox("Select Sale ID", list(sale_options.keys()))]
                 
                 if st.button("Generate Bill"):
                     try:
-                        # Get sale details
-                        cur = conn.cursor()
-                        cur.execute('''SELECT s.id, c.name, s.date, s.total_amount 
-                                      FROM sales s JOIN customers c ON s.customer_id = c.id 
-                                      WHERE s.id = %s''', (selected_sale_id,))
-                        sale = cur.fetchone()
-                        
-                        if sale:
-                            st.markdown("---")
-                            st.subheader("BILL")
-                            st.write(f"Sale ID: {sale[0]}")
-                            st.write(f"Customer: {sale[1]}")
-                            st.write(f"Date: {sale[2]}")
+                        bill = get_bill(selected_sale_id)
+                        if bill:
                             st.markdown("---")
-                            
-                            # Get sale items
-                            cur.execute('''SELECT p.name, si.quantity, si.price, (si.quantity * si.price) as total
-                                          FROM sale_items si JOIN products p ON si.product_id = p.id
-                                          WHERE si.sale_id = %s''', (selected_sale_id,))
-                            items = cur.fetchall()
-                            
-                            if items:
-                                for item in items:
-                                    st.write(f"{item[0]} - Qty: {item[1]}, Price: ${item[2]:.2f}, Total: ${item[3]:.2f}")
-                                
-                                st.markdown("---")
-                                st.write(f"**TOTAL AMOUNT: ${sale[3]:.2f}**")
+                            if bill["lines"]:
+                                st.markdown(bill["html"], unsafe_allow_html=True)
+                                st.download_button("Download Bill", bill["html"],
+                                                   file_name=f"bill_{bill['sale_id']}.html", mime="text/html")
                             else:
                                 st.info("No items found for this sale.")
                         else:
                             st.warning("Sale not found.")
-                        cur.close()
                     except Exception as e:
                         st.error(f"Error generating bill: {e}")
             else:
@@ -483,45 +501,49 @@ elif menu_option == "Analytics & Reports":
     st.header("📈 Analytics & Reports")
     
     analytics_action = st.radio("Select Report:", ["Sales Summary", "Sales by Date Range", "Top Selling Products", "Low Stock Alert", "Customer Purchase History"])
+    mark(analytics_action)
     
     # Sales Summary
     if analytics_action == "Sales Summary":
         st.subheader("Sales Summary")
         try:
-            # Get total sales
-            cur = conn.cursor()
-            cur.execute('SELECT COUNT(*), SUM(total_amount) FROM sales')
-            result = cur.fetchone()
-            total_sales = result[0] or 0
-            total_revenue = result[1] or 0.0
-            
+            # Totals and the trend come from the daily rollup
+            total_sales, total_revenue, items_sold = Sale.get_sales_summary()
+
             # Display metrics
-            col1, col2 = st.columns(2)
+            col1, col2, col3 = st.columns(3)
             col1.metric("Total Sales", total_sales)
             col2.metric("Total Revenue", f"${total_revenue:.2f}")
-            
-            # Sales by date
-            cur.execute('''SELECT date, SUM(total_amount) as daily_total
-                          FROM sales 
-                          GROUP BY date 
-                          ORDER BY date''')
-            sales_data = cur.fetchall()
-            cur.close()
-            
+            col3.metric("Items Sold", items_sold)
+
+            # Daily trend from the same rollup as the totals above
+            sales_data = Sale.get_daily_sales()
+
             if sales_data:
-                # Prepare data for chart
-                dates = [str(row[0]) for row in sales_data]
-                amounts = [float(row[1]) for row in sales_data]
-                
-                # Create bar chart
+                # Every calendar day in the range, zero on days without sales
+                first = sales_data[0].day
+                days = np.arange(np.datetime64(first, "D"), np.datetime64(sales_data[-1].day, "D") + 1)
+                revenue = np.zeros(len(days))
+                for row in sales_data:
+                    revenue[(row.day - first).days] = float(row.revenue)
+
                 st.write("Daily Sales Trend")
-                st.line_chart(dict(zip(dates, amounts)))
+                st.line_chart({"Day": days, "Revenue": revenue, "7-day average": moving_average(revenue, 7)}, x="Day")
+
+                # Basket sizes need the columnar extract (analytics.py), which
+                # is only loaded when asked for
+                if st.checkbox("Show basket sizes", key="basket_sizes"):
+                    baskets = get_analytics().basket_sizes()
+                    if len(baskets["size"]):
+                        st.write(f"Basket Size (lines per sale: mean {baskets['mean']:.1f}, "
+                                 f"median {baskets['median']:.0f}, 90th percentile {baskets['p90']:.0f})")
+                        st.bar_chart({"Lines": baskets["size"], "Sales": baskets["sales"]}, x="Lines")
             else:
                 st.info("No sales data available for chart.")
-                
+
         except Exception as e:
             st.error(f"Error generating sales summary: {e}")
-    
+
     # Sales by Date Range
     elif analytics_action == "Sales by Date Range":
         st.subheader("Sales by Date Range")
@@ -532,61 +554,47 @@ elif menu_option == "Analytics & Reports":
                 start_date = st.date_input("Start Date", date.today())
             with col2:
                 end_date = st.date_input("End Date", date.today())
-            
-            if st.button("Get Sales Report"):
-                if start_date <= end_date:
-                    cur = conn.cursor()
-                    cur.execute('''SELECT s.id, c.name, s.date, s.total_amount 
-                                  FROM sales s JOIN customers c ON s.customer_id = c.id 
-                                  WHERE s.date BETWEEN %s AND %s
-                                  ORDER BY s.date DESC''', (start_date, end_date))
-                    sales_data = cur.fetchall()
-                    cur.close()
-                    
-                    if sales_data:
-                        # Display sales in table
-                        st.write(f"Sales from {start_date} to {end_date}:")
-                        sales_df = [{"Sale ID": row[0], "Customer": row[1], "Date": str(row[2]), "Amount": float(row[3])} 
-                                   for row in sales_data]
-                        st.table(sales_df)
-                        
-                        # Calculate totals
-                        total_sales_count = len(sales_data)
-                        total_amount = sum([float(row[3]) for row in sales_data])
-                        
-                        # Display metrics
-                        col1, col2 = st.columns(2)
-                        col1.metric("Total Sales", total_sales_count)
-                        col2.metric("Total Revenue", f"${total_amount:.2f}")
-                    else:
-                        st.info("No sales found for the selected date range.")
+
+            if start_date <= end_date:
+                # Totals from the daily rollup; the sales themselves one page at a time
+                total_sales_count, total_amount, _ = Sale.get_sales_summary(start_date, end_date)
+                col1, col2 = st.columns(2)
+                col1.metric("Total Sales", total_sales_count)
+                col2.metric("Total Revenue", f"${total_amount:.2f}")
+
+                sales_data = paged_rows(f"range_{start_date}_{end_date}",
+                                        lambda after: Sale.get_sales_page(PAGE_SIZE, after, "date", True,
+                                                                          start_date, end_date))
+                if sales_data:
+                    # Display sales in table
+                    st.write(f"Sales from {start_date} to {end_date}:")
+                    sales_df = [{"Sale ID": row.id, "Customer": row.customer, "Date": str(row.date), "Amount": float(row.total_amount)}
+                               for row in sales_data]
+                    st.table(sales_df)
                 else:
-                    st.warning("End date must be after start date.")
+                    st.info("No sales found for the selected date range.")
+            else:
+                st.warning("End date must be after start date.")
         except Exception as e:
             st.error(f"Error retrieving sales data: {e}")
-    
+
     # Top Selling Products
     elif analytics_action == "Top Selling Products":
         st.subheader("Top Selling Products")
+        windows = {"All time": None, "Today": "today", "Last 7 days": "7d", "Last 30 days": "30d"}
+        window = st.radio("Period", list(windows), horizontal=True)
         try:
-            # Get top selling products
-            cur = conn.cursor()
-            cur.execute('''SELECT p.name, SUM(si.quantity) as total_quantity
-                          FROM sale_items si 
-                          JOIN products p ON si.product_id = p.id
-                          GROUP BY p.name, p.id
-                          ORDER BY total_quantity DESC
-                          LIMIT 10''')
-            top_products = cur.fetchall()
-            cur.close()
+            # Read the maintained per-product counters
+            top_products = Sale.get_top_selling_products(limit=10, window=windows[window])
             
             if top_products:
                 for product in top_products:
-                    st.write(f"{product[0]}: {product[1]} units sold")
+                    name = product.name or f"Product #{product.product_id}"
+                    st.write(f"{name}: {product.units_sold} units sold (${product.revenue:.2f})")
                 
                 # Create bar chart
-                product_names = [row[0] for row in top_products]
-                quantities = [int(row[1]) for row in top_products]
+                product_names = [row.name or f"Product #{row.product_id}" for row in top_products]
+                quantities = [int(row.units_sold) for row in top_products]
                 
                 st.bar_chart(dict(zip(product_names, quantities)))
             else:
@@ -598,10 +606,7 @@ elif menu_option == "Analytics & Reports":
     elif analytics_action == "Low Stock Alert":
         st.subheader("Low Stock Alert")
         try:
-            cur = conn.cursor()
-            cur.execute('SELECT name, quantity FROM products WHERE quantity < 10 ORDER BY quantity ASC')
-            low_stock = cur.fetchall()
-            cur.close()
+            low_stock = low_stock_products()
             
             if low_stock:
                 for item in low_stock:
@@ -617,30 +622,57 @@ elif menu_option == "Analytics & Reports":
         try:
             customers = Customer.get_all_customers()
             if customers:
-                customer_dict = {f"{customer[1]}": customer[0] for customer in customers}
+                customer_dict = {f"{customer.name}": customer.id for customer in customers}
                 selected_customer = st.selectbox("Select Customer", list(customer_dict.keys()), key="analytics_customer")
                 
                 if selected_customer:
                     customer_id = customer_dict[selected_customer]
-                    cur = conn.cursor()
-                    cur.execute('''SELECT s.id, s.date, s.total_amount 
-                                  FROM sales s 
-                                  WHERE s.customer_id = %s 
-                                  ORDER BY s.date DESC''', (customer_id,))
-                    customer_sales = cur.fetchall()
-                    cur.close()
-                    
+                    col1, col2 = st.columns(2)
+                    start_date = col1.date_input("From", value=None, key="history_start")
+                    end_date = col2.date_input("To", value=None, key="history_end")
+
+                    # Sales and their items come back together, one page at a time
+                    statement = {}
+                    def fetch_statement(after):
+                        statement.update(Sale.get_customer_statement(customer_id, start_date, end_date,
+                                                                     PAGE_SIZE, after))
+                        return statement["sales"], statement["next_after"]
+                    customer_sales = paged_rows(f"history_{customer_id}_{start_date}_{end_date}", fetch_statement)
+
                     if customer_sales:
-                        st.table({"Sale ID": [row[0] for row in customer_sales],
-                                 "Date": [str(row[1]) for row in customer_sales],
-                                 "Amount": [float(row[2]) for row in customer_sales]})
-                        
-                        # Calculate total purchases
-                        total_purchases = sum([float(row[2]) for row in customer_sales])
-                        st.metric("Total Purchases by Customer", f"${total_purchases:.2f}")
+                        st.table([{"Sale ID": sale["sale_id"], "Date": str(sale["date"]),
+                                   "Items": len(sale["lines"]), "Amount": float(sale["total_amount"])}
+                                  for sale in customer_sales])
+                        for sale in customer_sales:
+                            with st.expander(f"Sale {sale['sale_id']} - {sale['date']}"):
+                                st.table([{"Product": line["product"], "Quantity": line["quantity"],
+                                           "Price": f"${line['price']:.2f}", "Total": f"${line['total']:.2f}"}
+                                          for line in sale["lines"]])
+
+                        col1, col2 = st.columns(2)
+                        col1.metric("Number of Purchases", statement["sale_count"])
+                        col2.metric("Total Purchases by Customer", f"${statement['total_spent']:.2f}")
                     else:
                         st.info("This customer has no purchase history.")
             else:
                 st.info("No customers available.")
         except Exception as e:
             st.error(f"Error retrieving customer purchase history: {e}")
+
+# Rerun profile: where this rerun's time went, section by section
+if rerun_profile is not None:
+    rerun_profile.finish()
+    dump_path = rerun_profile.dump()
+    with st.sidebar.expander("Rerun Profile", expanded=True):
+        st.table([{"Section": row["section"], "Total ms": f"{row['wall_ms']:.1f}", "DB ms": f"{row['db_ms']:.1f}",
+                   "Queries": row["queries"], "Python ms": f"{row['python_ms']:.1f}",
+                   "Render ms": f"{row['render_ms']:.1f}"} for row in rerun_profile.breakdown()])
+        if not query_stats_enabled():
+            st.caption("DB time needs query instrumentation (QUERY_STATS=1).")
+        st.write("Slowest functions (self time)")
+        st.table([{"Function": name, "Calls": calls, "Self ms": f"{self_ms:.1f}", "Cumulative ms": f"{cumulative_ms:.1f}"}
+                  for name, calls, self_ms, cumulative_ms in rerun_profile.top_functions(10)])
+        st.download_button("Download .prof", rerun_profile.dump_bytes(), file_name="rerun.prof",
+                           mime="application/octet-stream")
+        if dump_path:
+            st.caption(f"Saved to {dump_path}")
@@ -0,0 +1,285 @@
+# asyncio access to the database.
+# Uses psycopg2's asynchronous connections, waiting on the socket through the
+# event loop, so queries take the same %s parameters and return the same
+# Python types (Decimal, date, records) as the blocking code in Database.py.
+# Async connections are in autocommit mode: wrap multi-statement writes in
+# `async with conn.transaction():`.
+#
+#   async with acquire() as conn:
+#       rows = await conn.fetchall('SELECT ...', params, record=ProductRecord)
+
+import asyncio
+import collections
+import threading
+import time
+import weakref
+from contextlib import asynccontextmanager
+
+import psycopg2
+from psycopg2 import extensions
+
+import instrumentation
+from Database import PoolError, PoolTimeout, connect_params, settings
+from records import RecordCursor
+
+
+async def _wait(raw):
+    # Drive an async connection until its current operation completes
+    loop = asyncio.get_running_loop()
+    while True:
+        state = raw.poll()
+        if state == extensions.POLL_OK:
+            return
+        ready = loop.create_future()
+        fd = raw.fileno()
+        if state == extensions.POLL_READ:
+            loop.add_reader(fd, ready.set_result, None)
+            try:
+                await ready
+            finally:
+                loop.remove_reader(fd)
+        elif state == extensions.POLL_WRITE:
+            loop.add_writer(fd, ready.set_result, None)
+            try:
+                await ready
+            finally:
+                loop.remove_writer(fd)
+        else:
+            raise psycopg2.OperationalError(f"unexpected poll state {state}")
+
+
+class AsyncConnection:
+    def __init__(self, raw):
+        self.raw = raw
+
+    @property
+    def closed(self):
+        return self.raw.closed
+
+    async def execute(self, query, params=None, record=None):
+        # Returns the cursor, ready to fetch from
+        cur = self.raw.cursor(cursor_factory=RecordCursor)
+        cur.record = record
+        start = time.perf_counter()
+        failed = True
+        try:
+            cur.execute(query, params)
+            await _wait(self.raw)
+            failed = False
+        finally:
+            if instrumentation.enabled():
+                instrumentation.observe(query, time.perf_counter() - start, cur.rowcount, failed)
+        return cur
+
+    async def fetchone(self, query, params=None, record=None):
+        cur = await self.execute(query, params, record)
+        row = cur.fetchone()
+        cur.close()
+        return row
+
+    async def fetchall(self, query, params=None, record=None):
+        cur = await self.execute(query, params, record)
+        rows = cur.fetchall()
+        cur.close()
+        return rows
+
+    async def fetchval(self, query, params=None):
+        row = await self.fetchone(query, params)
+        return row[0] if row is not None else None
+
+    def in_transaction(self):
+        return self.raw.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE
+
+    @asynccontextmanager
+    async def transaction(self):
+        # Commits when the block exits normally, rolls back otherwise
+        (await self.execute('BEGIN')).close()
+        try:
+            yield self
+        except BaseException:
+            if not self.raw.closed and not self.raw.isexecuting():
+                (await self.execute('ROLLBACK')).close()
+            raise
+        (await self.execute('COMMIT')).close()
+
+    async def close(self):
+        self.raw.close()
+
+
+async def connect():
+    raw = psycopg2.connect(**connect_params(), async_=1)
+    await _wait(raw)
+    return AsyncConnection(raw)
+
+
+class AsyncConnectionPool:
+    # The asyncio counterpart of Database.ConnectionPool. Belongs to the event
+    # loop it was first used on.
+    def __init__(self, min_size=1, max_size=10, timeout=30, health_check_interval=30):
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.health_check_interval = health_check_interval
+        self._cond = asyncio.Condition()
+        self._idle = collections.deque()   # (connection, last_used) pairs
+        self._size = 0
+        self._in_use = 0
+        self._closed = False
+        self._checkouts = 0
+        self._waits = 0
+        self._timeouts = 0
+        self._reconnects = 0
+        self._checkout_time = 0.0
+        self._max_checkout_time = 0.0
+
+    async def warm_up(self):
+        while True:
+            async with self._cond:
+                if self._closed or self._size >= self.min_size:
+                    return
+                self._size += 1
+            try:
+                con = await connect()
+            except Exception:
+                async with self._cond:
+                    self._size -= 1
+                raise
+            async with self._cond:
+                self._idle.append((con, time.monotonic()))
+                self._cond.notify()
+
+    async def _is_healthy(self, con, last_used):
+        if con.closed or con.in_transaction():
+            return False
+        if time.monotonic() - last_used < self.health_check_interval:
+            return True
+        try:
+            await con.fetchone('SELECT 1')
+            return True
+        except psycopg2.Error:
+            return False
+
+    async def getconn(self):
+        start = time.monotonic()
+        async with self._cond:
+            if self._closed:
+                raise PoolError("connection pool is closed")
+            if not self._idle and self._size >= self.max_size:
+                self._waits += 1
+                try:
+                    await asyncio.wait_for(
+                        self._cond.wait_for(lambda: self._closed or self._idle or self._size < self.max_size),
+                        self.timeout)
+                except asyncio.TimeoutError:
+                    self._timeouts += 1
+                    raise PoolTimeout(f"no connection available after {self.timeout}s") from None
+                if self._closed:
+                    raise PoolError("connection pool is closed")
+            if self._idle:
+                con, last_used = self._idle.pop()
+            else:
+                con, last_used = None, None
+                self._size += 1   # reserve the slot before connecting
+            self._in_use += 1
+
+        try:
+            if con is None:
+                con = await connect()
+            elif not await self._is_healthy(con, last_used):
+                await con.close()
+                con = await connect()
+                self._reconnects += 1
+        except BaseException:
+            async with self._cond:
+                self._size -= 1
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+
+        elapsed = time.monotonic() - start
+        self._checkouts += 1
+        self._checkout_time += elapsed
+        self._max_checkout_time = max(self._max_checkout_time, elapsed)
+        return con
+
+    async def putconn(self, con, close=False):
+        if not con.closed and not close:
+            if con.raw.isexecuting():
+                # Cancelled mid-query; the connection can't be reused
+                close = True
+            elif con.in_transaction():
+                try:
+                    (await con.execute('ROLLBACK')).close()
+                except psycopg2.Error:
+                    close = True
+        async with self._cond:
+            self._in_use -= 1
+            if con.closed or close or self._closed:
+                self._size -= 1
+                await con.close()
+            else:
+                self._idle.append((con, time.monotonic()))
+            self._cond.notify()
+
+    async def closeall(self):
+        async with self._cond:
+            self._closed = True
+            for con, _ in self._idle:
+                await con.close()
+            self._size -= len(self._idle)
+            self._idle.clear()
+            self._cond.notify_all()
+
+    def stats(self):
+        return {
+            "size": self._size,
+            "in_use": self._in_use,
+            "idle": len(self._idle),
+            "max_size": self.max_size,
+            "checkouts": self._checkouts,
+            "waits": self._waits,
+            "timeouts": self._timeouts,
+            "reconnects": self._reconnects,
+            "avg_checkout_ms": (self._checkout_time / self._checkouts * 1000) if self._checkouts else 0.0,
+            "max_checkout_ms": self._max_checkout_time * 1000,
+        }
+
+
+_pools = weakref.WeakKeyDictionary()    # event loop -> pool
+_pools_lock = threading.Lock()
+
+
+def get_async_pool():
+    loop = asyncio.get_running_loop()
+    with _pools_lock:
+        pool = _pools.get(loop)
+        if pool is None:
+            opts = settings["pool"]
+            pool = AsyncConnectionPool(
+                min_size=int(opts["min_size"]),
+                max_size=int(opts["max_size"]),
+                timeout=float(opts["checkout_timeout"]),
+                health_check_interval=float(opts["health_check_interval"]),
+            )
+            _pools[loop] = pool
+    return pool
+
+
+async def close_async_pool():
+    # Call before the event loop shuts down
+    with _pools_lock:
+        pool = _pools.pop(asyncio.get_running_loop(), None)
+    if pool is not None:
+        await pool.closeall()
+
+
+@asynccontextmanager
+async def acquire():
+    # Borrow a pooled async connection for the duration of an async with-block.
+    # An open transaction is rolled back when the block exits.
+    pool = get_async_pool()
+    con = await pool.getconn()
+    try:
+        yield con
+    finally:
+        await pool.putconn(con)
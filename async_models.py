@@ -0,0 +1,243 @@
+# asyncio variants of the Customer, Product, Sale and SaleItem operations.
+# Each method mirrors the blocking method of the same name but runs on an
+# async pooled connection, so concurrent tills and report queries overlap
+# instead of each holding a thread. Both layers execute the statements in
+# queries.py, read through the same @cached_query tags and invalidate the
+# same tags, so they return equally fresh data.
+#
+#   sale_id, total = await AsyncSale.checkout(customer_id, [(product_id, 2)])
+
+import asyncio
+from datetime import date as date_type
+
+from async_db import acquire
+from billing import invalidate_bill
+from cache import cached_query, invalidate
+from customers import Customer
+from pagination import DEFAULT_PAGE_SIZE, check_sort_key, page_query, sort_index, split_page
+from products import InsufficientStock, Product
+from queries import (CUSTOMERS_PAGE, DAILY_SALES, DECREMENT_STOCK, DELETE_CUSTOMER, DELETE_PRODUCT,
+                     INSERT_CUSTOMER, INSERT_PRODUCT, INSERT_SALE, INSERT_SALE_ITEM, INSERT_SALE_ITEMS,
+                     LOCK_PRODUCTS, PRODUCTS_PAGE, SALES_BY_CUSTOMER, SALES_PAGE, SALES_SUMMARY, SEARCH_CUSTOMERS,
+                     SELECT_CUSTOMER, SELECT_CUSTOMERS, SELECT_PRODUCT, SELECT_PRODUCTS, SELECT_SALE,
+                     SELECT_SALE_ITEMS, STOCK_LEVELS, date_range, rollup_range_params, sale_items_params,
+                     top_sellers_query, update_query)
+from records import (CustomerRecord, DailySales, ProductRecord, SaleItemRecord, SaleListing,
+                     SaleRecord, SalesSummary, TopSeller)
+from sales import Sale
+
+
+async def _fetch_page(select_sql, alias, sort_key, after, page_size, descending,
+                      where=None, params=(), record=None):
+    query, args = page_query(select_sql, alias, sort_key, after, page_size,
+                             descending, where, params)
+    async with acquire() as conn:
+        rows = await conn.fetchall(query, args, record)
+    return split_page(rows, page_size, sort_index(record, sort_key))
+
+
+async def _invalidate(*tags, sale_id=None):
+    # The cache may be the SQLite backend: invalidate from a worker thread
+    # so a write doesn't stall every other request on the event loop
+    def run():
+        if sale_id is not None:
+            invalidate_bill(sale_id)
+        invalidate(*tags)
+    await asyncio.to_thread(run)
+
+
+class AsyncCustomer:
+    async def insert_customer(name, contact):
+        async with acquire() as conn:
+            customer_id = await conn.fetchval(INSERT_CUSTOMER, (name, contact))
+        await _invalidate("customers")
+        return customer_id
+
+    async def update_customer(customer_id, name=None, contact=None):
+        # Returns False if the customer doesn't exist
+        sql, values = update_query("customers", [("name", name), ("contact", contact)], customer_id)
+        if not sql:
+            return True
+        async with acquire() as conn:
+            updated = await conn.fetchval(sql, values)
+        await _invalidate("customers")
+        return updated is not None
+
+    async def delete_customer(customer_id):
+        async with acquire() as conn:
+            (await conn.execute(DELETE_CUSTOMER, (customer_id,))).close()
+        await _invalidate("customers")
+
+    @cached_query("customers")
+    async def get_all_customers():
+        async with acquire() as conn:
+            return await conn.fetchall(SELECT_CUSTOMERS, record=CustomerRecord)
+
+    @cached_query("customers")
+    async def get_customers_page(page_size=DEFAULT_PAGE_SIZE, after=None, sort_key="id", descending=False):
+        check_sort_key(sort_key, Customer.SORT_KEYS)
+        return await _fetch_page(CUSTOMERS_PAGE, "c", sort_key, after, page_size, descending,
+                                 record=CustomerRecord)
+
+    async def view_customer_by_id(customer_id):
+        async with acquire() as conn:
+            return await conn.fetchone(SELECT_CUSTOMER, (customer_id,), CustomerRecord)
+
+    async def search_customer(name):
+        async with acquire() as conn:
+            return await conn.fetchall(SEARCH_CUSTOMERS, ('%' + name + '%',), CustomerRecord)
+
+
+class AsyncProduct:
+    async def insert_product(name, description, price, quantity):
+        async with acquire() as conn:
+            product_id = await conn.fetchval(INSERT_PRODUCT, (name, description, price, quantity))
+        await _invalidate("products")
+        return product_id
+
+    async def update_product(product_id, name=None, description=None, price=None, quantity=None):
+        # Returns False if the product doesn't exist
+        sql, values = update_query("products", [("name", name), ("description", description),
+                                                ("price", price), ("quantity", quantity)], product_id)
+        if not sql:
+            return True
+        async with acquire() as conn:
+            updated = await conn.fetchval(sql, values)
+        await _invalidate("products")
+        return updated is not None
+
+    async def delete_product(product_id):
+        async with acquire() as conn:
+            (await conn.execute(DELETE_PRODUCT, (product_id,))).close()
+        await _invalidate("products")
+
+    async def decrement_stock(lines, conn=None):
+        # See Product.decrement_stock. When conn is given it must be inside
+        # conn.transaction(), and the caller invalidates "products" afterwards.
+        if conn is None:
+            async with acquire() as conn:
+                try:
+                    async with conn.transaction():
+                        updated, failed = await AsyncProduct.decrement_stock(lines, conn)
+                        if failed:
+                            raise InsufficientStock(failed)
+                except InsufficientStock:
+                    return updated, failed
+            await _invalidate("products")
+            return updated, failed
+
+        quantities = Product.merge_quantities(lines)
+        if not quantities:
+            return {}, []
+        ordered = sorted(quantities.items())
+        product_ids = [product_id for product_id, _ in ordered]
+        (await conn.execute(LOCK_PRODUCTS, (product_ids,))).close()
+        rows = await conn.fetchall(DECREMENT_STOCK, (product_ids, [quantity for _, quantity in ordered]))
+        updated = {product_id: (price, remaining) for product_id, price, remaining in rows}
+
+        failed = []
+        missing = [product_id for product_id in quantities if product_id not in updated]
+        if missing:
+            available = dict(await conn.fetchall(STOCK_LEVELS, (missing,)))
+            failed = [(product_id, quantities[product_id], available.get(product_id))
+                      for product_id in sorted(missing)]
+        return updated, failed
+
+    @cached_query("products")
+    async def view_products():
+        async with acquire() as conn:
+            return await conn.fetchall(SELECT_PRODUCTS, record=ProductRecord)
+
+    @cached_query("products")
+    async def get_products_page(page_size=DEFAULT_PAGE_SIZE, after=None, sort_key="id", descending=False):
+        check_sort_key(sort_key, Product.SORT_KEYS)
+        return await _fetch_page(PRODUCTS_PAGE, "p", sort_key, after, page_size, descending,
+                                 record=ProductRecord)
+
+    @cached_query("products")
+    async def view_product_id(product_id):
+        async with acquire() as conn:
+            return await conn.fetchone(SELECT_PRODUCT, (product_id,), ProductRecord)
+
+
+class AsyncSaleItem:
+    async def add_item(sale_id, product_id, quantity, price):
+        async with acquire() as conn:
+            item_id = await conn.fetchval(INSERT_SALE_ITEM, (sale_id, product_id, quantity, price))
+        await _invalidate("sale_items", sale_id=sale_id)
+        return item_id
+
+    async def add_items(sale_id, lines, conn=None):
+        # See SaleItem.add_items; one INSERT for all lines
+        if conn is None:
+            async with acquire() as conn:
+                async with conn.transaction():
+                    item_ids = await AsyncSaleItem.add_items(sale_id, lines, conn)
+            await _invalidate("sale_items", sale_id=sale_id)
+            return item_ids
+        if not lines:
+            return []
+        rows = await conn.fetchall(INSERT_SALE_ITEMS, sale_items_params(sale_id, lines))
+        return [row[0] for row in rows]
+
+    async def get_items_by_sale(sale_id):
+        async with acquire() as conn:
+            return await conn.fetchall(SELECT_SALE_ITEMS, (sale_id,), SaleItemRecord)
+
+
+class AsyncSale:
+    async def insert_sale(customer_id, date, total_amount):
+        async with acquire() as conn:
+            sale_id = await conn.fetchval(INSERT_SALE, (customer_id, date, total_amount))
+        await _invalidate("sales")
+        return sale_id
+
+    async def checkout(customer_id, lines, sale_date=None):
+        # See Sale.checkout: one transaction for stock, header and items
+        cart = Sale.prepare_cart(lines)
+        if sale_date is None:
+            sale_date = date_type.today()
+
+        async with acquire() as conn:
+            async with conn.transaction():
+                updated, failed = await AsyncProduct.decrement_stock(
+                    [(product_id, quantity) for product_id, quantity, _ in cart], conn)
+                if failed:
+                    raise InsufficientStock(failed)
+                items, total_amount = Sale.price_cart(cart, updated)
+                sale_id = await conn.fetchval(INSERT_SALE, (customer_id, sale_date, total_amount))
+                await AsyncSaleItem.add_items(sale_id, items, conn)
+        await _invalidate("products", "sales", "sale_items")
+        return sale_id, total_amount
+
+    @cached_query("sales", "customers")
+    async def get_sales_page(page_size=DEFAULT_PAGE_SIZE, after=None, sort_key="date", descending=True,
+                             start_date=None, end_date=None):
+        check_sort_key(sort_key, Sale.SORT_KEYS)
+        where, params = date_range('s.date', start_date, end_date)
+        return await _fetch_page(SALES_PAGE, "s", sort_key, after, page_size, descending,
+                                 where, params, record=SaleListing)
+
+    async def view_sale_by_id(sale_id):
+        async with acquire() as conn:
+            return await conn.fetchone(SELECT_SALE, (sale_id,), SaleRecord)
+
+    async def get_sales_by_customer(customer_id):
+        async with acquire() as conn:
+            return await conn.fetchall(SALES_BY_CUSTOMER, (customer_id,), SaleRecord)
+
+    @cached_query("sales", "sale_items")
+    async def get_sales_summary(start_date=None, end_date=None):
+        async with acquire() as conn:
+            return await conn.fetchone(SALES_SUMMARY, rollup_range_params(start_date, end_date), SalesSummary)
+
+    @cached_query("sales", "sale_items")
+    async def get_daily_sales(start_date=None, end_date=None):
+        async with acquire() as conn:
+            return await conn.fetchall(DAILY_SALES, rollup_range_params(start_date, end_date), DailySales)
+
+    @cached_query("sales", "sale_items", "products")
+    async def get_top_selling_products(limit=5, window=None):
+        query, params = top_sellers_query(limit, window)
+        async with acquire() as conn:
+            return await conn.fetchall(query, params, TopSeller)
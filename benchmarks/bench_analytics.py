@@ -0,0 +1,85 @@
+# Aggregation speed of the columnar analytics (analytics.py) on a synthetic
+# extract; no database needed. With --db, also times the extract itself
+# (a full load, then an incremental refresh) from DB_NAME.
+#
+#   python benchmarks/bench_analytics.py --items 10000000
+#   DB_NAME=ecommerce_bench python benchmarks/bench_analytics.py --db
+
+import argparse
+import os
+import sys
+import time
+from datetime import date
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from analytics import EPOCH, SalesColumns, moving_average
+
+
+def make_columns(sales, items, customers, products, days):
+    rng = np.random.default_rng(42)
+    last_day = (date.today() - EPOCH).days
+    sale_ids = np.arange(1, sales + 1, dtype=np.int32)
+    # Every sale gets one item, the rest land on random sales
+    item_sales = np.concatenate([sale_ids, rng.integers(1, sales + 1, items - sales, dtype=np.int32)])
+    item_sales.sort()
+    quantity = rng.integers(1, 6, items, dtype=np.int32)
+    price = rng.integers(100, 50000, items, dtype=np.int64)
+    totals = np.bincount(item_sales, weights=quantity * price, minlength=sales + 1)[1:].astype(np.int64)
+    return SalesColumns.from_arrays(
+        {"id": sale_ids,
+         "customer_id": rng.integers(1, customers + 1, sales, dtype=np.int32),
+         "day": (last_day - rng.integers(0, days, sales)).astype(np.int32),
+         "total": totals},
+        {"id": np.arange(1, items + 1, dtype=np.int32),
+         "sale_id": item_sales,
+         "product_id": rng.integers(1, products + 1, items, dtype=np.int32),
+         "quantity": quantity,
+         "price": price})
+
+
+def timed(label, func):
+    start = time.perf_counter()
+    result = func()
+    print(f"{label:<36} {time.perf_counter() - start:8.3f} s")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sales", type=int, default=2000000)
+    parser.add_argument("--items", type=int, default=10000000)
+    parser.add_argument("--customers", type=int, default=100000)
+    parser.add_argument("--products", type=int, default=50000)
+    parser.add_argument("--days", type=int, default=730)
+    parser.add_argument("--db", action="store_true", help="also time the extract from the database")
+    args = parser.parse_args()
+
+    if args.db:
+        columns = SalesColumns()
+        timed("full extract", lambda: columns.refresh(force=True))
+        timed("incremental refresh (no changes)", lambda: columns.refresh(force=True))
+        print(f"{columns.sales.size} sales, {columns.items.size} sale items")
+    else:
+        columns = timed("build synthetic columns", lambda: make_columns(
+            args.sales, args.items, args.customers, args.products, args.days))
+        print(f"{args.sales} sales, {args.items} sale items")
+
+    last_30 = date.fromordinal(date.today().toordinal() - 29)
+    timed("derived item columns", columns._columns)
+    timed("summary (all time)", columns.summary)
+    daily = timed("daily (all time)", columns.daily)
+    timed("7-day moving average", lambda: moving_average(daily["revenue"], 7))
+    timed("daily (last 30 days)", lambda: columns.daily(last_30))
+    timed("revenue by product", lambda: columns.revenue_by("product", limit=20))
+    timed("revenue by customer", lambda: columns.revenue_by("customer", limit=20))
+    timed("revenue by day", lambda: columns.revenue_by("day", limit=20))
+    timed("top products (last 30 days)", lambda: columns.top_products(10, last_30))
+    timed("basket sizes (lines)", columns.basket_sizes)
+    timed("basket sizes (units)", lambda: columns.basket_sizes(by="units"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+# Throughput of the blocking models (one thread per till) versus the asyncio
+# models (one task per till) with the same pool size. Each till repeatedly
+# checks out a cart and then runs a report query.
+#
+#   DB_NAME=ecommerce_bench DB_POOL_MAX=20 python benchmarks/bench_async.py --tills 100 --rounds 20
+#
+# Writes sales and sale items; point DB_NAME at a scratch database.
+
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from Database import get_connection, settings
+from async_db import close_async_pool
+from async_models import AsyncSale
+from customers import Customer
+from migrations import migrate
+from products import Product
+from sales import Sale
+from sales_items import SaleItem
+
+
+def setup(products):
+    Customer.create_table()
+    Product.create_table()
+    Sale.create_table()
+    SaleItem.create_table()
+    migrate()
+    customer_id = Customer.insert_customer("Benchmark Till", "till@example.com")
+    product_ids = [Product.insert_product(f"Benchmark Product {i}", "", 4.99, 10**9) for i in range(products)]
+    return customer_id, product_ids
+
+
+def cleanup(customer_id, product_ids):
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute('DELETE FROM sales WHERE customer_id = %s', (customer_id,))
+        cur.execute('DELETE FROM products WHERE id = ANY(%s)', (product_ids,))
+        cur.execute('DELETE FROM customers WHERE id = %s', (customer_id,))
+        conn.commit()
+        cur.close()
+
+
+def make_carts(product_ids, count, lines):
+    rng = random.Random(1)
+    return [[(rng.choice(product_ids), rng.randint(1, 3)) for _ in range(lines)] for _ in range(count)]
+
+
+def run_sync(customer_id, carts, tills, rounds, think):
+    def till(index):
+        latencies = []
+        for i in range(rounds):
+            start = time.perf_counter()
+            Sale.checkout(customer_id, carts[(index * rounds + i) % len(carts)])
+            Sale.get_sales_summary.uncached()
+            latencies.append(time.perf_counter() - start)
+            if think:
+                time.sleep(think)
+        return latencies
+
+    with ThreadPoolExecutor(max_workers=tills) as executor:
+        return [latency for latencies in executor.map(till, range(tills)) for latency in latencies]
+
+
+async def run_async(customer_id, carts, tills, rounds, think):
+    async def till(index):
+        latencies = []
+        for i in range(rounds):
+            start = time.perf_counter()
+            await AsyncSale.checkout(customer_id, carts[(index * rounds + i) % len(carts)])
+            await AsyncSale.get_sales_summary()
+            latencies.append(time.perf_counter() - start)
+            if think:
+                await asyncio.sleep(think)
+        return latencies
+
+    try:
+        results = await asyncio.gather(*(till(index) for index in range(tills)))
+    finally:
+        await close_async_pool()
+    return [latency for latencies in results for latency in latencies]
+
+
+def report(label, latencies, elapsed):
+    latencies.sort()
+    p95 = latencies[int(len(latencies) * 0.95) - 1]
+    print(f"{label:<8} {len(latencies):>6} rounds in {elapsed:7.2f}s  {len(latencies) / elapsed:8.1f} rounds/s  "
+          f"p50 {statistics.median(latencies) * 1000:7.1f} ms  p95 {p95 * 1000:7.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tills", type=int, default=100)
+    parser.add_argument("--rounds", type=int, default=20, help="checkout + report rounds per till")
+    parser.add_argument("--lines", type=int, default=5)
+    parser.add_argument("--products", type=int, default=200)
+    parser.add_argument("--think-ms", type=float, default=0, help="pause between rounds, as a real till would")
+    args = parser.parse_args()
+
+    customer_id, product_ids = setup(args.products)
+    carts = make_carts(product_ids, 1000, args.lines)
+    think = args.think_ms / 1000
+    print(f"{args.tills} tills, pool max_size {settings['pool']['max_size']}")
+    try:
+        start = time.perf_counter()
+        latencies = run_sync(customer_id, carts, args.tills, args.rounds, think)
+        report("sync", latencies, time.perf_counter() - start)
+
+        start = time.perf_counter()
+        latencies = asyncio.run(run_async(customer_id, carts, args.tills, args.rounds, think))
+        report("async", latencies, time.perf_counter() - start)
+    finally:
+        cleanup(customer_id, product_ids)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+# Lookup latency of the in-memory product catalog (catalog.py) on a
+# synthetic catalog; no database needed.
+#
+#   python benchmarks/bench_catalog.py --products 1000000
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from catalog import ProductCatalog
+
+BRANDS = ["acme", "northwind", "contoso", "fabrikam", "globex", "initech", "umbrella", "stark",
+          "wayne", "tyrell", "hooli", "vandelay", "soylent", "wonka", "oceanic", "cyberdyne"]
+KINDS = ["chocolate", "biscuit", "shampoo", "detergent", "notebook", "battery", "coffee", "tea",
+         "toothpaste", "sanitizer", "noodles", "juice", "rice", "lentils", "candle", "charger"]
+SIZES = ["small", "medium", "large", "family", "mini", "value", "premium", "classic"]
+
+
+def make_rows(count):
+    rng = random.Random(42)
+    for product_id in range(1, count + 1):
+        name = f"{rng.choice(BRANDS)} {rng.choice(SIZES)} {rng.choice(KINDS)} {product_id}"
+        yield (product_id, f"89{product_id:011d}", name, f"{rng.randint(100, 99999) / 100:.2f}",
+               rng.randint(0, 500))
+
+
+def timed(label, calls, func):
+    start = time.perf_counter()
+    for args in calls:
+        func(*args)
+    elapsed = time.perf_counter() - start
+    print(f"{label:<28} {len(calls):>7} calls  {elapsed / len(calls) * 1e6:10.1f} us/call")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--products", type=int, default=1000000)
+    parser.add_argument("--calls", type=int, default=2000)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    catalog = ProductCatalog.from_rows(make_rows(args.products))
+    print(f"Built catalog of {len(catalog)} products in {time.perf_counter() - start:.1f}s")
+
+    rng = random.Random(7)
+    ids = [(rng.randint(1, args.products),) for _ in range(args.calls)]
+    skus = [(f"89{product_id:011d}",) for (product_id,) in ids]
+    timed("get(id)", ids, catalog.get)
+    timed("by_sku(sku)", skus, catalog.by_sku)
+    timed("search(id)", [(str(product_id),) for (product_id,) in ids], catalog.search)
+    timed("search(word prefixes)", [(f"{rng.choice(BRANDS)[:4]} {rng.choice(KINDS)[:3]} {product_id}",)
+                                    for (product_id,) in ids], catalog.search)
+    timed("search(typo)", [("chocolte wonka 12345",)] * (args.calls // 10), catalog.search)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+# Cost of query instrumentation on the checkout path: Sale.checkout timed
+# with instrumentation on and off, in alternating blocks so drift in the
+# database affects both sides alike.
+#
+#   DB_NAME=ecommerce_bench python benchmarks/bench_instrumentation.py --checkouts 2000
+#
+# Writes sales and sale items; point DB_NAME at a scratch database.
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import instrumentation
+from Database import get_connection
+from customers import Customer
+from migrations import migrate
+from products import Product
+from sales import Sale
+from sales_items import SaleItem
+
+BLOCK = 100
+
+
+def setup(products):
+    Customer.create_table()
+    Product.create_table()
+    Sale.create_table()
+    SaleItem.create_table()
+    migrate()
+    customer_id = Customer.insert_customer("Benchmark Till", "till@example.com")
+    product_ids = [Product.insert_product(f"Benchmark Product {i}", "", 4.99, 10**9) for i in range(products)]
+    return customer_id, product_ids
+
+
+def cleanup(customer_id, product_ids):
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute('DELETE FROM sales WHERE customer_id = %s', (customer_id,))
+        cur.execute('DELETE FROM products WHERE id = ANY(%s)', (product_ids,))
+        cur.execute('DELETE FROM customers WHERE id = %s', (customer_id,))
+        conn.commit()
+        cur.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--checkouts", type=int, default=2000, help="per side")
+    parser.add_argument("--lines", type=int, default=5)
+    parser.add_argument("--products", type=int, default=200)
+    args = parser.parse_args()
+
+    customer_id, product_ids = setup(args.products)
+    rng = random.Random(1)
+    carts = [[(rng.choice(product_ids), rng.randint(1, 3)) for _ in range(args.lines)] for _ in range(1000)]
+    timings = {True: [], False: []}
+    try:
+        for i in range(20):
+            Sale.checkout(customer_id, carts[i])     # warm up
+        done = 0
+        while done < args.checkouts:
+            for enabled in (True, False):
+                instrumentation.set_enabled(enabled)
+                for i in range(done, min(done + BLOCK, args.checkouts)):
+                    start = time.perf_counter()
+                    Sale.checkout(customer_id, carts[i % len(carts)])
+                    timings[enabled].append(time.perf_counter() - start)
+            done += BLOCK
+    finally:
+        instrumentation.set_enabled(True)
+        cleanup(customer_id, product_ids)
+
+    for enabled in (False, True):
+        latencies = timings[enabled]
+        print(f"instrumentation {'on ' if enabled else 'off'}  {len(latencies)} checkouts  "
+              f"mean {statistics.mean(latencies) * 1000:7.3f} ms  median {statistics.median(latencies) * 1000:7.3f} ms")
+    overhead = statistics.median(timings[True]) / statistics.median(timings[False]) - 1
+    print(f"overhead {overhead:+.2%} (median)")
+
+
+if __name__ == "__main__":
+    main()
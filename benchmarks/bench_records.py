@@ -0,0 +1,99 @@
+# Memory per 1M rows and bulk-processing speed of the row types:
+# today's plain driver tuples, the NamedTuple records (records.py), a
+# __slots__ class, and a regular class / dict per row for comparison.
+# No database needed; rows are product-shaped with fresh values per row, as
+# the driver would produce them.
+#
+#   python benchmarks/bench_records.py --rows 1000000
+
+import argparse
+import gc
+import os
+import sys
+import time
+import tracemalloc
+from decimal import Decimal
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from records import ProductRecord
+
+
+class SlotsProduct:
+    __slots__ = ProductRecord._fields
+
+    def __init__(self, id, name, description, price, quantity, sku):
+        self.id = id
+        self.name = name
+        self.description = description
+        self.price = price
+        self.quantity = quantity
+        self.sku = sku
+
+
+class PlainProduct:
+    def __init__(self, id, name, description, price, quantity, sku):
+        self.id = id
+        self.name = name
+        self.description = description
+        self.price = price
+        self.quantity = quantity
+        self.sku = sku
+
+
+def driver_rows(count):
+    return [(i, f"Product {i}", None, Decimal(i % 10000) / 100, i % 500, f"SKU{i:09d}")
+            for i in range(count)]
+
+
+KINDS = [
+    ("tuple (today)", lambda rows: rows),
+    ("ProductRecord", lambda rows: [tuple.__new__(ProductRecord, row) for row in rows]),
+    ("__slots__ class", lambda rows: [SlotsProduct(*row) for row in rows]),
+    ("class with __dict__", lambda rows: [PlainProduct(*row) for row in rows]),
+    ("dict", lambda rows: [dict(zip(ProductRecord._fields, row)) for row in rows]),
+]
+
+
+def total_quantity(rows):
+    if isinstance(rows[0], tuple) and not hasattr(rows[0], "quantity"):
+        return sum(row[4] for row in rows)
+    if isinstance(rows[0], dict):
+        return sum(row["quantity"] for row in rows)
+    return sum(row.quantity for row in rows)
+
+
+def measure(label, convert, count):
+    # Memory: everything still referenced once the driver tuples are dropped
+    gc.collect()
+    tracemalloc.start()
+    records = convert(driver_rows(count))
+    gc.collect()
+    total, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del records
+
+    # Speed, without tracemalloc slowing allocations down
+    rows = driver_rows(count)
+    start = time.perf_counter()
+    records = convert(rows)
+    built = time.perf_counter() - start
+    del rows
+    start = time.perf_counter()
+    total_quantity(records)
+    scanned = time.perf_counter() - start
+    per_million = 1000000 / count
+    print(f"{label:<22} {total * per_million / 2**20:8.0f} MiB/1M rows  "
+          f"build {built * per_million:6.2f}s/1M  scan {scanned * per_million:6.3f}s/1M")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=1000000)
+    args = parser.parse_args()
+    for label, convert in KINDS:
+        measure(label, convert, args.rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+# Scaling of the batch report runner (reports.py) with the number of worker
+# processes: each report is run with 1, 2, 4 and 8 workers, the output is
+# checked to be identical, and the speedup over one worker is printed.
+#
+#   DB_NAME=ecommerce_bench python benchmarks/bench_reports.py --reports statements customers
+#
+# Read-only; seed DB_NAME with `python benchmarks/bench_suite.py seed` first.
+
+import argparse
+import os
+import sys
+import time
+from datetime import date
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from reports import REPORTS, run_report
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--reports", nargs="+", choices=list(REPORTS), default=["statements", "customers"])
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--start", type=date.fromisoformat)
+    parser.add_argument("--end", type=date.fromisoformat)
+    parser.add_argument("--repeat", type=int, default=3, help="best of")
+    args = parser.parse_args()
+
+    for name in args.reports:
+        expected = None
+        base = None
+        for workers in args.workers:
+            best = float("inf")
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                rows = run_report(name, args.start, args.end, workers)
+                best = min(best, time.perf_counter() - start)
+            if expected is None:
+                expected, base = rows, best
+            elif rows != expected:
+                print(f"{name}: output with {workers} workers differs from {args.workers[0]}")
+                return 1
+            print(f"{name:<11} {workers:>2} workers  {len(rows):>9} rows  {best:8.3f} s  "
+                  f"speedup {base / best:5.2f}x")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,87 @@
+# Throughput of SaleItem.add_item (one INSERT + commit per line) versus
+# SaleItem.add_items (one multi-row INSERT + commit per cart).
+#
+#   DB_NAME=ecommerce_bench python benchmarks/bench_sale_items.py --carts 200 --lines 50
+#
+# Writes sales and sale items; point DB_NAME at a scratch database.
+
+import argparse
+import contextlib
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from Database import get_connection
+from customers import Customer
+from products import Product
+from sales import Sale
+from sales_items import SaleItem
+from migrations import migrate
+
+
+def setup():
+    Customer.create_table()
+    Product.create_table()
+    Sale.create_table()
+    SaleItem.create_table()
+    migrate()
+    customer_id = Customer.insert_customer("Benchmark Customer", "bench@example.com")
+    product_ids = [Product.insert_product(f"Benchmark Product {i}", "", 9.99, 1000000) for i in range(100)]
+    return customer_id, product_ids
+
+
+def make_cart(product_ids, lines):
+    return [(random.choice(product_ids), random.randint(1, 5), 9.99) for _ in range(lines)]
+
+
+def timed(carts, add_cart):
+    start = time.perf_counter()
+    for cart in carts:
+        add_cart(cart)
+    return time.perf_counter() - start
+
+
+def report(label, carts, lines, elapsed):
+    total = carts * lines
+    print(f"{label:<24} {total:>8} lines in {elapsed:7.2f}s  {total / elapsed:10.0f} lines/s  "
+          f"{elapsed / carts * 1000:8.2f} ms/cart")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--carts", type=int, default=200)
+    parser.add_argument("--lines", type=int, default=50)
+    args = parser.parse_args()
+
+    customer_id, product_ids = setup()
+    carts = [make_cart(product_ids, args.lines) for _ in range(args.carts)]
+    sale_ids = [Sale.insert_sale(customer_id, "2024-01-01", 0) for _ in range(2 * args.carts)]
+    per_row_sales = iter(sale_ids[:args.carts])
+    batched_sales = iter(sale_ids[args.carts:])
+
+    def per_row(cart):
+        sale_id = next(per_row_sales)
+        for product_id, quantity, price in cart:
+            SaleItem.add_item(sale_id, product_id, quantity, price)
+
+    def batched(cart):
+        SaleItem.add_items(next(batched_sales), cart)
+
+    # add_item prints a line per call; keep the report readable
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        per_row_elapsed = timed(carts, per_row)
+    report("add_item (per row)", args.carts, args.lines, per_row_elapsed)
+    report("add_items (batched)", args.carts, args.lines, timed(carts, batched))
+
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute('DELETE FROM sales WHERE id = ANY(%s)', (sale_ids,))
+        conn.commit()
+        cur.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,345 @@
+# Reproducible benchmark suite for the billing and inventory paths.
+#
+#   DB_NAME=ecommerce_bench python benchmarks/bench_suite.py seed --sales 2000000 --items 10000000
+#   DB_NAME=ecommerce_bench python benchmarks/bench_suite.py run --save-baseline
+#   DB_NAME=ecommerce_bench python benchmarks/bench_suite.py run            # exit 1 on regression
+#
+# seed fills an empty database with a synthetic dataset generated inside
+# Postgres (generate_series with a fixed setseed, so the same sizes give the
+# same data). run times each case over the seeded data, prints throughput and
+# p50/p95/p99 latency, and compares the result with the stored baseline: a
+# case regresses when its p95 latency rises, or its throughput falls, by more
+# than --tolerance. Rows written by run are deleted again afterwards.
+#
+# Postgres only: the schema relies on plpgsql triggers, pg_trgm and
+# Postgres-specific SQL, so a SQLite stand-in would time a different program.
+# Point DB_NAME at a scratch database; seed --reset truncates every table.
+
+import argparse
+import contextlib
+import itertools
+import json
+import math
+import os
+import random
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from Database import get_connection, settings
+from billing import fetch_bill
+from customers import Customer
+from maintenance import rebuild_daily_rollup, rebuild_product_sales
+from migrations import migrate
+from products import Product
+from sales import Sale
+from sales_items import SaleItem
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+SEED_BATCH = 1000000
+SEED_TABLES = ["sale_items", "sales", "products", "customers", "sales_daily", "sales_daily_customers",
+               "product_sales", "product_sales_daily", "products_deleted"]
+WORDS = ["chocolate", "biscuit", "shampoo", "detergent", "notebook", "battery", "coffee", "tea",
+         "toothpaste", "sanitizer", "noodles", "juice", "rice", "lentils", "candle", "charger"]
+
+
+# ---------- seeding ----------
+
+def create_schema():
+    Customer.create_table()
+    Product.create_table()
+    Sale.create_table()
+    SaleItem.create_table()
+    migrate()
+
+
+def seed(customers, products, sales, items, days, reset):
+    create_schema()
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute('SELECT EXISTS (SELECT 1 FROM sales) OR EXISTS (SELECT 1 FROM products)')
+        if cur.fetchone()[0]:
+            if not reset:
+                cur.close()
+                raise SystemExit("The database already has data; seed a scratch database or pass --reset")
+            cur.execute(f'TRUNCATE {", ".join(SEED_TABLES)} RESTART IDENTITY CASCADE')
+
+        # The rollup triggers would fire once per row; they are switched off
+        # for the load and the rollups rebuilt in one pass afterwards. The whole
+        # load is one transaction, so a failure leaves the triggers enabled.
+        cur.execute('ALTER TABLE sales DISABLE TRIGGER USER')
+        cur.execute('ALTER TABLE sale_items DISABLE TRIGGER USER')
+        cur.execute('SELECT setseed(0.42)')
+
+        start = time.perf_counter()
+        cur.execute('''INSERT INTO customers (name, contact)
+                       SELECT 'Customer ' || g, 'customer' || g || '@example.com'
+                       FROM generate_series(1, %s) g''', (customers,))
+        cur.execute('''INSERT INTO products (name, description, price, quantity, sku)
+                       SELECT initcap((%s::text[])[1 + g %% %s]) || ' ' || initcap((%s::text[])[1 + (g / %s) %% %s]) || ' ' || g,
+                              '', round((1 + random() * 499)::numeric, 2), 1000000000, 'BENCH' || lpad(g::text, 10, '0')
+                       FROM generate_series(1, %s) g''',
+                    (WORDS, len(WORDS), WORDS, len(WORDS), len(WORDS), products))
+        cur.execute('''INSERT INTO sales (customer_id, date, total_amount)
+                       SELECT 1 + floor(random() * %s)::int, current_date - (g %% %s), 0
+                       FROM generate_series(1, %s) g''', (customers, days, sales))
+        print(f"{customers} customers, {products} products, {sales} sales in {time.perf_counter() - start:.1f}s")
+
+        for low in range(0, items, SEED_BATCH):
+            high = min(low + SEED_BATCH, items)
+            # Every sale gets at least one item; the rest land on random sales
+            cur.execute('''INSERT INTO sale_items (sale_id, product_id, quantity, price)
+                           SELECT i.sale_id, p.id, i.quantity, p.price
+                           FROM (SELECT CASE WHEN g <= %s THEN g ELSE 1 + floor(random() * %s)::int END AS sale_id,
+                                        1 + floor(random() * %s)::int AS product_id,
+                                        1 + floor(random() * 5)::int AS quantity
+                                 FROM generate_series(%s, %s) g) i
+                           JOIN products p ON p.id = i.product_id''',
+                        (sales, sales, products, low + 1, high))
+            print(f"  {high} / {items} sale items ({time.perf_counter() - start:.1f}s)")
+
+        cur.execute('''UPDATE sales s SET total_amount = t.total
+                       FROM (SELECT sale_id, SUM(quantity * price) AS total FROM sale_items GROUP BY sale_id) t
+                       WHERE s.id = t.sale_id''')
+        cur.execute('ALTER TABLE sales ENABLE TRIGGER USER')
+        cur.execute('ALTER TABLE sale_items ENABLE TRIGGER USER')
+        conn.commit()
+        cur.close()
+
+    rebuild_daily_rollup()
+    rebuild_product_sales()
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute('ANALYZE')
+        conn.commit()
+        cur.close()
+    print(f"Seeded in {time.perf_counter() - start:.1f}s")
+
+
+def dataset():
+    # Sizes and id ranges of the seeded data; runs are only comparable on
+    # the same dataset
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute('''SELECT (SELECT COALESCE(MAX(id), 0) FROM customers),
+                              (SELECT COALESCE(MAX(id), 0) FROM products),
+                              (SELECT COALESCE(MAX(id), 0) FROM sales),
+                              (SELECT COALESCE(MAX(id), 0) FROM sale_items),
+                              (SELECT MIN(date) FROM sales), (SELECT MAX(date) FROM sales)''')
+        customers, products, sales, items, first_day, last_day = cur.fetchone()
+        conn.commit()
+        cur.close()
+    if not sales or not products:
+        raise SystemExit("No data to benchmark; run the seed command first")
+    return {"customers": customers, "products": products, "sales": sales, "sale_items": items,
+            "days": (last_day - first_day).days + 1, "first_day": first_day}
+
+
+# ---------- cases ----------
+# Each case takes the dataset and returns op(rng), one timed operation.
+# Reads call the uncached functions so the query cache doesn't hide the
+# database work.
+
+def case_insert_product(data):
+    counter = itertools.count()
+
+    def op(rng):
+        Product.insert_product(f"Bench Insert {next(counter)}", "", round(rng.uniform(1, 500), 2), 100)
+    return op
+
+
+def case_add_item(data):
+    sale_id = Sale.insert_sale(1, date.today(), 0)
+
+    def op(rng):
+        product_id = rng.randint(1, data["products"])
+        SaleItem.add_item(sale_id, product_id, rng.randint(1, 5), 9.99)
+    return op
+
+
+def case_generate_bill(data):
+    # The bill query and its rendering, as Sale.generate_bill runs them on a
+    # cache miss, without printing
+    def op(rng):
+        fetch_bill(rng.randint(1, data["sales"]))
+    return op
+
+
+def case_top_selling(data):
+    windows = [None] + list(Sale.TOP_SELLING_WINDOWS)
+
+    def op(rng):
+        Sale.get_top_selling_products.uncached(5, rng.choice(windows))
+    return op
+
+
+def case_total_sales_by_date(data):
+    def op(rng):
+        start = data["first_day"] + timedelta(days=rng.randrange(data["days"]))
+        Sale.get_total_sales_by_date.uncached(start, start + timedelta(days=30))
+    return op
+
+
+def case_checkout(data):
+    def op(rng):
+        lines = [(rng.randint(1, data["products"]), rng.randint(1, 3)) for _ in range(rng.randint(1, 5))]
+        Sale.checkout(rng.randint(1, data["customers"]), lines)
+    return op
+
+
+CASES = {
+    "insert_product": case_insert_product,
+    "add_item": case_add_item,
+    "generate_bill": case_generate_bill,
+    "top_selling": case_top_selling,
+    "total_sales_by_date": case_total_sales_by_date,
+    "checkout": case_checkout,
+}
+
+
+# ---------- running ----------
+
+def percentile(sorted_values, p):
+    # Nearest-rank percentile
+    return sorted_values[max(0, math.ceil(p / 100 * len(sorted_values)) - 1)]
+
+
+def run_case(name, op, iterations, concurrency, warmup, seed):
+    warm = random.Random(f"{seed}-{name}-warmup")
+    for _ in range(warmup):
+        op(warm)
+
+    def worker(index):
+        rng = random.Random(f"{seed}-{name}-{index}")
+        latencies = []
+        for _ in range(iterations // concurrency + (index < iterations % concurrency)):
+            start = time.perf_counter()
+            op(rng)
+            latencies.append(time.perf_counter() - start)
+        return latencies
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        latencies = sorted(latency for latencies in executor.map(worker, range(concurrency))
+                           for latency in latencies)
+    elapsed = time.perf_counter() - start
+    return {
+        "ops": len(latencies),
+        "throughput": len(latencies) / elapsed,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+    }
+
+
+def cleanup(data):
+    # Delete what the cases wrote. Sale items go with their sales, and the
+    # triggers take them back out of the rollups.
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute('DELETE FROM sales WHERE id > %s', (data["sales"],))
+        cur.execute('DELETE FROM products WHERE id > %s', (data["products"],))
+        conn.commit()
+        cur.close()
+
+
+def compare(results, baseline, tolerance):
+    # Returns a description of each regression past the tolerance
+    if baseline["dataset"] != results["dataset"]:
+        print("Warning: the baseline was recorded on a different dataset")
+    regressions = []
+    for name, case in results["cases"].items():
+        base = baseline["cases"].get(name)
+        if base is None:
+            continue
+        if case["p95_ms"] > base["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {case['p95_ms']:.2f} ms, baseline {base['p95_ms']:.2f} ms")
+        if case["throughput"] < base["throughput"] * (1 - tolerance):
+            regressions.append(f"{name}: {case['throughput']:.1f} ops/s, baseline {base['throughput']:.1f} ops/s")
+    return regressions
+
+
+def run(args):
+    names = args.cases.split(",") if args.cases else list(CASES)
+    unknown = [name for name in names if name not in CASES]
+    if unknown:
+        raise SystemExit(f"Unknown case(s): {', '.join(unknown)}; choose from {', '.join(CASES)}")
+    data = dataset()
+    results = {
+        "dataset": {key: value for key, value in data.items() if key != "first_day"},
+        "concurrency": args.concurrency,
+        "cases": {},
+    }
+    print(f"{data['sale_items']} sale items, {args.concurrency} thread(s), "
+          f"pool max_size {settings['pool']['max_size']}")
+    print(f"{'case':<22} {'ops':>6} {'ops/s':>10} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    try:
+        for name in names:
+            # The models print as they go; keep the report readable
+            with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                case = run_case(name, CASES[name](data), args.iterations, args.concurrency, args.warmup, args.seed)
+            results["cases"][name] = case
+            print(f"{name:<22} {case['ops']:>6} {case['throughput']:>10.1f} {case['p50_ms']:>9.2f} "
+                  f"{case['p95_ms']:>9.2f} {case['p99_ms']:>9.2f}")
+    finally:
+        cleanup(data)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+        return 0
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}; pass --save-baseline to record one")
+        return 0
+    with open(args.baseline) as f:
+        regressions = compare(results, json.load(f), args.tolerance)
+    if regressions:
+        print(f"Regressions past {args.tolerance:.0%} of the baseline:")
+        for regression in regressions:
+            print(f"  {regression}")
+        return 1
+    print("No regressions against the baseline.")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    seed_parser = commands.add_parser("seed", help="load a synthetic dataset")
+    seed_parser.add_argument("--customers", type=int, default=10000)
+    seed_parser.add_argument("--products", type=int, default=5000)
+    seed_parser.add_argument("--sales", type=int, default=200000)
+    seed_parser.add_argument("--items", type=int, default=1000000, help="sale items (at least --sales)")
+    seed_parser.add_argument("--days", type=int, default=365, help="days of history, ending today")
+    seed_parser.add_argument("--reset", action="store_true", help="truncate existing data first")
+
+    run_parser = commands.add_parser("run", help="time the cases and check for regressions")
+    run_parser.add_argument("--cases", help=f"comma-separated subset of: {', '.join(CASES)}")
+    run_parser.add_argument("--iterations", type=int, default=500, help="timed operations per case")
+    run_parser.add_argument("--warmup", type=int, default=20, help="untimed operations per case")
+    run_parser.add_argument("--concurrency", type=int, default=1, help="threads per case")
+    run_parser.add_argument("--seed", type=int, default=1, help="seed for the operation mix")
+    run_parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    run_parser.add_argument("--save-baseline", action="store_true", help="store this run as the baseline")
+    run_parser.add_argument("--tolerance", type=float, default=0.2, help="allowed slowdown, e.g. 0.2 for 20%%")
+    run_parser.add_argument("--output", help="also write the results as JSON")
+    args = parser.parse_args()
+
+    if args.command == "seed":
+        if args.items < args.sales:
+            parser.error("--items must be at least --sales")
+        seed(args.customers, args.products, args.sales, args.items, args.days, args.reset)
+        return 0
+    return run(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,113 @@
+# Query plans for the hot lookup paths before and after the schema migrations.
+#
+#   DB_NAME=ecommerce_bench python benchmarks/explain_indexes.py --seed 1000000
+#
+# --seed adds that many synthetic sales (plus customers, products and about
+# three items per sale) with generate_series. Point DB_NAME at a scratch
+# database: the pending migrations are applied between the two runs.
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from Database import get_connection
+from customers import Customer
+from products import Product
+from sales import Sale
+from sales_items import SaleItem
+from migrations import migrate, pending_migrations
+
+QUERIES = [
+    ("generate_bill / get_items_by_sale",
+     'SELECT * FROM sale_items WHERE sale_id = (SELECT max(id) / 2 FROM sales)'),
+    ("get_sales_by_customer",
+     'SELECT * FROM sales WHERE customer_id = (SELECT max(id) / 2 FROM customers) ORDER BY date DESC'),
+    ("get_total_sales_by_date",
+     "SELECT SUM(total_amount) FROM sales WHERE date BETWEEN current_date - 7 AND current_date"),
+    ("top selling products",
+     '''SELECT p.name, SUM(si.quantity) AS total_quantity FROM sale_items si
+        JOIN products p ON si.product_id = p.id
+        GROUP BY p.name, p.id ORDER BY total_quantity DESC LIMIT 10'''),
+    ("search_customer",
+     "SELECT * FROM customers WHERE name ILIKE '%ustomer 4242%'"),
+]
+
+
+def seed(sales):
+    customers = max(sales // 20, 1)
+    products = max(sales // 100, 1)
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute('''WITH ins AS (
+                           INSERT INTO customers (name, contact)
+                           SELECT 'Customer ' || g, 'customer' || g || '@example.com'
+                           FROM generate_series(1, %s) g RETURNING id)
+                       SELECT min(id), max(id) FROM ins''', (customers,))
+        c_lo, c_hi = cur.fetchone()
+        cur.execute('''WITH ins AS (
+                           INSERT INTO products (name, description, price, quantity)
+                           SELECT 'Product ' || g, 'Synthetic product', round((random() * 99 + 1)::numeric, 2), 100000
+                           FROM generate_series(1, %s) g RETURNING id)
+                       SELECT min(id), max(id) FROM ins''', (products,))
+        p_lo, p_hi = cur.fetchone()
+        cur.execute('''WITH ins AS (
+                           INSERT INTO sales (customer_id, date, total_amount)
+                           SELECT %s + floor(random() * (%s - %s + 1))::int,
+                                  current_date - floor(random() * 730)::int,
+                                  round((random() * 500)::numeric, 2)
+                           FROM generate_series(1, %s) g RETURNING id)
+                       SELECT min(id), max(id) FROM ins''', (c_lo, c_hi, c_lo, sales))
+        s_lo, s_hi = cur.fetchone()
+        cur.execute('''INSERT INTO sale_items (sale_id, product_id, quantity, price)
+                       SELECT s, %s + floor(random() * (%s - %s + 1))::int,
+                              1 + floor(random() * 5)::int, round((random() * 99 + 1)::numeric, 2)
+                       FROM generate_series(%s, %s) s, generate_series(1, 3)''',
+                    (p_lo, p_hi, p_lo, s_lo, s_hi))
+        cur.execute('ANALYZE')
+        conn.commit()
+        cur.close()
+
+
+def explain_all(label):
+    print(f"==== {label} ====")
+    with get_connection() as conn:
+        cur = conn.cursor()
+        for name, query in QUERIES:
+            cur.execute('EXPLAIN (ANALYZE, BUFFERS) ' + query)
+            plan = [row[0] for row in cur.fetchall()]
+            print(f"--- {name}")
+            print("\n".join(plan))
+            print()
+        cur.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seed", type=int, default=0, help="number of synthetic sales to add first")
+    args = parser.parse_args()
+
+    Customer.create_table()
+    Product.create_table()
+    Sale.create_table()
+    SaleItem.create_table()
+    if args.seed:
+        start = time.perf_counter()
+        seed(args.seed)
+        print(f"Seeded {args.seed} sales in {time.perf_counter() - start:.1f}s")
+
+    if pending_migrations():
+        explain_all("before migrations")
+        migrate()
+        with get_connection() as conn:
+            cur = conn.cursor()
+            cur.execute('ANALYZE')
+            conn.commit()
+            cur.close()
+    explain_all("after migrations")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+# Bill / invoice service.
+# A bill (header, lines with product names, line totals and the grand total)
+# is fetched with one query, rendered once to text and HTML, and kept in the
+# query cache (cache.py) by sale id, so reprints at the counter don't touch
+# the database. Each bill has its own tag, sale:<id>: code that changes a
+# sale's items calls invalidate_bill(sale_id), which drops that bill only,
+# in every process with the sqlite backend. The cache TTL bounds the rest.
+
+import html
+from decimal import Decimal
+
+from Database import get_connection
+from cache import caching_enabled, get_cache, invalidate
+
+
+def fetch_bill(sale_id):
+    # Returns the bill structure for a sale, or None if the sale doesn't exist
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute('''SELECT s.id, s.customer_id, c.name, s.date, s.total_amount,
+                              si.id, si.product_id, p.name, si.quantity, si.price,
+                              si.quantity * si.price,
+                              COALESCE(SUM(si.quantity * si.price) OVER (), 0)
+                       FROM sales s
+                       LEFT JOIN customers c ON c.id = s.customer_id
+                       LEFT JOIN sale_items si ON si.sale_id = s.id
+                       LEFT JOIN products p ON p.id = si.product_id
+                       WHERE s.id = %s
+                       ORDER BY si.id''', (sale_id,))
+        rows = cur.fetchall()
+        cur.close()
+    if not rows:
+        return None
+    first = rows[0]
+    lines = [{"item_id": row[5],
+              "product_id": row[6],
+              "product": row[7] if row[7] is not None else f"Product #{row[6]}",
+              "quantity": row[8],
+              "price": row[9],
+              "total": row[10]}
+             for row in rows if row[5] is not None]
+    bill = {"sale_id": first[0],
+            "customer_id": first[1],
+            "customer": first[2] if first[2] is not None else f"Customer #{first[1]}",
+            "date": first[3],
+            "total_amount": first[4],
+            "items_total": first[11] if lines else Decimal("0.00"),
+            "lines": lines}
+    bill["text"] = render_text(bill)
+    bill["html"] = render_html(bill)
+    return bill
+
+
+def render_text(bill):
+    out = [f"Bill for Sale ID: {bill['sale_id']}",
+           f"Customer: {bill['customer']}",
+           f"Date: {bill['date']}",
+           "-" * 60]
+    for line in bill["lines"]:
+        out.append(f"{line['product'][:28]:<28} {line['quantity']:>5} x {line['price']:>9.2f} = {line['total']:>10.2f}")
+    out.append("-" * 60)
+    out.append(f"{'TOTAL AMOUNT':<45}{bill['total_amount']:>15.2f}")
+    return "\n".join(out)
+
+
+def render_html(bill):
+    rows = "".join(
+        f"<tr><td>{html.escape(line['product'])}</td><td>{line['quantity']}</td>"
+        f"<td>${line['price']:.2f}</td><td>${line['total']:.2f}</td></tr>"
+        for line in bill["lines"])
+    return (f"<div class=\"bill\"><h3>BILL</h3>"
+            f"<p>Sale ID: {bill['sale_id']}<br>Customer: {html.escape(bill['customer'])}<br>"
+            f"Date: {bill['date']}</p>"
+            f"<table><tr><th>Product</th><th>Qty</th><th>Price</th><th>Total</th></tr>{rows}</table>"
+            f"<p><strong>TOTAL AMOUNT: ${bill['total_amount']:.2f}</strong></p></div>")
+
+
+def bill_tag(sale_id):
+    return f"sale:{sale_id}"
+
+
+def get_bill(sale_id):
+    # The bill from the cache; don't mutate it. A missing sale isn't cached.
+    if not caching_enabled():
+        return fetch_bill(sale_id)
+    cache = get_cache()
+    key = f"billing.get_bill:{sale_id!r}"
+    tags = (bill_tag(sale_id),)
+    found, bill = cache.get(key)
+    if found:
+        return bill
+    versions = cache.versions(tags)
+    bill = fetch_bill(sale_id)
+    if bill is not None:
+        cache.set(key, bill, tags, None, versions)
+    return bill
+
+
+def invalidate_bill(sale_id):
+    # Call after committing a change to a sale's items
+    invalidate(bill_tag(sale_id))
@@ -0,0 +1,233 @@
+# Bulk product / customer import.
+#
+#   python bulk_import.py products catalog.csv [--rejects rejects.csv]
+#   python bulk_import.py customers customers.jsonl
+#
+# Input is CSV with a header row, or JSON Lines (.jsonl / .ndjson). Rows are
+# validated in Python and streamed with COPY FROM STDIN into a temporary
+# staging table, then upserted in one statement:
+#   products  - keyed on sku; name, description, price and quantity are
+#               replaced by the file's values
+#   customers - keyed on contact; the name is replaced
+# When a key appears more than once in a file the last row wins. Rejected rows
+# are reported with their line number and reason and are not imported. The
+# whole import is one transaction.
+
+import argparse
+import csv
+import json
+import sys
+from decimal import Decimal, InvalidOperation
+
+from Database import get_connection
+from cache import invalidate
+from migrations import migrate
+
+PRODUCT_FIELDS = ("sku", "name", "description", "price", "quantity")
+CUSTOMER_FIELDS = ("name", "contact")
+MAX_PRICE = Decimal("99999999.99")    # DECIMAL(10, 2)
+MAX_QUANTITY = 2 ** 31 - 1
+
+
+class RejectedRow(Exception):
+    pass
+
+
+def read_records(path):
+    # Yields (line_no, record); a record is a dict, or a RejectedRow when the
+    # line itself could not be parsed.
+    if path.endswith((".jsonl", ".ndjson")):
+        with open(path, encoding="utf-8") as f:
+            for line_no, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError as e:
+                    yield line_no, RejectedRow(f"invalid JSON: {e}")
+                    continue
+                if not isinstance(record, dict):
+                    yield line_no, RejectedRow("expected a JSON object")
+                    continue
+                yield line_no, record
+    else:
+        with open(path, newline="", encoding="utf-8") as f:
+            reader = csv.DictReader(f)
+            for record in reader:
+                yield reader.line_num, record
+
+
+def _text(record, field, max_length, required=True):
+    value = record.get(field)
+    value = "" if value is None else str(value).strip()
+    if not value:
+        if required:
+            raise RejectedRow(f"{field} is required")
+        return None
+    if len(value) > max_length:
+        raise RejectedRow(f"{field} is longer than {max_length} characters")
+    return value
+
+
+def validate_product(record):
+    sku = _text(record, "sku", 64)
+    name = _text(record, "name", 100)
+    description = _text(record, "description", 10 ** 6, required=False)
+    try:
+        price = Decimal(str(record.get("price", "")).strip())
+    except InvalidOperation:
+        raise RejectedRow(f"price is not a number: {record.get('price')!r}")
+    if not price.is_finite() or price < 0 or price > MAX_PRICE or price != price.quantize(Decimal("0.01")):
+        raise RejectedRow(f"price out of range: {record.get('price')!r}")
+    try:
+        quantity = int(str(record.get("quantity", "")).strip())
+    except ValueError:
+        raise RejectedRow(f"quantity is not an integer: {record.get('quantity')!r}")
+    if quantity < 0 or quantity > MAX_QUANTITY:
+        raise RejectedRow(f"quantity out of range: {quantity}")
+    return (sku, name, description, price, quantity)
+
+
+def validate_customer(record):
+    return (_text(record, "name", 100), _text(record, "contact", 100))
+
+
+def _copy_field(value):
+    if value is None:
+        return "\\N"
+    return (str(value).replace("\\", "\\\\").replace("\t", "\\t")
+            .replace("\n", "\\n").replace("\r", "\\r"))
+
+
+class _CopyStream:
+    # Minimal file object for copy_expert that pulls COPY text-format lines
+    # from an iterator, so the file is never held in memory.
+    def __init__(self, lines):
+        self._lines = lines
+        self._pending = ""
+
+    def read(self, size=-1):
+        chunks = [self._pending]
+        length = len(self._pending)
+        for line in self._lines:
+            chunks.append(line)
+            length += len(line)
+            if 0 <= size <= length:
+                break
+        data = "".join(chunks)
+        if 0 <= size < len(data):
+            data, self._pending = data[:size], data[size:]
+        else:
+            self._pending = ""
+        return data
+
+    readline = read
+
+
+def _copy_lines(records, validate, rejected):
+    for line_no, record in records:
+        try:
+            if isinstance(record, RejectedRow):
+                raise record
+            values = validate(record)
+        except RejectedRow as e:
+            rejected.append((line_no, str(e)))
+            continue
+        yield "\t".join([str(line_no)] + [_copy_field(v) for v in values]) + "\n"
+
+
+def import_products(records):
+    # records: iterable of (line_no, dict) as produced by read_records
+    rejected = []
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute('''CREATE TEMP TABLE products_staging (
+                        line_no INTEGER, sku TEXT, name TEXT, description TEXT,
+                        price DECIMAL(10, 2), quantity INTEGER
+                    ) ON COMMIT DROP''')
+        cur.copy_expert('COPY products_staging FROM STDIN',
+                        _CopyStream(_copy_lines(records, validate_product, rejected)))
+        staged = cur.rowcount
+        cur.execute('''WITH upserted AS (
+                           INSERT INTO products (sku, name, description, price, quantity)
+                           SELECT DISTINCT ON (sku) sku, name, description, price, quantity
+                           FROM products_staging
+                           ORDER BY sku, line_no DESC
+                           ON CONFLICT (sku) DO UPDATE
+                           SET name = EXCLUDED.name, description = EXCLUDED.description,
+                               price = EXCLUDED.price, quantity = EXCLUDED.quantity
+                           RETURNING (xmax = 0) AS inserted)
+                       SELECT count(*) FILTER (WHERE inserted), count(*) FILTER (WHERE NOT inserted)
+                       FROM upserted''')
+        inserted, updated = cur.fetchone()
+        conn.commit()
+        cur.close()
+    invalidate("products")
+    return {"staged": staged, "inserted": inserted, "updated": updated,
+            "duplicates": staged - inserted - updated, "rejected": rejected}
+
+
+def import_customers(records):
+    # records: iterable of (line_no, dict) as produced by read_records
+    rejected = []
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute('''CREATE TEMP TABLE customers_staging (
+                        line_no INTEGER, name TEXT, contact TEXT
+                    ) ON COMMIT DROP''')
+        cur.copy_expert('COPY customers_staging FROM STDIN',
+                        _CopyStream(_copy_lines(records, validate_customer, rejected)))
+        staged = cur.rowcount
+        # contact has no unique constraint, so keep other writers out while
+        # deciding between update and insert
+        cur.execute('LOCK TABLE customers IN SHARE ROW EXCLUSIVE MODE')
+        cur.execute('''WITH latest AS (
+                           SELECT DISTINCT ON (contact) name, contact
+                           FROM customers_staging
+                           ORDER BY contact, line_no DESC),
+                       updated AS (
+                           UPDATE customers c SET name = l.name
+                           FROM latest l WHERE c.contact = l.contact
+                           RETURNING c.contact),
+                       inserted AS (
+                           INSERT INTO customers (name, contact)
+                           SELECT l.name, l.contact FROM latest l
+                           WHERE NOT EXISTS (SELECT 1 FROM customers c WHERE c.contact = l.contact)
+                           RETURNING id)
+                       SELECT (SELECT count(*) FROM inserted), (SELECT count(DISTINCT contact) FROM updated)''')
+        inserted, updated = cur.fetchone()
+        conn.commit()
+        cur.close()
+    invalidate("customers")
+    return {"staged": staged, "inserted": inserted, "updated": updated,
+            "duplicates": staged - inserted - updated, "rejected": rejected}
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Bulk import products or customers")
+    parser.add_argument("kind", choices=["products", "customers"])
+    parser.add_argument("path", help="CSV file with a header row, or .jsonl")
+    parser.add_argument("--rejects", help="write rejected rows to this CSV file")
+    args = parser.parse_args(argv)
+
+    migrate()
+    importer = import_products if args.kind == "products" else import_customers
+    result = importer(read_records(args.path))
+    print(f"Staged {result['staged']} rows: {result['inserted']} inserted, "
+          f"{result['updated']} updated, {result['duplicates']} superseded by a later row, "
+          f"{len(result['rejected'])} rejected")
+    if args.rejects:
+        with open(args.rejects, "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(["line", "reason"])
+            writer.writerows(result["rejected"])
+    else:
+        for line_no, reason in result["rejected"][:20]:
+            print(f"  line {line_no}: {reason}")
+        if len(result["rejected"]) > 20:
+            print(f"  ... and {len(result['rejected']) - 20} more (use --rejects to save them all)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
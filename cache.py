@@ -0,0 +1,348 @@
+# Query result cache.
+# Read methods are wrapped with @cached_query(*tags); the result is kept for
+# a TTL under a key built from the function and its arguments. Write methods
+# call invalidate(table, ...) after committing, which drops every entry
+# tagged with those tables. Entries are evicted least-recently-used once the
+# byte budget is exceeded.
+#
+# Backends ([cache] backend in the settings):
+#   memory  per-process LRU (default)
+#   sqlite  a local SQLite file shared by every process on the machine, so a
+#           write from the CLI also invalidates the Streamlit app's entries
+# Writes that bypass the models (psql, another host) are only picked up when
+# the TTL runs out. Cached values are shared between callers: don't mutate them.
+# Coroutine functions (async_models.py) are cached the same way; the SQLite
+# backend is then called from a worker thread so it doesn't block the loop.
+
+import asyncio
+import functools
+import inspect
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from Database import settings
+
+
+class MemoryCache:
+    def __init__(self, max_bytes, ttl):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()   # key -> (value, size, expires, tags)
+        self._tags = {}                 # tag -> set of keys
+        self._versions = {}             # tag -> invalidation count
+        self._bytes = 0
+        self._counts = {"hits": 0, "misses": 0, "sets": 0, "evictions": 0,
+                        "expirations": 0, "invalidations": 0}
+
+    def get(self, key):
+        # Returns (found, value)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._counts["misses"] += 1
+                return False, None
+            if entry[2] <= time.monotonic():
+                self._remove(key)
+                self._counts["expirations"] += 1
+                self._counts["misses"] += 1
+                return False, None
+            self._entries.move_to_end(key)
+            self._counts["hits"] += 1
+            return True, entry[0]
+
+    def versions(self, tags):
+        with self._lock:
+            return tuple(self._versions.get(tag, 0) for tag in tags)
+
+    def set(self, key, value, tags, ttl=None, versions=None):
+        # versions comes from versions(tags) taken before the value was loaded;
+        # if a tag was invalidated meanwhile the value may be stale and is dropped.
+        size = len(pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if versions is not None and versions != tuple(self._versions.get(tag, 0) for tag in tags):
+                return
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, size, time.monotonic() + (self.ttl if ttl is None else ttl), tuple(tags))
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add(key)
+            self._bytes += size
+            self._counts["sets"] += 1
+            while self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self._counts["evictions"] += 1
+
+    def _remove(self, key):
+        value, size, expires, tags = self._entries.pop(key)
+        self._bytes -= size
+        for tag in tags:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+    def invalidate(self, tags):
+        with self._lock:
+            for tag in tags:
+                self._versions[tag] = self._versions.get(tag, 0) + 1
+                for key in list(self._tags.get(tag, ())):
+                    self._remove(key)
+                    self._counts["invalidations"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._tags.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counts)
+            stats.update(backend="memory", entries=len(self._entries), bytes=self._bytes,
+                         max_bytes=self.max_bytes)
+        return stats
+
+
+class SQLiteCache:
+    # Same interface as MemoryCache, stored in a SQLite file. Hit/miss counts
+    # are per process; entries, bytes and tag versions are shared.
+    def __init__(self, path, max_bytes, ttl):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute('''CREATE TABLE IF NOT EXISTS cache_entries (
+            key TEXT PRIMARY KEY,
+            value BLOB NOT NULL,
+            size INTEGER NOT NULL,
+            expires REAL NOT NULL,
+            last_used REAL NOT NULL
+        )''')
+        self._db.execute('CREATE INDEX IF NOT EXISTS cache_entries_last_used_idx ON cache_entries (last_used)')
+        self._db.execute('''CREATE TABLE IF NOT EXISTS cache_tags (
+            tag TEXT NOT NULL,
+            key TEXT NOT NULL,
+            PRIMARY KEY (tag, key)
+        )''')
+        self._db.execute('CREATE INDEX IF NOT EXISTS cache_tags_key_idx ON cache_tags (key)')
+        self._db.execute('''CREATE TABLE IF NOT EXISTS cache_versions (
+            tag TEXT PRIMARY KEY,
+            version INTEGER NOT NULL
+        )''')
+        self._counts = {"hits": 0, "misses": 0, "sets": 0, "evictions": 0,
+                        "expirations": 0, "invalidations": 0}
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            row = self._db.execute('SELECT value, expires FROM cache_entries WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                self._counts["misses"] += 1
+                return False, None
+            if row[1] <= now:
+                self._db.execute('BEGIN IMMEDIATE')
+                self._delete(key)
+                self._db.execute('COMMIT')
+                self._counts["expirations"] += 1
+                self._counts["misses"] += 1
+                return False, None
+            self._db.execute('UPDATE cache_entries SET last_used = ? WHERE key = ?', (now, key))
+            self._counts["hits"] += 1
+        return True, pickle.loads(row[0])
+
+    def _versions(self, tags):
+        found = dict(self._db.execute(
+            f'SELECT tag, version FROM cache_versions WHERE tag IN ({",".join("?" * len(tags))})', tags).fetchall()) if tags else {}
+        return tuple(found.get(tag, 0) for tag in tags)
+
+    def versions(self, tags):
+        with self._lock:
+            return self._versions(tuple(tags))
+
+    def _delete(self, key):
+        self._db.execute('DELETE FROM cache_entries WHERE key = ?', (key,))
+        self._db.execute('DELETE FROM cache_tags WHERE key = ?', (key,))
+
+    def set(self, key, value, tags, ttl=None, versions=None):
+        blob = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        if len(blob) > self.max_bytes:
+            return
+        tags = tuple(tags)
+        now = time.time()
+        with self._lock:
+            self._db.execute('BEGIN IMMEDIATE')
+            try:
+                if versions is not None and versions != self._versions(tags):
+                    self._db.execute('ROLLBACK')
+                    return
+                self._delete(key)
+                self._db.execute('INSERT INTO cache_entries (key, value, size, expires, last_used) VALUES (?, ?, ?, ?, ?)',
+                                 (key, blob, len(blob), now + (self.ttl if ttl is None else ttl), now))
+                self._db.executemany('INSERT INTO cache_tags (tag, key) VALUES (?, ?)', [(tag, key) for tag in tags])
+                total = self._db.execute('SELECT COALESCE(SUM(size), 0) FROM cache_entries').fetchone()[0]
+                if total > self.max_bytes:
+                    # Expired entries go first, then the least recently used
+                    for old_key, size in self._db.execute(
+                            'SELECT key, size FROM cache_entries ORDER BY expires > ?, last_used', (now,)).fetchall():
+                        if total <= self.max_bytes:
+                            break
+                        self._delete(old_key)
+                        total -= size
+                        self._counts["evictions"] += 1
+                self._db.execute('COMMIT')
+                self._counts["sets"] += 1
+            except Exception:
+                self._db.execute('ROLLBACK')
+                raise
+
+    def invalidate(self, tags):
+        tags = tuple(tags)
+        if not tags:
+            return
+        marks = ",".join("?" * len(tags))
+        with self._lock:
+            self._db.execute('BEGIN IMMEDIATE')
+            try:
+                self._db.executemany('''INSERT INTO cache_versions (tag, version) VALUES (?, 1)
+                                        ON CONFLICT (tag) DO UPDATE SET version = version + 1''',
+                                     [(tag,) for tag in tags])
+                removed = self._db.execute(
+                    f'DELETE FROM cache_entries WHERE key IN (SELECT key FROM cache_tags WHERE tag IN ({marks}))',
+                    tags).rowcount
+                self._db.execute(
+                    f'DELETE FROM cache_tags WHERE key NOT IN (SELECT key FROM cache_entries)')
+                self._db.execute('COMMIT')
+                self._counts["invalidations"] += max(removed, 0)
+            except Exception:
+                self._db.execute('ROLLBACK')
+                raise
+
+    def clear(self):
+        with self._lock:
+            self._db.execute('DELETE FROM cache_entries')
+            self._db.execute('DELETE FROM cache_tags')
+
+    def stats(self):
+        with self._lock:
+            entries, size = self._db.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM cache_entries').fetchone()
+            stats = dict(self._counts)
+        stats.update(backend="sqlite", entries=entries, bytes=size, max_bytes=self.max_bytes)
+        return stats
+
+
+_cache = None
+_cache_lock = threading.Lock()
+_inherited = []
+
+
+def _reset_after_fork():
+    # A forked process starts with its own cache: an SQLite connection must
+    # not be used across a fork. The inherited one is kept referenced so it
+    # isn't closed from the child.
+    global _cache, _cache_lock
+    if _cache is not None:
+        _inherited.append(_cache)
+    _cache = None
+    _cache_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def get_cache():
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                opts = settings["cache"]
+                max_bytes = int(opts["max_bytes"])
+                ttl = float(opts["ttl"])
+                if opts["backend"] == "memory":
+                    _cache = MemoryCache(max_bytes, ttl)
+                elif opts["backend"] == "sqlite":
+                    path = opts["path"] or os.path.join(os.path.dirname(os.path.abspath(__file__)), ".query_cache.sqlite3")
+                    _cache = SQLiteCache(path, max_bytes, ttl)
+                else:
+                    raise ValueError(f"Unknown cache backend {opts['backend']!r}; use memory or sqlite")
+    return _cache
+
+
+def caching_enabled():
+    return settings["cache"]["enabled"].lower() in ("1", "true", "yes", "on")
+
+
+async def _cache_call(cache, method, *args):
+    # The memory backend only takes a lock; SQLite does file I/O
+    if isinstance(cache, MemoryCache):
+        return method(*args)
+    return await asyncio.to_thread(method, *args)
+
+
+def cached_query(*tags, ttl=None):
+    # Decorator for read functions; tags are the tables the result depends on.
+    def decorator(func):
+        name = f"{func.__module__}.{func.__qualname__}"
+
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                if not caching_enabled():
+                    return await func(*args, **kwargs)
+                cache = get_cache()
+                key = f"{name}:{args!r}:{sorted(kwargs.items())!r}"
+                found, value = await _cache_call(cache, cache.get, key)
+                if found:
+                    return value
+                versions = await _cache_call(cache, cache.versions, tags)
+                value = await func(*args, **kwargs)
+                await _cache_call(cache, cache.set, key, value, tags, ttl, versions)
+                return value
+            async_wrapper.uncached = func
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not caching_enabled():
+                return func(*args, **kwargs)
+            cache = get_cache()
+            key = f"{name}:{args!r}:{sorted(kwargs.items())!r}"
+            found, value = cache.get(key)
+            if found:
+                return value
+            versions = cache.versions(tags)
+            value = func(*args, **kwargs)
+            cache.set(key, value, tags, ttl, versions)
+            return value
+        wrapper.uncached = func
+        return wrapper
+    return decorator
+
+
+def invalidate(*tags):
+    # Call after committing a write to any of the tagged tables
+    if _cache is not None or settings["cache"]["backend"] != "memory":
+        get_cache().invalidate(tags)
+
+
+def clear_cache():
+    if _cache is not None:
+        _cache.clear()
+
+
+def cache_stats():
+    if _cache is None and settings["cache"]["backend"] == "memory":
+        return {"hits": 0, "misses": 0, "sets": 0, "evictions": 0, "expirations": 0,
+                "invalidations": 0, "backend": "memory", "entries": 0, "bytes": 0,
+                "max_bytes": int(settings["cache"]["max_bytes"])}
+    return get_cache().stats()
@@ -0,0 +1,371 @@
+# In-memory product catalog for the sale screen.
+# Products are loaded once into parallel arrays (id, price in cents, stock)
+# and lists (name, sku), with:
+#   - an id -> position array, for O(1) lookup by id
+#   - a sku -> position dict, for barcode / SKU lookup
+#   - word postings and a sorted vocabulary, for prefix search on any word
+#     of the name
+#   - a trigram index over the vocabulary, for typo-tolerant search
+# refresh() applies only the rows changed since the last load, using the
+# products.updated_xid column and the products_deleted tombstones (migration 8).
+#
+#   catalog = get_catalog()
+#   catalog.get(42); catalog.by_sku("8901234567890"); catalog.search("choc bar")
+
+import bisect
+import heapq
+import re
+import threading
+import time
+from array import array
+from collections import Counter
+from decimal import Decimal
+
+from Database import get_connection, iter_query
+
+REFRESH_INTERVAL = 2.0     # seconds; get_catalog() refreshes at most this often
+
+_WORD = re.compile(r"[0-9a-z]+")
+
+
+def _words(text):
+    return _WORD.findall(text.lower()) if text else []
+
+
+def _trigrams(word):
+    padded = f"  {word} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _max_edits(word):
+    # Short words match too much with a typo allowed
+    if len(word) < 4:
+        return 0
+    return 1 if len(word) < 8 else 2
+
+
+def _within_edits(a, b, limit):
+    # Levenshtein distance <= limit, giving up as soon as a row exceeds it
+    if abs(len(a) - len(b)) > limit:
+        return False
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+        if min(current) > limit:
+            return False
+        previous = current
+    return previous[-1] <= limit
+
+
+def _cents(price):
+    return int((Decimal(str(price)) * 100).to_integral_value())
+
+
+class CatalogEntry:
+    __slots__ = ("id", "sku", "name", "price", "quantity")
+
+    def __init__(self, product_id, sku, name, price, quantity):
+        self.id = product_id
+        self.sku = sku
+        self.name = name
+        self.price = price
+        self.quantity = quantity
+
+    def __repr__(self):
+        return f"CatalogEntry(id={self.id}, sku={self.sku!r}, name={self.name!r}, price={self.price}, quantity={self.quantity})"
+
+
+class ProductCatalog:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._ids = array('i')           # 0 marks a free slot
+        self._prices = array('q')        # cents
+        self._quantities = array('q')
+        self._names = []
+        self._skus = []
+        self._free = []
+        self._pos_by_id = array('i')     # product id -> position, -1 if absent
+        self._by_sku = {}
+        self._postings = {}              # word -> array of positions
+        self._vocab = []                 # sorted words, for prefix ranges
+        self._trigram_words = {}         # trigram -> set of (non-numeric) words
+        self._count = 0
+        self._watermark = None
+        self._refreshed_at = 0.0
+
+    @classmethod
+    def from_rows(cls, rows):
+        # rows: (id, sku, name, price, quantity)
+        catalog = cls()
+        with catalog._lock:
+            for row in rows:
+                catalog._insert(*row, index_vocab=False)
+            catalog._vocab = sorted(catalog._postings)
+            for word in catalog._vocab:
+                catalog._index_trigrams(word)
+        return catalog
+
+    # ---------- loading ----------
+
+    def _read_watermark(self, cur):
+        # Changes are read from this transaction id on next time: the oldest
+        # one still running when this snapshot was taken. Every writer below
+        # it has finished and is visible now; the rest are read again.
+        cur.execute('SELECT pg_snapshot_xmin(pg_current_snapshot())')
+        return cur.fetchone()[0]
+
+    def load(self):
+        with get_connection() as conn:
+            cur = conn.cursor()
+            watermark = self._read_watermark(cur)
+            conn.commit()
+            cur.close()
+        fresh = ProductCatalog.from_rows(
+            iter_query('SELECT id, sku, name, price, quantity FROM products ORDER BY id'))
+        with self._lock:
+            for name in ("_ids", "_prices", "_quantities", "_names", "_skus", "_free", "_pos_by_id",
+                         "_by_sku", "_postings", "_vocab", "_trigram_words", "_count"):
+                setattr(self, name, getattr(fresh, name))
+            self._watermark = watermark
+            self._refreshed_at = time.monotonic()
+
+    def refresh(self, force=False):
+        # Apply products inserted, updated or deleted since the last load or
+        # refresh. Returns the number of changed rows.
+        if self._watermark is None:
+            self.load()
+            return self._count
+        if not force and time.monotonic() - self._refreshed_at < REFRESH_INTERVAL:
+            return 0
+        with get_connection() as conn:
+            cur = conn.cursor()
+            watermark = self._read_watermark(cur)
+            cur.execute('SELECT product_id FROM products_deleted WHERE deleted_xid >= %s::xid8', (self._watermark,))
+            deleted = [row[0] for row in cur.fetchall()]
+            cur.execute('''SELECT id, sku, name, price, quantity FROM products
+                           WHERE updated_xid >= %s::xid8''', (self._watermark,))
+            changed = cur.fetchall()
+            conn.commit()
+            cur.close()
+        with self._lock:
+            for product_id in deleted:
+                self._remove(product_id)
+            for row in changed:
+                self._put(*row)
+            self._watermark = watermark
+            self._refreshed_at = time.monotonic()
+        return len(deleted) + len(changed)
+
+    # ---------- maintenance of the arrays and indexes ----------
+
+    def _position(self, product_id):
+        if 0 < product_id < len(self._pos_by_id):
+            return self._pos_by_id[product_id]
+        return -1
+
+    def _insert(self, product_id, sku, name, price, quantity, index_vocab=True):
+        if self._free:
+            pos = self._free.pop()
+            self._ids[pos] = product_id
+            self._prices[pos] = _cents(price)
+            self._quantities[pos] = quantity
+            self._names[pos] = name
+            self._skus[pos] = sku
+        else:
+            pos = len(self._ids)
+            self._ids.append(product_id)
+            self._prices.append(_cents(price))
+            self._quantities.append(quantity)
+            self._names.append(name)
+            self._skus.append(sku)
+        if product_id >= len(self._pos_by_id):
+            self._pos_by_id.extend([-1] * (product_id + 1 - len(self._pos_by_id)))
+        self._pos_by_id[product_id] = pos
+        if sku:
+            self._by_sku[sku] = pos
+        self._add_words(pos, name, index_vocab)
+        self._count += 1
+
+    def _put(self, product_id, sku, name, price, quantity):
+        pos = self._position(product_id)
+        if pos < 0:
+            self._insert(product_id, sku, name, price, quantity)
+            return
+        if self._skus[pos] != sku:
+            if self._skus[pos] and self._by_sku.get(self._skus[pos]) == pos:
+                del self._by_sku[self._skus[pos]]
+            if sku:
+                self._by_sku[sku] = pos
+            self._skus[pos] = sku
+        if self._names[pos] != name:
+            self._remove_words(pos, self._names[pos])
+            self._names[pos] = name
+            self._add_words(pos, name, True)
+        self._prices[pos] = _cents(price)
+        self._quantities[pos] = quantity
+
+    def _remove(self, product_id):
+        pos = self._position(product_id)
+        if pos < 0:
+            return
+        if self._skus[pos] and self._by_sku.get(self._skus[pos]) == pos:
+            del self._by_sku[self._skus[pos]]
+        self._remove_words(pos, self._names[pos])
+        self._pos_by_id[product_id] = -1
+        self._ids[pos] = 0
+        self._names[pos] = None
+        self._skus[pos] = None
+        self._free.append(pos)
+        self._count -= 1
+
+    def _add_words(self, pos, name, index_vocab):
+        for word in set(_words(name)):
+            postings = self._postings.get(word)
+            if postings is None:
+                self._postings[word] = array('i', [pos])
+                if index_vocab:
+                    bisect.insort(self._vocab, word)
+                    self._index_trigrams(word)
+            else:
+                postings.append(pos)
+
+    def _remove_words(self, pos, name):
+        for word in set(_words(name)):
+            postings = self._postings.get(word)
+            if postings is None:
+                continue
+            postings.remove(pos)
+            if not postings:
+                del self._postings[word]
+                del self._vocab[bisect.bisect_left(self._vocab, word)]
+                if not word.isdigit():
+                    for trigram in _trigrams(word):
+                        words = self._trigram_words[trigram]
+                        words.discard(word)
+                        if not words:
+                            del self._trigram_words[trigram]
+
+    def _index_trigrams(self, word):
+        # Numbers are only matched by prefix
+        if word.isdigit():
+            return
+        for trigram in _trigrams(word):
+            self._trigram_words.setdefault(trigram, set()).add(word)
+
+    # ---------- lookups ----------
+
+    def _entry(self, pos):
+        return CatalogEntry(self._ids[pos], self._skus[pos], self._names[pos],
+                            Decimal(self._prices[pos]).scaleb(-2), self._quantities[pos])
+
+    def __len__(self):
+        return self._count
+
+    def get(self, product_id):
+        with self._lock:
+            pos = self._position(product_id)
+            return self._entry(pos) if pos >= 0 else None
+
+    def by_sku(self, sku):
+        with self._lock:
+            pos = self._by_sku.get(sku)
+            return self._entry(pos) if pos is not None else None
+
+    def _prefix_words(self, prefix):
+        i = bisect.bisect_left(self._vocab, prefix)
+        words = []
+        while i < len(self._vocab) and self._vocab[i].startswith(prefix):
+            words.append(self._vocab[i])
+            i += 1
+        return words
+
+    def _fuzzy_words(self, word):
+        limit = _max_edits(word)
+        if not limit:
+            return []
+        trigrams = _trigrams(word)
+        # Each edit changes at most three trigrams
+        needed = len(trigrams) - 3 * limit
+        shared = Counter()
+        for trigram in trigrams:
+            shared.update(self._trigram_words.get(trigram, ()))
+        return [candidate for candidate, count in shared.items()
+                if count >= needed and _within_edits(word, candidate, limit)]
+
+    def search(self, query, limit=20, fuzzy=True):
+        # Products whose name has a word starting with each query word; a query
+        # word with no such match is retried allowing typos. An exact SKU or
+        # id match comes first. An empty query lists the first products by id.
+        query = (query or "").strip()
+        with self._lock:
+            if not query:
+                # Slots are reused after deletes, so walk the id index instead
+                results = []
+                for pos in self._pos_by_id:
+                    if len(results) >= limit:
+                        break
+                    if pos >= 0:
+                        results.append(self._entry(pos))
+                return results
+            exact = []
+            pos = self._by_sku.get(query)
+            if pos is not None:
+                exact.append(pos)
+            if query.isdigit() and self._position(int(query)) >= 0:
+                exact.append(self._position(int(query)))
+
+            matches = []        # vocabulary words matching each query word
+            for word in _words(query):
+                words = self._prefix_words(word)
+                if not words and fuzzy:
+                    words = self._fuzzy_words(word)
+                if not words:
+                    matches = None
+                    break
+                matches.append(words)
+
+            found = []
+            if matches:
+                # Start from the rarest query word, then check the others against
+                # each candidate's own words
+                matches.sort(key=lambda words: sum(len(self._postings[w]) for w in words))
+                first, rest = matches[0], [set(words) for words in matches[1:]]
+                candidates = set()
+                for word in first:
+                    candidates.update(self._postings[word])
+                if rest:
+                    candidates = [pos for pos in candidates
+                                  if all(words.intersection(_words(self._names[pos])) for words in rest)]
+                lowered = query.lower()
+                found = heapq.nsmallest(
+                    limit, candidates,
+                    key=lambda pos: (not self._names[pos].lower().startswith(lowered),
+                                     len(self._names[pos]), self._names[pos].lower(), pos))
+
+            seen = set()
+            results = []
+            for pos in exact + found:
+                if pos not in seen:
+                    seen.add(pos)
+                    results.append(self._entry(pos))
+            return results[:limit]
+
+
+_catalog = None
+_catalog_lock = threading.Lock()
+
+
+def get_catalog():
+    # The shared catalog, loaded on first use and refreshed at most every
+    # REFRESH_INTERVAL seconds
+    global _catalog
+    with _catalog_lock:
+        if _catalog is None:
+            catalog = ProductCatalog()
+            catalog.load()
+            _catalog = catalog
+        else:
+            _catalog.refresh()
+    return _catalog
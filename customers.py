@@ -6,88 +6,107 @@
 # Analytics / Helpers: Get sales by customer, search customer
 
 import psycopg2
-from Database import conn
+from Database import get_connection, iter_query
+from cache import cached_query, invalidate
+from pagination import DEFAULT_PAGE_SIZE, check_sort_key, fetch_page, print_pages
+from queries import (CUSTOMERS_PAGE, DELETE_CUSTOMER, INSERT_CUSTOMER, SALES_BY_CUSTOMER, SEARCH_CUSTOMERS,
+                     SELECT_CUSTOMER, SELECT_CUSTOMERS, update_query)
+from records import CustomerRecord, SaleRecord, record_cursor
 class Customer:
-    def __init__(self, name, contact):
-        self.name = name
-        self.contact = contact
+    SORT_KEYS = ("id", "name")
+
     def create_table():
-        cur = conn.cursor()
-        cur.execute('''CREATE TABLE IF NOT EXISTS customers (
-            id SERIAL PRIMARY KEY,
-            name VARCHAR(100) NOT NULL,
-            contact VARCHAR(100) NOT NULL
-        )''')
-        conn.commit()
-        cur.close()
+        with get_connection() as conn:
+            cur = conn.cursor()
+            cur.execute('''CREATE TABLE IF NOT EXISTS customers (
+                id SERIAL PRIMARY KEY,
+                name VARCHAR(100) NOT NULL,
+                contact VARCHAR(100) NOT NULL
+            )''')
+            conn.commit()
+            cur.close()
     def insert_customer(name, contact):
-        cur = conn.cursor()
-        cur.execute('''INSERT INTO customers (name, contact)
-                       VALUES (%s, %s)''',
-                    (name, contact))
-        conn.commit()
-        cur.close()
+        with get_connection() as conn:
+            cur = conn.cursor()
+            cur.execute(INSERT_CUSTOMER, (name, contact))
+            customer_id = cur.fetchone()[0]
+            conn.commit()
+            cur.close()
+        invalidate("customers")
+        return customer_id
     def update_customer(customer_id, name=None, contact=None):
-        cur = conn.cursor()
-        cur.execute('SELECT * FROM customers WHERE id = %s', (customer_id,))
-        customer = cur.fetchone()
-        if not customer:
-            print("Customer not found")
+        with get_connection() as conn:
+            cur = conn.cursor()
+            cur.execute('SELECT * FROM customers WHERE id = %s', (customer_id,))
+            customer = cur.fetchone()
+            if not customer:
+                print("Customer not found")
+                cur.close()
+                return
+            sql, values = update_query("customers", [("name", name), ("contact", contact)], customer_id)
+            if sql:
+                cur.execute(sql, values)
+            conn.commit()
             cur.close()
-            return
-        update_fields = []
-        if name:
-            update_fields.append(f"name = '{name}'")
-        if contact:
-                update_fields.append(f"contact = '{contact}'")
-        update_query = f"UPDATE customers SET {', '.join(update_fields)} WHERE id = %s"
-        cur.execute(update_query, (customer_id,))
-        conn.commit()
-        cur.close()
+        invalidate("customers")
     def delete_customer(customer_id):
-        cur = conn.cursor()
-        cur.execute('DELETE FROM customers WHERE id = %s', (customer_id,))
-        conn.commit()
-        cur.close()
+        with get_connection() as conn:
+            cur = conn.cursor()
+            cur.execute(DELETE_CUSTOMER, (customer_id,))
+            conn.commit()
+            cur.close()
+        invalidate("customers")
+    @cached_query("customers")
     def get_all_customers():
-        cur = conn.cursor()
-        cur.execute('SELECT * FROM customers')
-        customers = cur.fetchall()
-        cur.close()
-        return customers
+        with get_connection() as conn:
+            cur = record_cursor(conn, CustomerRecord)
+            cur.execute(SELECT_CUSTOMERS)
+            customers = cur.fetchall()
+            cur.close()
+            return customers
     
+    def iter_customers(itersize=None):
+        # Streams every customer in id order with constant memory
+        return iter_query(f'{SELECT_CUSTOMERS} ORDER BY id',
+                          itersize=itersize, record=CustomerRecord)
+
+    @cached_query("customers")
+    def get_customers_page(page_size=DEFAULT_PAGE_SIZE, after=None, sort_key="id", descending=False):
+        # Returns (rows, next_after); pass next_after back for the next page
+        check_sort_key(sort_key, Customer.SORT_KEYS)
+        return fetch_page(CUSTOMERS_PAGE, "c", sort_key, after, page_size, descending, record=CustomerRecord)
+
     def view_customers():
-        cur = conn.cursor()
-        cur.execute('SELECT * FROM customers')
-        customers = cur.fetchall()
-        for customer in customers:
-            print(customer)
-        cur.close()
+        print_pages(Customer.get_customers_page)
     def view_customer_by_id(customer_id):
-        cur = conn.cursor()
-        cur.execute('SELECT * FROM customers WHERE id = %s', (customer_id,))
-        customer = cur.fetchone()
-        if customer:
-            print(customer)
-        else:
-            print("Customer not found")
-        cur.close()
+        with get_connection() as conn:
+            cur = record_cursor(conn, CustomerRecord)
+            cur.execute(SELECT_CUSTOMER, (customer_id,))
+            customer = cur.fetchone()
+            if customer:
+                print(customer)
+            else:
+                print("Customer not found")
+            cur.close()
+            return customer
     def get_sales_by_customer(customer_id):
-        cur = conn.cursor()
-        cur.execute('''SELECT s.id, s.date, s.total_amount FROM sales s
-                       JOIN customers c ON s.customer_id = c.id
-                       WHERE c.id = %s''', (customer_id,))
-        sales = cur.fetchall()
-        for sale in sales:
-            print(sale)
-        cur.close()
+        with get_connection() as conn:
+            cur = record_cursor(conn, SaleRecord)
+            cur.execute(SALES_BY_CUSTOMER, (customer_id,))
+            sales = cur.fetchall()
+            for sale in sales:
+                print(sale)
+            cur.close()
+            return sales
     def search_customer(name):
-        cur = conn.cursor()
-        cur.execute('SELECT * FROM customers WHERE name ILIKE %s', ('%' + name + '%',))
-        customers = cur.fetchall()
-        for customer in customers:
-            print(customer)
-        cur.close()
+        with get_connection() as conn:
+            cur = record_cursor(conn, CustomerRecord)
+            cur.execute(SEARCH_CUSTOMERS, ('%' + name + '%',))
+            customers = cur.fetchall()
+            for customer in customers:
+                print(customer)
+            cur.close()
+            return customers
 # Menu
     def customer_menu():
         while True:
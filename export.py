@@ -0,0 +1,261 @@
+# Sales history export to Parquet for offline reporting.
+#
+#   python export.py exports/                 # new sales since the last run
+#   python export.py exports/ --full          # everything, replacing the old files
+#
+# One row per sale line: the sale joined with its items, the product and the
+# customer (a sale without items gives one row with empty item columns).
+# Files are partitioned by the month of the sale date, Hive style, so pyarrow,
+# pandas, DuckDB or Spark can read the directory as one dataset:
+#   exports/month=2024-05/part-20240601T020000123456-0001.parquet
+#
+# Rows are streamed from a server-side cursor in sale id order and buffered
+# per month up to --batch-rows rows in total, so memory is bounded whatever
+# the size of the history. At most MAX_OPEN_FILES part files are open at
+# once; a month that comes round again after its file was closed gets a new
+# part file.
+#
+# Runs are incremental: _export_state.json records the highest sale id
+# exported, and the next run exports only sales above it. Like analytics.py,
+# this treats sales as append-only, as checkout writes them; sale ids missing
+# just below the newest (transactions still open during the run) are
+# re-checked by the runs of the next GAP_TTL seconds. A run writes .tmp
+# files and renames them only after the new state is saved, so an interrupted
+# run leaves no partial data and is simply repeated.
+
+import argparse
+import glob
+import itertools
+import json
+import os
+import sys
+import time
+from datetime import datetime
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from Database import get_connection
+
+STATE_FILE = "_export_state.json"
+BATCH_ROWS = 50000         # rows buffered across all months before a flush
+FETCH_ROWS = 5000          # rows per round trip from the server-side cursor
+MAX_OPEN_FILES = 16
+GAP_WINDOW = 10000         # missing sale ids this close to the newest are re-checked
+GAP_TTL = 86400.0          # seconds before a missing sale id is taken as rolled back
+
+SCHEMA = pa.schema([
+    ("sale_id", pa.int32()),
+    ("sale_date", pa.date32()),
+    ("customer_id", pa.int32()),
+    ("customer_name", pa.string()),
+    ("customer_contact", pa.string()),
+    ("sale_total", pa.decimal128(10, 2)),
+    ("item_id", pa.int32()),
+    ("product_id", pa.int32()),
+    ("sku", pa.string()),
+    ("product_name", pa.string()),
+    ("quantity", pa.int32()),
+    ("price", pa.decimal128(10, 2)),
+    ("line_total", pa.decimal128(20, 2)),
+])
+
+EXPORT_QUERY = '''SELECT s.id, s.date, s.customer_id, c.name, c.contact, s.total_amount,
+                         si.id, si.product_id, p.sku, p.name, si.quantity, si.price,
+                         si.quantity * si.price
+                  FROM sales s
+                  LEFT JOIN sale_items si ON si.sale_id = s.id
+                  LEFT JOIN customers c ON c.id = s.customer_id
+                  LEFT JOIN products p ON p.id = si.product_id
+                  WHERE s.id > %s OR s.id = ANY(%s)
+                  ORDER BY s.id, si.id'''
+
+
+def load_state(directory):
+    path = os.path.join(directory, STATE_FILE)
+    if not os.path.exists(path):
+        return {"last_sale_id": 0, "pending": {}, "last_run": None}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_state(directory, state):
+    # Replaced atomically, so a crash leaves the old state or the new one
+    path = os.path.join(directory, STATE_FILE)
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(state, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def recover(directory, state):
+    # Finish the renames (and, after --full, the removals) of a run whose
+    # state was saved, and drop the .tmp files of a run that never got that far
+    run = state.get("last_run") or {}
+    for path in run.get("files", []):
+        full = os.path.join(directory, path)
+        if os.path.exists(full + ".tmp"):
+            os.replace(full + ".tmp", full)
+    for path in run.get("replaces", []):
+        full = os.path.join(directory, path)
+        if os.path.exists(full):
+            os.remove(full)
+    for tmp in glob.glob(os.path.join(directory, "month=*", "*.parquet.tmp")):
+        os.remove(tmp)
+
+
+class PartitionWriter:
+    # Month -> buffered rows and open ParquetWriter, flushing the largest
+    # buffer whenever batch_rows rows are held in total
+    def __init__(self, directory, run_id, batch_rows=BATCH_ROWS, max_open=MAX_OPEN_FILES):
+        self.directory = directory
+        self.run_id = run_id
+        self.batch_rows = batch_rows
+        self.max_open = max_open
+        self.buffers = {}
+        self.buffered = 0
+        self.writers = {}          # month -> (writer, path); insertion order is LRU
+        self.files = []
+        self.rows = 0
+        self._parts = itertools.count(1)
+
+    def add(self, month, row):
+        self.buffers.setdefault(month, []).append(row)
+        self.buffered += 1
+        if self.buffered >= self.batch_rows:
+            self.flush(max(self.buffers, key=lambda key: len(self.buffers[key])))
+
+    def flush(self, month):
+        rows = self.buffers.pop(month, None)
+        if not rows:
+            return
+        self.buffered -= len(rows)
+        columns = list(zip(*rows))
+        table = pa.Table.from_arrays([pa.array(column, type=field.type) for column, field in zip(columns, SCHEMA)],
+                                     schema=SCHEMA)
+        self._writer(month).write_table(table)
+        self.rows += len(rows)
+
+    def _writer(self, month):
+        if month in self.writers:
+            self.writers[month] = self.writers.pop(month)     # most recently used
+            return self.writers[month][0]
+        if len(self.writers) >= self.max_open:
+            self._close(next(iter(self.writers)))
+        relative = os.path.join(f"month={month}", f"part-{self.run_id}-{next(self._parts):04d}.parquet")
+        path = os.path.join(self.directory, relative)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        writer = pq.ParquetWriter(path + ".tmp", SCHEMA, compression="zstd")
+        self.writers[month] = (writer, path)
+        self.files.append(relative)
+        return writer
+
+    def _close(self, month):
+        writer, _ = self.writers.pop(month)
+        writer.close()
+
+    def close(self):
+        for month in list(self.buffers):
+            self.flush(month)
+        for month in list(self.writers):
+            self._close(month)
+
+    def discard(self):
+        for writer, path in self.writers.values():
+            writer.close()
+        self.writers.clear()
+        for relative in self.files:
+            tmp = os.path.join(self.directory, relative + ".tmp")
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+
+def export_sales(directory, full=False, batch_rows=BATCH_ROWS):
+    # Export sales above the watermark (all of them with full=True); returns
+    # a summary of the run
+    os.makedirs(directory, exist_ok=True)
+    state = load_state(directory)
+    recover(directory, state)
+    if full:
+        previous = sorted(os.path.relpath(path, directory)
+                          for path in glob.glob(os.path.join(directory, "month=*", "*.parquet")))
+        state = {"last_sale_id": 0, "pending": {}, "last_run": None}
+    else:
+        previous = []
+
+    started = time.time()
+    run_id = datetime.fromtimestamp(started).strftime("%Y%m%dT%H%M%S%f")
+    last_sale_id = state["last_sale_id"]
+    pending = {int(sale_id): seen for sale_id, seen in state["pending"].items()
+               if started - seen <= GAP_TTL}
+    writer = PartitionWriter(directory, run_id, batch_rows)
+    sale_ids = []                  # exported sale ids above the old watermark
+    sales = 0
+    try:
+        with get_connection() as conn:
+            cur = conn.cursor(name=f"export_{run_id}")
+            cur.itersize = FETCH_ROWS
+            cur.execute(EXPORT_QUERY, (last_sale_id, sorted(pending)))
+            current = None
+            while True:
+                rows = cur.fetchmany(FETCH_ROWS)
+                if not rows:
+                    break
+                for row in rows:
+                    if row[0] != current:
+                        current = row[0]
+                        sales += 1
+                        pending.pop(current, None)
+                        if current > last_sale_id:
+                            sale_ids.append(current)
+                    writer.add(f"{row[1]:%Y-%m}", row)
+                # Only the ids near the newest are needed for the gap check
+                if len(sale_ids) > 2 * GAP_WINDOW:
+                    del sale_ids[:-GAP_WINDOW]
+            cur.close()
+            conn.rollback()
+        writer.close()
+    except BaseException:
+        writer.discard()
+        raise
+
+    if sale_ids:
+        new_last = sale_ids[-1]
+        low = max(last_sale_id, new_last - GAP_WINDOW)
+        present = set(sale_ids)
+        for missing in range(low + 1, new_last):
+            if missing not in present:
+                pending.setdefault(missing, started)
+    else:
+        new_last = last_sale_id
+
+    run = {"run_id": run_id, "full": full, "started": datetime.fromtimestamp(started).isoformat(timespec="seconds"),
+           "seconds": round(time.time() - started, 3), "sales": sales, "rows": writer.rows,
+           "files": writer.files, "replaces": previous}
+    state = {"last_sale_id": new_last, "pending": {str(sale_id): seen for sale_id, seen in sorted(pending.items())},
+             "last_run": run}
+    save_state(directory, state)
+    recover(directory, state)
+    return run
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export sales history to month-partitioned Parquet files.")
+    parser.add_argument("directory")
+    parser.add_argument("--full", action="store_true", help="export everything and replace the existing files")
+    parser.add_argument("--batch-rows", type=int, default=BATCH_ROWS, help="rows buffered before a flush")
+    args = parser.parse_args()
+
+    run = export_sales(args.directory, args.full, args.batch_rows)
+    if not run["files"]:
+        print("No new sales to export.")
+    else:
+        print(f"Exported {run['sales']} sales ({run['rows']} rows) to {len(run['files'])} files "
+              f"in {run['seconds']:.1f} s.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
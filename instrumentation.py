@@ -0,0 +1,315 @@
+# Query instrumentation.
+# Every connection from Database.py uses InstrumentedCursor (and RecordCursor
+# builds on it), so each statement is timed where it runs. Statements are
+# grouped by normalized SQL (literals replaced with ?), the caller that ran
+# them (Class.method, or the Streamlit page for page-level code) and the page,
+# with a count, rows, errors and a latency histogram per group.
+#
+# Statements slower than [instrumentation] slow_ms are written to the slow
+# query log (slow_log, or stderr when unset). When export_path or export_url
+# is set, a JSON snapshot of the groups is written / POSTed every
+# export_interval seconds.
+#
+#   python instrumentation.py report query_stats.json [--top 20]
+
+import bisect
+import contextlib
+import contextvars
+import json
+import os
+import re
+import sys
+import threading
+import time
+import urllib.request
+from datetime import datetime
+
+import psycopg2
+from psycopg2 import extensions
+
+# Upper bounds of the histogram buckets, in ms; the last bucket is unbounded
+BUCKETS_MS = (0.5, 1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+_enabled = True
+_slow_seconds = 0.25
+_slow_log = ""
+_export_path = ""
+_export_url = ""
+_export_interval = 60.0
+
+_lock = threading.Lock()
+_log_lock = threading.Lock()
+_stats = {}                   # (caller, page, sql) -> [count, seconds, max, rows, errors, buckets]
+_normalized = {}              # query text -> normalized SQL
+_exporter = None
+_page = contextvars.ContextVar("page", default=None)
+_timer = contextvars.ContextVar("db_timer", default=None)
+
+# Frames in these files are database plumbing, not callers
+_here = os.path.dirname(os.path.abspath(__file__))
+_PLUMBING = {os.path.join(_here, name) for name in
+             ("instrumentation.py", "records.py", "Database.py", "async_db.py", "cache.py", "pagination.py")}
+_PLUMBING.add(os.path.join(os.path.dirname(os.path.abspath(psycopg2.__file__)), "extras.py"))
+_PLUMBING.add(os.path.abspath(contextlib.__file__))
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+_PLACEHOLDER = re.compile(r"%s|%\(\w+\)s")
+_VALUES = re.compile(r"(VALUES\s*\([^()]*\))(?:\s*,\s*\([^()]*\))+")
+
+
+def configure(options):
+    # options: the [instrumentation] settings section
+    global _enabled, _slow_seconds, _slow_log, _export_path, _export_url, _export_interval
+    _enabled = options["enabled"].lower() in ("1", "true", "yes", "on")
+    _slow_seconds = float(options["slow_ms"]) / 1000
+    _slow_log = options["slow_log"]
+    _export_path = options["export_path"]
+    _export_url = options["export_url"]
+    _export_interval = float(options["export_interval"])
+
+
+def set_enabled(enabled):
+    global _enabled
+    _enabled = enabled
+
+
+def enabled():
+    return _enabled
+
+
+def set_page(page):
+    # Label the statements run from here on (in this thread / task) with a page
+    _page.set(page)
+
+
+def start_db_timer():
+    # Totals [seconds, statements] of the statements run from here on in this
+    # thread / task, until stop_db_timer(token)
+    timer = [0.0, 0]
+    return timer, _timer.set(timer)
+
+
+def stop_db_timer(token):
+    _timer.reset(token)
+
+
+def normalize(query):
+    # SQL with literals and placeholders as ?, value lists collapsed, and
+    # whitespace squeezed, so statements that differ only by values group together
+    text = _normalized.get(query)
+    if text is not None:
+        return text
+    raw = query.decode("utf-8", "replace") if isinstance(query, bytes) else str(query)
+    text = _STRING.sub("?", raw)
+    text = _VALUES.sub(r"\1, ...", text)
+    text = _NUMBER.sub("?", text)
+    text = _PLACEHOLDER.sub("?", text)
+    text = " ".join(text.split())
+    # Statements built with execute_values carry their values inline and
+    # are rarely repeated verbatim; only cache the parameterized ones
+    if isinstance(query, str):
+        if len(_normalized) >= 4096:
+            _normalized.clear()
+        _normalized[query] = text
+    return text
+
+
+def caller():
+    # Class.method (or module.function) of the first frame outside the
+    # database plumbing; code at module level is labelled with the page
+    frame = sys._getframe(1)
+    while frame is not None and frame.f_code.co_filename in _PLUMBING:
+        frame = frame.f_back
+    if frame is None:
+        return "?"
+    code = frame.f_code
+    name = getattr(code, "co_qualname", code.co_name)
+    if name == "<module>":
+        return _page.get() or os.path.basename(code.co_filename)
+    if "." not in name:
+        name = f"{os.path.splitext(os.path.basename(code.co_filename))[0]}.{name}"
+    return name
+
+
+def observe(query, seconds, rows, failed=False):
+    # Record one statement
+    sql = normalize(query)
+    who = caller()
+    page = _page.get()
+    bucket = bisect.bisect_left(BUCKETS_MS, seconds * 1000)
+    key = (who, page, sql)
+    with _lock:
+        entry = _stats.get(key)
+        if entry is None:
+            entry = _stats[key] = [0, 0.0, 0.0, 0, 0, [0] * (len(BUCKETS_MS) + 1)]
+        entry[0] += 1
+        entry[1] += seconds
+        if seconds > entry[2]:
+            entry[2] = seconds
+        entry[3] += rows if rows > 0 else 0
+        entry[4] += failed
+        entry[5][bucket] += 1
+    timer = _timer.get()
+    if timer is not None:
+        timer[0] += seconds
+        timer[1] += 1
+    if seconds >= _slow_seconds:
+        _log_slow(sql, seconds, rows, who, page, failed)
+    if _exporter is None and (_export_path or _export_url):
+        _start_exporter()
+
+
+def _log_slow(sql, seconds, rows, who, page, failed):
+    line = (f"{datetime.now().isoformat(timespec='milliseconds')} {seconds * 1000:.1f} ms rows={max(rows, 0)} "
+            f"caller={who}{f' page={page}' if page else ''}{' FAILED' if failed else ''} sql={sql}\n")
+    if not _slow_log:
+        sys.stderr.write(line)
+        return
+    with _log_lock:
+        with open(_slow_log, "a", encoding="utf-8") as f:
+            f.write(line)
+
+
+class InstrumentedCursor(extensions.cursor):
+    # Times execute, executemany and copy_expert. Async connections are timed
+    # by async_db instead: their execute returns before the query has run.
+    # For a server-side (named) cursor only the DECLARE is timed, not fetches.
+    def execute(self, query, params=None):
+        if not _enabled or self.connection.async_:
+            return super().execute(query, params)
+        start = time.perf_counter()
+        failed = True
+        try:
+            result = super().execute(query, params)
+            failed = False
+            return result
+        finally:
+            observe(query, time.perf_counter() - start, self.rowcount, failed)
+
+    def executemany(self, query, vars_list):
+        if not _enabled:
+            return super().executemany(query, vars_list)
+        start = time.perf_counter()
+        failed = True
+        try:
+            result = super().executemany(query, vars_list)
+            failed = False
+            return result
+        finally:
+            observe(query, time.perf_counter() - start, self.rowcount, failed)
+
+    def copy_expert(self, sql, file, size=8192):
+        if not _enabled:
+            return super().copy_expert(sql, file, size)
+        start = time.perf_counter()
+        failed = True
+        try:
+            result = super().copy_expert(sql, file, size)
+            failed = False
+            return result
+        finally:
+            observe(sql, time.perf_counter() - start, self.rowcount, failed)
+
+
+def _percentile(buckets, count, p):
+    # Upper bound (ms) of the bucket holding the p-th percentile
+    rank = p / 100 * count
+    seen = 0
+    for i, n in enumerate(buckets):
+        seen += n
+        if seen >= rank:
+            return BUCKETS_MS[i] if i < len(BUCKETS_MS) else float("inf")
+    return float("inf")
+
+
+def snapshot():
+    # One dict per statement group, most total time first
+    with _lock:
+        items = [(key, list(entry[:5]) + [list(entry[5])]) for key, entry in _stats.items()]
+    rows = []
+    for (who, page, sql), (count, seconds, longest, row_count, errors, buckets) in items:
+        rows.append({
+            "caller": who,
+            "page": page,
+            "sql": sql,
+            "count": count,
+            "total_ms": seconds * 1000,
+            "avg_ms": seconds / count * 1000,
+            "max_ms": longest * 1000,
+            "p50_ms": _percentile(buckets, count, 50),
+            "p95_ms": _percentile(buckets, count, 95),
+            "p99_ms": _percentile(buckets, count, 99),
+            "rows": row_count,
+            "errors": errors,
+            "histogram": buckets,
+        })
+    rows.sort(key=lambda row: row["total_ms"], reverse=True)
+    return rows
+
+
+def reset():
+    with _lock:
+        _stats.clear()
+
+
+def export(path=None, url=None):
+    # Write the snapshot to a JSON file (replaced atomically) and/or POST it
+    path = path or _export_path
+    url = url or _export_url
+    report = {"generated_at": datetime.now().isoformat(timespec="seconds"), "pid": os.getpid(),
+              "buckets_ms": list(BUCKETS_MS), "queries": snapshot()}
+    body = json.dumps(report, default=str)
+    if path:
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(body)
+        os.replace(tmp, path)
+    if url:
+        request = urllib.request.Request(url, data=body.encode("utf-8"), method="POST",
+                                         headers={"Content-Type": "application/json"})
+        with urllib.request.urlopen(request, timeout=10) as response:
+            response.read()
+    return report
+
+
+def _start_exporter():
+    global _exporter
+    with _lock:
+        if _exporter is not None:
+            return
+        _exporter = threading.Thread(target=_export_loop, name="query-stats-export", daemon=True)
+    _exporter.start()
+
+
+def _export_loop():
+    while True:
+        time.sleep(_export_interval)
+        try:
+            export()
+        except Exception as e:
+            print("Query stats export failed:", e)
+
+
+def print_report(queries, top=20):
+    print(f"{'count':>8} {'total ms':>10} {'avg ms':>8} {'p95 ms':>8} {'rows':>9}  caller / sql")
+    for row in queries[:top]:
+        print(f"{row['count']:>8} {row['total_ms']:>10.1f} {row['avg_ms']:>8.2f} {row['p95_ms']:>8} "
+              f"{row['rows']:>9}  {row['caller']}{' [' + row['page'] + ']' if row['page'] else ''}")
+        print(f"{'':>48}{row['sql'][:120]}")
+
+
+def main(argv):
+    if len(argv) < 2 or argv[0] != "report":
+        print("Usage: python instrumentation.py report query_stats.json [--top N]")
+        return 1
+    top = int(argv[argv.index("--top") + 1]) if "--top" in argv else 20
+    with open(argv[1], encoding="utf-8") as f:
+        report = json.load(f)
+    print(f"Exported {report['generated_at']} by pid {report['pid']}")
+    print_report(report["queries"], top)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -11,7 +11,7 @@
 #Analytical Queries
 
 import psycopg2
-from Database import conn
+import Database
 from customers import Customer
 from products import Product
 from sales import Sale
@@ -37,4 +37,6 @@ def main_menu():
             print("Invalid choice. Please try again.")
         
 if __name__ == "__main__":
+    if Database.warmup_enabled():
+        Database.warm_up(background=True)
     main_menu()
\ No newline at end of file
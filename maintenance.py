@@ -0,0 +1,83 @@
+# Maintenance tasks that are run by hand, not on every start-up.
+#
+#   python maintenance.py repair-sequences [table ...]
+#   python maintenance.py rebuild-daily-rollup [start-date end-date]
+#   python maintenance.py rebuild-product-sales
+
+import sys
+from Database import get_connection
+from cache import invalidate
+
+TABLES = ["customers", "products", "sales", "sale_items"]
+
+
+def repair_sequences(tables=TABLES):
+    # Move each table's id sequence past MAX(id), e.g. after rows were loaded
+    # with explicit ids. Sequences are never moved backwards, and the table is
+    # locked against inserts while its sequence is checked.
+    repaired = {}
+    with get_connection() as conn:
+        cur = conn.cursor()
+        for table in tables:
+            if table not in TABLES:
+                raise ValueError(f"Unknown table: {table}")
+            cur.execute(f'LOCK TABLE {table} IN EXCLUSIVE MODE')
+            cur.execute("SELECT pg_get_serial_sequence(%s, 'id')", (table,))
+            sequence = cur.fetchone()[0]
+            cur.execute(f'SELECT last_value, is_called FROM {sequence}')
+            last_value, is_called = cur.fetchone()
+            next_value = last_value + 1 if is_called else last_value
+            cur.execute(f'SELECT COALESCE(MAX(id), 0) FROM {table}')
+            max_id = cur.fetchone()[0]
+            if next_value <= max_id:
+                cur.execute('SELECT setval(%s, %s, false)', (sequence, max_id + 1))
+                repaired[table] = (next_value, max_id + 1)
+        conn.commit()
+        cur.close()
+    return repaired
+
+
+def rebuild_daily_rollup(start_date=None, end_date=None):
+    # Recompute sales_daily from the raw sales for a date range (default: all
+    # days). Writes to sales and sale_items wait until the rebuild commits.
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute('SELECT sales_daily_rebuild(%s::date, %s::date)', (start_date, end_date))
+        conn.commit()
+        cur.close()
+    invalidate("sales", "sale_items")
+
+
+def rebuild_product_sales():
+    # Recompute the per-product sales counters from sale_items
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute('SELECT product_sales_rebuild()')
+        conn.commit()
+        cur.close()
+    invalidate("sales", "sale_items")
+
+
+def main(argv):
+    if not argv or argv[0] not in ("repair-sequences", "rebuild-daily-rollup", "rebuild-product-sales"):
+        print("Usage: python maintenance.py repair-sequences [table ...]")
+        print("       python maintenance.py rebuild-daily-rollup [start-date end-date]")
+        print("       python maintenance.py rebuild-product-sales")
+        return 1
+    if argv[0] == "rebuild-daily-rollup":
+        rebuild_daily_rollup(*argv[1:3])
+        print("Daily sales rollup rebuilt.")
+    elif argv[0] == "rebuild-product-sales":
+        rebuild_product_sales()
+        print("Product sales counters rebuilt.")
+    elif argv[0] == "repair-sequences":
+        repaired = repair_sequences(argv[1:] or TABLES)
+        if not repaired:
+            print("All sequences are ahead of their tables.")
+        for table, (old, new) in repaired.items():
+            print(f"{table}: next id {old} -> {new}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
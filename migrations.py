@@ -0,0 +1,513 @@
+# Versioned schema migrations.
+# Each migration runs once, in its own transaction, and is recorded in the
+# schema_migrations table. Add new entries at the end; never edit one that
+# has already shipped.
+#
+#   python migrations.py            apply pending migrations
+#   python migrations.py status     list applied and pending migrations
+
+import sys
+from Database import get_connection
+
+MIGRATIONS = [
+    (1, "indexes for bill, customer and date-range lookups", [
+        'CREATE INDEX IF NOT EXISTS sale_items_sale_id_idx ON sale_items (sale_id)',
+        'CREATE INDEX IF NOT EXISTS sale_items_product_id_idx ON sale_items (product_id)',
+        'CREATE INDEX IF NOT EXISTS sales_customer_id_date_idx ON sales (customer_id, date)',
+        'CREATE INDEX IF NOT EXISTS sales_date_idx ON sales (date)',
+    ]),
+    # NOT VALID: new rows are checked, existing orphans don't block the upgrade
+    (2, "foreign keys between sales, sale items, customers and products", [
+        '''ALTER TABLE sales ADD CONSTRAINT sales_customer_id_fkey
+           FOREIGN KEY (customer_id) REFERENCES customers (id) NOT VALID''',
+        '''ALTER TABLE sale_items ADD CONSTRAINT sale_items_sale_id_fkey
+           FOREIGN KEY (sale_id) REFERENCES sales (id) ON DELETE CASCADE NOT VALID''',
+        '''ALTER TABLE sale_items ADD CONSTRAINT sale_items_product_id_fkey
+           FOREIGN KEY (product_id) REFERENCES products (id) NOT VALID''',
+    ]),
+    (3, "trigram index for customer name search", [
+        'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+        'CREATE INDEX IF NOT EXISTS customers_name_trgm_idx ON customers USING gin (name gin_trgm_ops)',
+    ]),
+    (4, "keyset pagination indexes for the sortable listings", [
+        'CREATE INDEX IF NOT EXISTS products_name_id_idx ON products (name, id)',
+        'CREATE INDEX IF NOT EXISTS products_price_id_idx ON products (price, id)',
+        'CREATE INDEX IF NOT EXISTS products_quantity_id_idx ON products (quantity, id)',
+        'CREATE INDEX IF NOT EXISTS customers_name_id_idx ON customers (name, id)',
+        'CREATE INDEX IF NOT EXISTS sales_date_id_idx ON sales (date, id)',
+        'CREATE INDEX IF NOT EXISTS sales_total_amount_id_idx ON sales (total_amount, id)',
+        'DROP INDEX IF EXISTS sales_date_idx',
+    ]),
+    (5, "natural keys for bulk import: products.sku and customers.contact", [
+        'ALTER TABLE products ADD COLUMN IF NOT EXISTS sku VARCHAR(64)',
+        'CREATE UNIQUE INDEX IF NOT EXISTS products_sku_key ON products (sku)',
+        'CREATE INDEX IF NOT EXISTS customers_contact_idx ON customers (contact)',
+    ]),
+    # Daily rollup kept current by triggers, so dashboards read O(days) rows.
+    # sales_daily_customers holds per-day, per-customer sale counts so the
+    # distinct customer count can be maintained incrementally. The triggers
+    # are statement-level: a statement's rows (transition tables) become one
+    # upsert per day, taken in day / customer order, so concurrent checkouts
+    # don't queue on today's row once per line.
+    (6, "daily sales rollup maintained by triggers", [
+        '''CREATE TABLE IF NOT EXISTS sales_daily (
+               day DATE PRIMARY KEY,
+               sale_count INTEGER NOT NULL DEFAULT 0,
+               revenue DECIMAL(14, 2) NOT NULL DEFAULT 0,
+               items_sold BIGINT NOT NULL DEFAULT 0,
+               customer_count INTEGER NOT NULL DEFAULT 0
+           )''',
+        '''CREATE TABLE IF NOT EXISTS sales_daily_customers (
+               day DATE NOT NULL,
+               customer_id INTEGER NOT NULL,
+               sale_count INTEGER NOT NULL,
+               PRIMARY KEY (day, customer_id)
+           )''',
+        # Changes are parallel arrays of (day, customer or NULL for item-only
+        # changes, sale count delta, revenue delta, items delta)
+        '''CREATE OR REPLACE FUNCTION sales_daily_apply_changes(p_days DATE[], p_customers INTEGER[],
+                                                            p_sales INTEGER[], p_revenue NUMERIC[],
+                                                            p_items BIGINT[]) RETURNS void AS $$
+           BEGIN
+               IF p_days IS NULL THEN
+                   RETURN;
+               END IF;
+               WITH changes AS (
+                   SELECT * FROM unnest(p_days, p_customers, p_sales, p_revenue, p_items)
+                                 AS c(day, customer_id, sales, revenue, items)
+               ), per_customer AS (
+                   SELECT day, customer_id, SUM(sales)::INTEGER AS sales FROM changes
+                   WHERE customer_id IS NOT NULL
+                   GROUP BY day, customer_id
+                   HAVING SUM(sales) <> 0
+               ), counted AS (
+                   INSERT INTO sales_daily_customers AS d (day, customer_id, sale_count)
+                   SELECT day, customer_id, sales FROM per_customer ORDER BY day, customer_id
+                   ON CONFLICT (day, customer_id) DO UPDATE SET sale_count = d.sale_count + EXCLUDED.sale_count
+                   RETURNING d.day, d.customer_id, d.sale_count
+               ), customers_delta AS (
+                   -- A customer appears on a day when their count leaves zero
+                   -- and disappears when it returns to zero
+                   SELECT c.day, SUM(CASE WHEN c.sale_count > 0 AND c.sale_count - p.sales <= 0 THEN 1
+                                          WHEN c.sale_count <= 0 AND c.sale_count - p.sales > 0 THEN -1
+                                          ELSE 0 END) AS customers
+                   FROM counted c JOIN per_customer p USING (day, customer_id)
+                   GROUP BY c.day
+               )
+               INSERT INTO sales_daily AS d (day, sale_count, revenue, items_sold, customer_count)
+               SELECT t.day, t.sales, t.revenue, t.items, COALESCE(cd.customers, 0)
+               FROM (SELECT day, SUM(sales) AS sales, SUM(revenue) AS revenue, SUM(items) AS items
+                     FROM changes GROUP BY day) t
+               LEFT JOIN customers_delta cd USING (day)
+               ORDER BY t.day
+               ON CONFLICT (day) DO UPDATE
+               SET sale_count = d.sale_count + EXCLUDED.sale_count,
+                   revenue = d.revenue + EXCLUDED.revenue,
+                   items_sold = d.items_sold + EXCLUDED.items_sold,
+                   customer_count = d.customer_count + EXCLUDED.customer_count;
+
+               DELETE FROM sales_daily_customers d
+               USING unnest(p_days, p_customers) AS c(day, customer_id)
+               WHERE d.day = c.day AND d.customer_id = c.customer_id AND d.sale_count <= 0;
+           END;
+           $$ LANGUAGE plpgsql''',
+        '''CREATE OR REPLACE FUNCTION sales_daily_sales_insert() RETURNS trigger AS $$
+           DECLARE
+               v_days DATE[]; v_customers INTEGER[]; v_sales INTEGER[]; v_revenue NUMERIC[]; v_items BIGINT[];
+           BEGIN
+               SELECT array_agg(date), array_agg(customer_id), array_agg(1), array_agg(total_amount), array_agg(0::BIGINT)
+               INTO v_days, v_customers, v_sales, v_revenue, v_items
+               FROM new_sales;
+               PERFORM sales_daily_apply_changes(v_days, v_customers, v_sales, v_revenue, v_items);
+               RETURN NULL;
+           END;
+           $$ LANGUAGE plpgsql''',
+        # An updated sale leaves its old day / customer and joins the new one,
+        # taking its items along; a total-only change nets out to revenue
+        '''CREATE OR REPLACE FUNCTION sales_daily_sales_update() RETURNS trigger AS $$
+           DECLARE
+               v_days DATE[]; v_customers INTEGER[]; v_sales INTEGER[]; v_revenue NUMERIC[]; v_items BIGINT[];
+           BEGIN
+               WITH changed AS (
+                   SELECT o.id, o.date AS old_date, o.customer_id AS old_customer, o.total_amount AS old_total,
+                          n.date AS new_date, n.customer_id AS new_customer, n.total_amount AS new_total
+                   FROM old_sales o JOIN new_sales n ON n.id = o.id
+                   WHERE (o.date, o.customer_id, o.total_amount) IS DISTINCT FROM (n.date, n.customer_id, n.total_amount)
+               ), counts AS (
+                   SELECT sale_id, SUM(quantity) AS items FROM sale_items
+                   WHERE sale_id IN (SELECT id FROM changed)
+                   GROUP BY sale_id
+               ), changes AS (
+                   SELECT old_date AS day, old_customer AS customer_id, -1 AS sales, -old_total AS revenue,
+                          -COALESCE(counts.items, 0) AS items
+                   FROM changed LEFT JOIN counts ON counts.sale_id = changed.id
+                   UNION ALL
+                   SELECT new_date, new_customer, 1, new_total, COALESCE(counts.items, 0)
+                   FROM changed LEFT JOIN counts ON counts.sale_id = changed.id
+               )
+               SELECT array_agg(day), array_agg(customer_id), array_agg(changes.sales), array_agg(changes.revenue),
+                      array_agg(changes.items::BIGINT)
+               INTO v_days, v_customers, v_sales, v_revenue, v_items
+               FROM changes;
+               PERFORM sales_daily_apply_changes(v_days, v_customers, v_sales, v_revenue, v_items);
+               RETURN NULL;
+           END;
+           $$ LANGUAGE plpgsql''',
+        # A deleted sale's items are gone by now (the cascade runs first) and
+        # can't be counted, so items_sold is recounted for the days touched.
+        # The upsert above has locked those rows, so a checkout landing on
+        # the same day either waits for this transaction or is counted here.
+        '''CREATE OR REPLACE FUNCTION sales_daily_sales_delete() RETURNS trigger AS $$
+           DECLARE
+               v_days DATE[]; v_customers INTEGER[]; v_sales INTEGER[]; v_revenue NUMERIC[]; v_items BIGINT[];
+           BEGIN
+               SELECT array_agg(date), array_agg(customer_id), array_agg(-1), array_agg(-total_amount),
+                      array_agg(0::BIGINT)
+               INTO v_days, v_customers, v_sales, v_revenue, v_items
+               FROM old_sales;
+               PERFORM sales_daily_apply_changes(v_days, v_customers, v_sales, v_revenue, v_items);
+               UPDATE sales_daily d
+               SET items_sold = (SELECT COALESCE(SUM(si.quantity), 0)
+                                 FROM sales s JOIN sale_items si ON si.sale_id = s.id
+                                 WHERE s.date = d.day)
+               WHERE d.day = ANY(v_days);
+               RETURN NULL;
+           END;
+           $$ LANGUAGE plpgsql''',
+        # Items whose sale is gone (a cascaded delete) drop out of the join:
+        # the sale's delete trigger recounts their days. Each event has only
+        # its own transition tables, so they are read by TG_OP.
+        '''CREATE OR REPLACE FUNCTION sales_daily_items_change() RETURNS trigger AS $$
+           DECLARE
+               v_sale_ids INTEGER[]; v_quantities INTEGER[];
+               v_days DATE[]; v_customers INTEGER[]; v_sales INTEGER[]; v_revenue NUMERIC[]; v_items BIGINT[];
+           BEGIN
+               IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                   SELECT array_agg(sale_id), array_agg(-quantity) INTO v_sale_ids, v_quantities FROM old_items;
+               END IF;
+               IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                   SELECT v_sale_ids || array_agg(sale_id), v_quantities || array_agg(quantity)
+                   INTO v_sale_ids, v_quantities FROM new_items;
+               END IF;
+               WITH changes AS (
+                   SELECT s.date AS day, SUM(i.quantity) AS items
+                   FROM unnest(v_sale_ids, v_quantities) AS i(sale_id, quantity)
+                   JOIN sales s ON s.id = i.sale_id
+                   GROUP BY s.date
+                   HAVING SUM(i.quantity) <> 0
+               )
+               SELECT array_agg(day), array_agg(NULL::INTEGER), array_agg(0), array_agg(0::NUMERIC),
+                      array_agg(changes.items::BIGINT)
+               INTO v_days, v_customers, v_sales, v_revenue, v_items
+               FROM changes;
+               PERFORM sales_daily_apply_changes(v_days, v_customers, v_sales, v_revenue, v_items);
+               RETURN NULL;
+           END;
+           $$ LANGUAGE plpgsql''',
+        '''CREATE OR REPLACE FUNCTION sales_daily_rebuild(p_start DATE, p_end DATE) RETURNS void AS $$
+           BEGIN
+               LOCK TABLE sales, sale_items IN SHARE MODE;
+               DELETE FROM sales_daily
+               WHERE (p_start IS NULL OR day >= p_start) AND (p_end IS NULL OR day <= p_end);
+               DELETE FROM sales_daily_customers
+               WHERE (p_start IS NULL OR day >= p_start) AND (p_end IS NULL OR day <= p_end);
+               INSERT INTO sales_daily_customers (day, customer_id, sale_count)
+               SELECT date, customer_id, COUNT(*) FROM sales
+               WHERE (p_start IS NULL OR date >= p_start) AND (p_end IS NULL OR date <= p_end)
+               GROUP BY date, customer_id;
+               INSERT INTO sales_daily (day, sale_count, revenue, items_sold, customer_count)
+               SELECT s.day, s.sale_count, s.revenue, COALESCE(i.items_sold, 0), s.customer_count
+               FROM (SELECT date AS day, COUNT(*) AS sale_count, SUM(total_amount) AS revenue,
+                            COUNT(DISTINCT customer_id) AS customer_count
+                     FROM sales
+                     WHERE (p_start IS NULL OR date >= p_start) AND (p_end IS NULL OR date <= p_end)
+                     GROUP BY date) s
+               LEFT JOIN (SELECT sa.date AS day, SUM(si.quantity) AS items_sold
+                          FROM sale_items si JOIN sales sa ON sa.id = si.sale_id
+                          WHERE (p_start IS NULL OR sa.date >= p_start) AND (p_end IS NULL OR sa.date <= p_end)
+                          GROUP BY sa.date) i ON i.day = s.day;
+           END;
+           $$ LANGUAGE plpgsql''',
+        '''CREATE TRIGGER sales_daily_sales_insert AFTER INSERT ON sales
+           REFERENCING NEW TABLE AS new_sales
+           FOR EACH STATEMENT EXECUTE FUNCTION sales_daily_sales_insert()''',
+        '''CREATE TRIGGER sales_daily_sales_update AFTER UPDATE ON sales
+           REFERENCING OLD TABLE AS old_sales NEW TABLE AS new_sales
+           FOR EACH STATEMENT EXECUTE FUNCTION sales_daily_sales_update()''',
+        '''CREATE TRIGGER sales_daily_sales_delete AFTER DELETE ON sales
+           REFERENCING OLD TABLE AS old_sales
+           FOR EACH STATEMENT EXECUTE FUNCTION sales_daily_sales_delete()''',
+        '''CREATE TRIGGER sales_daily_items_insert AFTER INSERT ON sale_items
+           REFERENCING NEW TABLE AS new_items
+           FOR EACH STATEMENT EXECUTE FUNCTION sales_daily_items_change()''',
+        '''CREATE TRIGGER sales_daily_items_update AFTER UPDATE ON sale_items
+           REFERENCING OLD TABLE AS old_items NEW TABLE AS new_items
+           FOR EACH STATEMENT EXECUTE FUNCTION sales_daily_items_change()''',
+        '''CREATE TRIGGER sales_daily_items_delete AFTER DELETE ON sale_items
+           REFERENCING OLD TABLE AS old_items
+           FOR EACH STATEMENT EXECUTE FUNCTION sales_daily_items_change()''',
+        'SELECT sales_daily_rebuild(NULL, NULL)',
+    ]),
+    # Running per-product totals for the all-time leaderboard, plus per-day
+    # buckets for windowed (today / 7d / 30d) leaderboards. last_sold only
+    # moves forward; deleting a sale does not roll it back. As in migration
+    # 6 the triggers are statement-level: one grouped upsert per statement
+    # into each table, in product id order, so checkouts sharing popular
+    # products lock their counter rows in the same order.
+    (7, "per-product sales counters maintained by triggers", [
+        '''CREATE TABLE IF NOT EXISTS product_sales (
+               product_id INTEGER PRIMARY KEY,
+               units_sold BIGINT NOT NULL DEFAULT 0,
+               revenue DECIMAL(16, 2) NOT NULL DEFAULT 0,
+               last_sold DATE
+           )''',
+        'CREATE INDEX IF NOT EXISTS product_sales_units_idx ON product_sales (units_sold DESC, product_id)',
+        '''CREATE TABLE IF NOT EXISTS product_sales_daily (
+               day DATE NOT NULL,
+               product_id INTEGER NOT NULL,
+               units_sold BIGINT NOT NULL DEFAULT 0,
+               revenue DECIMAL(16, 2) NOT NULL DEFAULT 0,
+               PRIMARY KEY (day, product_id)
+           )''',
+        '''CREATE OR REPLACE FUNCTION product_sales_apply_changes(p_days DATE[], p_products INTEGER[],
+                                                              p_units BIGINT[], p_revenue NUMERIC[])
+           RETURNS void AS $$
+           BEGIN
+               IF p_products IS NULL THEN
+                   RETURN;
+               END IF;
+               INSERT INTO product_sales AS t (product_id, units_sold, revenue, last_sold)
+               SELECT product_id, SUM(units), SUM(revenue), MAX(day) FILTER (WHERE units > 0)
+               FROM unnest(p_days, p_products, p_units, p_revenue) AS c(day, product_id, units, revenue)
+               GROUP BY product_id
+               HAVING SUM(units) <> 0 OR SUM(revenue) <> 0
+               ORDER BY product_id
+               ON CONFLICT (product_id) DO UPDATE
+               SET units_sold = t.units_sold + EXCLUDED.units_sold,
+                   revenue = t.revenue + EXCLUDED.revenue,
+                   last_sold = GREATEST(t.last_sold, EXCLUDED.last_sold);
+               INSERT INTO product_sales_daily AS t (day, product_id, units_sold, revenue)
+               SELECT day, product_id, SUM(units), SUM(revenue)
+               FROM unnest(p_days, p_products, p_units, p_revenue) AS c(day, product_id, units, revenue)
+               WHERE day IS NOT NULL
+               GROUP BY product_id, day
+               HAVING SUM(units) <> 0 OR SUM(revenue) <> 0
+               ORDER BY product_id, day
+               ON CONFLICT (day, product_id) DO UPDATE
+               SET units_sold = t.units_sold + EXCLUDED.units_sold,
+                   revenue = t.revenue + EXCLUDED.revenue;
+           END;
+           $$ LANGUAGE plpgsql''',
+        # Items of a sale that is gone (a cascaded delete) only adjust the
+        # all-time totals: the sale's delete trigger recounts their days
+        '''CREATE OR REPLACE FUNCTION product_sales_items_change() RETURNS trigger AS $$
+           DECLARE
+               v_sale_ids INTEGER[]; v_products INTEGER[]; v_units BIGINT[]; v_revenue NUMERIC[];
+               v_days DATE[];
+           BEGIN
+               IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                   SELECT array_agg(sale_id), array_agg(product_id), array_agg(-quantity::BIGINT),
+                          array_agg(-(quantity * price))
+                   INTO v_sale_ids, v_products, v_units, v_revenue FROM old_items;
+               END IF;
+               IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                   SELECT v_sale_ids || array_agg(sale_id), v_products || array_agg(product_id),
+                          v_units || array_agg(quantity::BIGINT), v_revenue || array_agg(quantity * price)
+                   INTO v_sale_ids, v_products, v_units, v_revenue FROM new_items;
+               END IF;
+               SELECT array_agg(s.date ORDER BY i.n) INTO v_days
+               FROM unnest(v_sale_ids) WITH ORDINALITY AS i(sale_id, n)
+               LEFT JOIN sales s ON s.id = i.sale_id;
+               PERFORM product_sales_apply_changes(v_days, v_products, v_units, v_revenue);
+               RETURN NULL;
+           END;
+           $$ LANGUAGE plpgsql''',
+        # A sale moved to another day takes its items' units along; the
+        # all-time totals net out to zero and are left alone
+        '''CREATE OR REPLACE FUNCTION product_sales_sales_update() RETURNS trigger AS $$
+           DECLARE
+               v_days DATE[]; v_products INTEGER[]; v_units BIGINT[]; v_revenue NUMERIC[];
+           BEGIN
+               WITH moved AS (
+                   SELECT o.id, o.date AS old_date, n.date AS new_date
+                   FROM old_sales o JOIN new_sales n ON n.id = o.id
+                   WHERE o.date <> n.date
+               ), items AS (
+                   SELECT m.old_date, m.new_date, si.product_id, SUM(si.quantity)::BIGINT AS units,
+                          SUM(si.quantity * si.price) AS revenue
+                   FROM moved m JOIN sale_items si ON si.sale_id = m.id
+                   GROUP BY m.old_date, m.new_date, si.product_id
+               ), changes AS (
+                   SELECT old_date AS day, product_id, -units AS units, -revenue AS revenue FROM items
+                   UNION ALL
+                   SELECT new_date, product_id, units, revenue FROM items
+               )
+               SELECT array_agg(day), array_agg(product_id), array_agg(changes.units), array_agg(changes.revenue)
+               INTO v_days, v_products, v_units, v_revenue
+               FROM changes;
+               PERFORM product_sales_apply_changes(v_days, v_products, v_units, v_revenue);
+               RETURN NULL;
+           END;
+           $$ LANGUAGE plpgsql''',
+        # A deleted sale's items are gone by now (the cascade runs first), so
+        # the day buckets of the deleted sales' days are recounted. They are
+        # locked in key order first; the recount then reads a fresh snapshot.
+        '''CREATE OR REPLACE FUNCTION product_sales_sales_delete() RETURNS trigger AS $$
+           BEGIN
+               PERFORM 1 FROM product_sales_daily
+               WHERE day IN (SELECT date FROM old_sales)
+               ORDER BY product_id, day
+               FOR UPDATE;
+               UPDATE product_sales_daily d
+               SET units_sold = COALESCE(c.units, 0), revenue = COALESCE(c.revenue, 0)
+               FROM product_sales_daily t
+               LEFT JOIN (SELECT s.date AS day, si.product_id, SUM(si.quantity) AS units,
+                                 SUM(si.quantity * si.price) AS revenue
+                          FROM sales s JOIN sale_items si ON si.sale_id = s.id
+                          WHERE s.date IN (SELECT date FROM old_sales)
+                          GROUP BY s.date, si.product_id) c USING (day, product_id)
+               WHERE t.day IN (SELECT date FROM old_sales)
+                 AND d.day = t.day AND d.product_id = t.product_id
+                 AND (d.units_sold, d.revenue) IS DISTINCT FROM (COALESCE(c.units, 0), COALESCE(c.revenue, 0));
+               RETURN NULL;
+           END;
+           $$ LANGUAGE plpgsql''',
+        '''CREATE OR REPLACE FUNCTION product_sales_rebuild() RETURNS void AS $$
+           BEGIN
+               LOCK TABLE sales, sale_items IN SHARE MODE;
+               DELETE FROM product_sales;
+               DELETE FROM product_sales_daily;
+               INSERT INTO product_sales_daily (day, product_id, units_sold, revenue)
+               SELECT s.date, si.product_id, SUM(si.quantity), SUM(si.quantity * si.price)
+               FROM sale_items si JOIN sales s ON s.id = si.sale_id
+               GROUP BY s.date, si.product_id;
+               INSERT INTO product_sales (product_id, units_sold, revenue, last_sold)
+               SELECT si.product_id, SUM(si.quantity), SUM(si.quantity * si.price), MAX(s.date)
+               FROM sale_items si LEFT JOIN sales s ON s.id = si.sale_id
+               GROUP BY si.product_id;
+           END;
+           $$ LANGUAGE plpgsql''',
+        '''CREATE TRIGGER product_sales_sales_update AFTER UPDATE ON sales
+           REFERENCING OLD TABLE AS old_sales NEW TABLE AS new_sales
+           FOR EACH STATEMENT EXECUTE FUNCTION product_sales_sales_update()''',
+        '''CREATE TRIGGER product_sales_sales_delete AFTER DELETE ON sales
+           REFERENCING OLD TABLE AS old_sales
+           FOR EACH STATEMENT EXECUTE FUNCTION product_sales_sales_delete()''',
+        '''CREATE TRIGGER product_sales_items_insert AFTER INSERT ON sale_items
+           REFERENCING NEW TABLE AS new_items
+           FOR EACH STATEMENT EXECUTE FUNCTION product_sales_items_change()''',
+        '''CREATE TRIGGER product_sales_items_update AFTER UPDATE ON sale_items
+           REFERENCING OLD TABLE AS old_items NEW TABLE AS new_items
+           FOR EACH STATEMENT EXECUTE FUNCTION product_sales_items_change()''',
+        '''CREATE TRIGGER product_sales_items_delete AFTER DELETE ON sale_items
+           REFERENCING OLD TABLE AS old_items
+           FOR EACH STATEMENT EXECUTE FUNCTION product_sales_items_change()''',
+        'SELECT product_sales_rebuild()',
+    ]),
+    # Change tracking for in-process copies of the catalog (catalog.py):
+    # updated_xid is stamped with the writing transaction's id on every
+    # insert and update, and deleted ids are kept as tombstones so a refresh
+    # can drop them. Transaction ids (xid8, PostgreSQL 13+) rather than
+    # timestamps, so a reader can tell which writers may still be running
+    # from its own snapshot, without any privileges.
+    (8, "products.updated_xid and delete tombstones for incremental catalog refresh", [
+        'ALTER TABLE products ADD COLUMN IF NOT EXISTS updated_xid XID8 NOT NULL DEFAULT pg_current_xact_id()',
+        'CREATE INDEX IF NOT EXISTS products_updated_xid_idx ON products (updated_xid)',
+        '''CREATE TABLE IF NOT EXISTS products_deleted (
+               product_id INTEGER PRIMARY KEY,
+               deleted_xid XID8 NOT NULL
+           )''',
+        'CREATE INDEX IF NOT EXISTS products_deleted_xid_idx ON products_deleted (deleted_xid)',
+        '''CREATE OR REPLACE FUNCTION products_touch() RETURNS trigger AS $$
+           BEGIN
+               NEW.updated_xid := pg_current_xact_id();
+               IF TG_OP = 'INSERT' THEN
+                   DELETE FROM products_deleted WHERE product_id = NEW.id;
+               END IF;
+               RETURN NEW;
+           END;
+           $$ LANGUAGE plpgsql''',
+        '''CREATE OR REPLACE FUNCTION products_tombstone() RETURNS trigger AS $$
+           BEGIN
+               INSERT INTO products_deleted (product_id, deleted_xid)
+               VALUES (OLD.id, pg_current_xact_id())
+               ON CONFLICT (product_id) DO UPDATE SET deleted_xid = EXCLUDED.deleted_xid;
+               RETURN NULL;
+           END;
+           $$ LANGUAGE plpgsql''',
+        '''CREATE TRIGGER products_touch BEFORE INSERT OR UPDATE ON products
+           FOR EACH ROW EXECUTE FUNCTION products_touch()''',
+        '''CREATE TRIGGER products_tombstone AFTER DELETE ON products
+           FOR EACH ROW EXECUTE FUNCTION products_tombstone()''',
+    ]),
+]
+
+# Arbitrary key so concurrent app sessions don't migrate at the same time
+MIGRATION_LOCK_ID = 720431
+
+
+def _ensure_table(cur):
+    cur.execute('''CREATE TABLE IF NOT EXISTS schema_migrations (
+                    version INTEGER PRIMARY KEY,
+                    description TEXT NOT NULL,
+                    applied_at TIMESTAMP NOT NULL DEFAULT now()
+                )''')
+
+
+def applied_versions():
+    with get_connection() as conn:
+        cur = conn.cursor()
+        _ensure_table(cur)
+        cur.execute('SELECT version FROM schema_migrations')
+        versions = {row[0] for row in cur.fetchall()}
+        conn.commit()
+        cur.close()
+        return versions
+
+
+def pending_migrations():
+    applied = applied_versions()
+    return [m for m in MIGRATIONS if m[0] not in applied]
+
+
+def migrate(target=None):
+    # Apply pending migrations up to target (default: all). Returns the
+    # versions that were applied by this call.
+    applied_now = []
+    with get_connection() as conn:
+        cur = conn.cursor()
+        for version, description, statements in MIGRATIONS:
+            if target is not None and version > target:
+                break
+            _ensure_table(cur)
+            cur.execute('SELECT pg_advisory_xact_lock(%s)', (MIGRATION_LOCK_ID,))
+            cur.execute('SELECT 1 FROM schema_migrations WHERE version = %s', (version,))
+            if cur.fetchone():
+                conn.commit()
+                continue
+            for statement in statements:
+                cur.execute(statement)
+            cur.execute('INSERT INTO schema_migrations (version, description) VALUES (%s, %s)',
+                        (version, description))
+            conn.commit()
+            applied_now.append(version)
+        cur.close()
+    return applied_now
+
+
+def main(argv):
+    if argv and argv[0] == "status":
+        applied = applied_versions()
+        for version, description, _ in MIGRATIONS:
+            print(f"{version:>4}  {'applied' if version in applied else 'pending':8} {description}")
+        return 0
+    if argv:
+        print("Usage: python migrations.py [status]")
+        return 1
+    applied = migrate()
+    print("Applied migrations:", applied if applied else "none (schema is up to date)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
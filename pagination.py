@@ -0,0 +1,91 @@
+# Keyset (seek) pagination shared by the model classes.
+# A page continues from the last row seen, WHERE (sort_key, id) > (that row's
+# sort_key, id), instead of using OFFSET, so deep pages cost the same as the
+# first one and rows inserted meanwhile don't shift the page boundaries.
+# The cursor carries both values, (sort_value, id), so it stays valid when
+# the row it came from is deleted or changed.
+
+from Database import get_connection
+from records import record_cursor
+
+DEFAULT_PAGE_SIZE = 50
+
+
+def page_query(select_sql, alias, sort_key="id", after=None, page_size=DEFAULT_PAGE_SIZE,
+               descending=False, where=None, params=()):
+    # select_sql: "SELECT <alias>.id, ... FROM <table> <alias> [JOIN ...]" with
+    # no WHERE/ORDER BY; the first column must be the row id.
+    # sort_key must be a trusted, NOT NULL column of <table>; callers check it
+    # against their own list of sortable columns. after is the cursor from
+    # split_page, or None for the first page.
+    # Returns (query, args) selecting page_size + 1 rows, so the caller can
+    # tell whether another page follows.
+    op = "<" if descending else ">"
+    order = "DESC" if descending else "ASC"
+    conditions = [where] if where else []
+    args = list(params)
+    if after is not None:
+        sort_value, last_id = after
+        if sort_key == "id":
+            conditions.append(f"{alias}.id {op} %s")
+            args.append(last_id)
+        else:
+            conditions.append(f"({alias}.{sort_key}, {alias}.id) {op} (%s, %s)")
+            args.extend((sort_value, last_id))
+    query = select_sql
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    if sort_key == "id":
+        query += f" ORDER BY {alias}.id {order}"
+    else:
+        query += f" ORDER BY {alias}.{sort_key} {order}, {alias}.id {order}"
+    query += " LIMIT %s"
+    args.append(page_size + 1)
+    return query, args
+
+
+def split_page(rows, page_size, sort_index=0):
+    # Returns (rows, next_after); next_after is the (sort_value, id) cursor
+    # of the last row, taking the sort value from column sort_index, and
+    # None on the last page
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        return rows, (rows[-1][sort_index], rows[-1][0])
+    return rows, None
+
+
+def sort_index(record, sort_key):
+    # Column of sort_key in rows of `record`; rows without a record are
+    # only paged by id, their first column
+    return record._fields.index(sort_key) if record is not None else 0
+
+
+def fetch_page(select_sql, alias, sort_key="id", after=None, page_size=DEFAULT_PAGE_SIZE,
+               descending=False, where=None, params=(), record=None):
+    # Runs page_query; returns (rows, next_after), rows as `record` instances if given
+    query, args = page_query(select_sql, alias, sort_key, after, page_size,
+                             descending, where, params)
+    with get_connection() as conn:
+        cur = record_cursor(conn, record)
+        cur.execute(query, args)
+        rows = cur.fetchall()
+        cur.close()
+    return split_page(rows, page_size, sort_index(record, sort_key))
+
+
+def check_sort_key(sort_key, allowed):
+    if sort_key not in allowed:
+        raise ValueError(f"Cannot sort by {sort_key!r}; choose one of {', '.join(allowed)}")
+
+
+def print_pages(fetch, page_size=DEFAULT_PAGE_SIZE, **kwargs):
+    # CLI helper: print one page at a time until the user stops or rows run out
+    after = None
+    while True:
+        rows, after = fetch(page_size=page_size, after=after, **kwargs)
+        for row in rows:
+            print(row)
+        if after is None:
+            break
+        if input("Press Enter for the next page, q to stop: ").strip().lower() == "q":
+            break
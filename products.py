@@ -1,75 +1,158 @@
 # Product CRUD operations (create table, insert, update, delete, view).
 import psycopg2
-from Database import conn
+from Database import get_connection, iter_query
+from cache import cached_query, invalidate
+from pagination import DEFAULT_PAGE_SIZE, check_sort_key, fetch_page, print_pages
+from queries import (DECREMENT_STOCK, DELETE_PRODUCT, INSERT_PRODUCT, LOCK_PRODUCTS, PRODUCTS_PAGE,
+                     SELECT_PRODUCT, SELECT_PRODUCTS, STOCK_LEVELS, update_query)
+from records import ProductRecord, record_cursor
+
+
+class InsufficientStock(Exception):
+    def __init__(self, failed):
+        # failed: (product_id, requested, available) tuples; available is None
+        # when the product does not exist
+        self.failed = failed
+        details = ", ".join(
+            f"product {product_id}: requested {requested}, "
+            + ("not found" if available is None else f"available {available}")
+            for product_id, requested, available in failed)
+        super().__init__(f"Insufficient stock ({details})")
+
 
 class Product:
-    def __init__(self, name, description, price, quantity):
-        self.name = name
-        self.description = description
-        self.price = price
-        self.quantity = quantity
+    SORT_KEYS = ("id", "name", "price", "quantity")
 
     def create_table():
-        cur = conn.cursor()
-        cur.execute('''CREATE TABLE IF NOT EXISTS products (
-            id SERIAL PRIMARY KEY,
-            name VARCHAR(100) NOT NULL,
-            description TEXT,
-            price DECIMAL(10, 2) NOT NULL,
-            quantity INTEGER NOT NULL
-        )''')
-        conn.commit()
-        cur.close()
+        with get_connection() as conn:
+            cur = conn.cursor()
+            cur.execute('''CREATE TABLE IF NOT EXISTS products (
+                id SERIAL PRIMARY KEY,
+                name VARCHAR(100) NOT NULL,
+                description TEXT,
+                price DECIMAL(10, 2) NOT NULL,
+                quantity INTEGER NOT NULL
+            )''')
+            conn.commit()
+            cur.close()
 
     def insert_product(name, description, price, quantity):
-        cur = conn.cursor()
-        cur.execute('''INSERT INTO products (name, description, price, quantity)
-                       VALUES (%s, %s, %s, %s)''',
-                    (name, description, price, quantity))
-        conn.commit()
-        cur.close()
+        with get_connection() as conn:
+            cur = conn.cursor()
+            cur.execute(INSERT_PRODUCT, (name, description, price, quantity))
+            product_id = cur.fetchone()[0]
+            conn.commit()
+            cur.close()
+        invalidate("products")
+        return product_id
 
     def update_product(product_id, name=None, description=None, price=None, quantity=None):
-        cur = conn.cursor()
-        cur.execute('SELECT * FROM products WHERE id = %s', (product_id,))
-        product = cur.fetchone()
-        if not product:
-            print("Product not found")
+        with get_connection() as conn:
+            cur = conn.cursor()
+            cur.execute('SELECT * FROM products WHERE id = %s', (product_id,))
+            product = cur.fetchone()
+            if not product:
+                print("Product not found")
+                cur.close()
+                return
+            sql, values = update_query("products", [("name", name), ("description", description),
+                                                    ("price", price), ("quantity", quantity)], product_id)
+            if sql:
+                cur.execute(sql, values)
+            conn.commit()
             cur.close()
-            return
-        update_fields = []
-        if name:
-            update_fields.append(f"name = '{name}'")
-        if description:
-            update_fields.append(f"description = '{description}'")
-        if price:
-            update_fields.append(f"price = {price}")
-        if quantity:
-            update_fields.append(f"quantity = {quantity}")
-        update_query = f"UPDATE products SET {', '.join(update_fields)} WHERE id = %s"
-        cur.execute(update_query, (product_id,))
-        conn.commit()
-        cur.close()
+        invalidate("products")
     
     def delete_product(product_id):
+        with get_connection() as conn:
+            cur = conn.cursor()
+            cur.execute(DELETE_PRODUCT, (product_id,))
+            conn.commit()
+            cur.close()
+        invalidate("products")
+
+    def decrement_stock(lines, conn=None):
+        # lines: (product_id, quantity) pairs for a whole cart; repeated
+        # products are merged. Each row is decremented by a conditional
+        # UPDATE, so concurrent sales can never take stock below zero.
+        # Returns (updated, failed): updated maps product_id -> (price, remaining),
+        # failed lists (product_id, requested, available) for lines that could
+        # not be served. When conn is given the caller owns the transaction,
+        # must roll back on failure and invalidate("products") after committing;
+        # otherwise it is all-or-nothing here.
+        if conn is None:
+            with get_connection() as conn:
+                updated, failed = Product.decrement_stock(lines, conn)
+                if failed:
+                    conn.rollback()
+                else:
+                    conn.commit()
+            if not failed:
+                invalidate("products")
+            return updated, failed
+
+        quantities = Product.merge_quantities(lines)
+        if not quantities:
+            return {}, []
+
         cur = conn.cursor()
-        cur.execute('DELETE FROM products WHERE id = %s', (product_id,))
-        conn.commit()
+        # Lock the cart's rows in product id order first, so two carts that
+        # share products queue on the lowest id instead of deadlocking. The
+        # UPDATE alone doesn't guarantee an order: the planner picks the join.
+        ordered = sorted(quantities.items())
+        product_ids = [product_id for product_id, _ in ordered]
+        cur.execute(LOCK_PRODUCTS, (product_ids,))
+        cur.execute(DECREMENT_STOCK, (product_ids, [quantity for _, quantity in ordered]))
+        updated = {product_id: (price, remaining) for product_id, price, remaining in cur.fetchall()}
+
+        failed = []
+        missing = [product_id for product_id in quantities if product_id not in updated]
+        if missing:
+            # Only the failure path pays for this lookup
+            cur.execute(STOCK_LEVELS, (missing,))
+            available = dict(cur.fetchall())
+            failed = [(product_id, quantities[product_id], available.get(product_id))
+                      for product_id in sorted(missing)]
         cur.close()
+        return updated, failed
 
+    def merge_quantities(lines):
+        # {product_id: total quantity} for (product_id, quantity) lines
+        quantities = {}
+        for product_id, quantity in lines:
+            if quantity <= 0:
+                raise ValueError(f"Quantity for product {product_id} must be positive")
+            quantities[product_id] = quantities.get(product_id, 0) + quantity
+        return quantities
+
+    @cached_query("products")
     def view_products():
-        cur = conn.cursor()
-        cur.execute('SELECT * FROM products')
-        products = cur.fetchall()
-        cur.close()
-        return products
+        with get_connection() as conn:
+            cur = record_cursor(conn, ProductRecord)
+            cur.execute(SELECT_PRODUCTS)
+            products = cur.fetchall()
+            cur.close()
+            return products
     
+    def iter_products(itersize=None):
+        # Streams every product in id order with constant memory
+        return iter_query(f'{SELECT_PRODUCTS} ORDER BY id',
+                          itersize=itersize, record=ProductRecord)
+
+    @cached_query("products")
+    def get_products_page(page_size=DEFAULT_PAGE_SIZE, after=None, sort_key="id", descending=False):
+        # Returns (rows, next_after); pass next_after back for the next page
+        check_sort_key(sort_key, Product.SORT_KEYS)
+        return fetch_page(PRODUCTS_PAGE, "p", sort_key, after, page_size, descending, record=ProductRecord)
+
+    @cached_query("products")
     def view_product_id(product_id):
-        cur = conn.cursor()
-        cur.execute('SELECT * FROM products WHERE id = %s', (product_id,))
-        product = cur.fetchone()
-        cur.close()
-        return product
+        with get_connection() as conn:
+            cur = record_cursor(conn, ProductRecord)
+            cur.execute(SELECT_PRODUCT, (product_id,))
+            product = cur.fetchone()
+            cur.close()
+            return product
 
 #Menu
     def product_menu():
@@ -110,9 +193,7 @@ class Product:
                 print("Product deleted")
 
             elif choice == '5':
-                products = Product.view_products()
-                for product in products:
-                    print(product)
+                print_pages(Product.get_products_page)
                 print("Product viewed")
             
             elif choice == '6':
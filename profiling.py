@@ -0,0 +1,206 @@
+# Rerun profiling for the Streamlit app.
+# Streamlit runs app.py from the top on every interaction. With profiling on
+# ([profiling] enabled, or the sidebar checkbox), each rerun is split into
+# sections at mark(name) calls, and every section is timed three ways:
+#   db      time spent in SQL statements (from instrumentation)
+#   render  time spent inside Streamlit calls, including the libraries they
+#           call (pandas, pyarrow, protobuf)
+#   python  the rest: our own code and everything it calls
+# Each section runs under its own cProfile profiler; the merged stats can be
+# saved as a .prof file (dump_dir, or the sidebar download) and opened with
+# `python -m pstats`, snakeviz, or turned into a flame graph with flameprof.
+#
+#   rerun = start_rerun()
+#   rerun.mark("Sales: customers")  ...  rerun.mark("Sales: cart")  ...
+#   rerun.finish()
+
+import cProfile
+import io
+import marshal
+import os
+import pstats
+import re
+import sys
+import threading
+import time
+from datetime import datetime
+
+import instrumentation
+from Database import settings
+
+RENDER_PACKAGES = ("streamlit",)
+
+_local = threading.local()
+
+
+def profiling_enabled():
+    return settings["profiling"]["enabled"].lower() in ("1", "true", "yes", "on")
+
+
+def _package_dirs(names):
+    dirs = []
+    for name in names:
+        module = sys.modules.get(name)
+        if module is not None and getattr(module, "__file__", None):
+            dirs.append(os.path.dirname(os.path.abspath(module.__file__)) + os.sep)
+    return tuple(dirs)
+
+
+class Section:
+    __slots__ = ("name", "wall", "db", "queries", "render", "stats")
+
+    def __init__(self, name):
+        self.name = name
+        self.wall = 0.0
+        self.db = 0.0
+        self.queries = 0
+        self.render = 0.0
+        self.stats = None
+
+    @property
+    def python(self):
+        return max(self.wall - self.db - self.render, 0.0)
+
+
+class RerunProfile:
+    def __init__(self, label=None):
+        self.label = label
+        self.sections = []
+        self.finished = False
+        self._render_dirs = _package_dirs(RENDER_PACKAGES)
+        self._timer, self._token = instrumentation.start_db_timer()
+        self._current = None
+        self._profiler = None
+        self._started = 0.0
+        self._db_start = (0.0, 0)
+
+    def mark(self, name):
+        # End the current section and start the next one
+        self._close()
+        section = Section(name)
+        self.sections.append(section)
+        self._current = section
+        self._db_start = tuple(self._timer)
+        self._profiler = cProfile.Profile()
+        self._started = time.perf_counter()
+        self._profiler.enable()
+
+    def _close(self):
+        if self._current is None:
+            return
+        self._profiler.disable()
+        section = self._current
+        section.wall = time.perf_counter() - self._started
+        section.db = self._timer[0] - self._db_start[0]
+        section.queries = self._timer[1] - self._db_start[1]
+        section.stats = pstats.Stats(self._profiler, stream=io.StringIO())
+        section.render = self._render_time(section.stats)
+        self._current = None
+        self._profiler = None
+
+    def _render_time(self, stats):
+        # Cumulative time of the calls made into the render packages from
+        # outside them. Calls from the page's top-level code have no caller
+        # entry (that frame was running before profiling started); they are
+        # what is left of a function's time after its recorded callers.
+        if not self._render_dirs:
+            return 0.0
+        total = 0.0
+        for func, (_, _, _, cumulative, callers) in stats.stats.items():
+            if not func[0].startswith(self._render_dirs):
+                continue
+            recorded = 0.0
+            for caller, edge in callers.items():
+                recorded += edge[3]
+                if not caller[0].startswith(self._render_dirs):
+                    total += edge[3]
+            total += max(cumulative - recorded, 0.0)
+        return total
+
+    def finish(self):
+        self._close()
+        if not self.finished:
+            self.finished = True
+            try:
+                instrumentation.stop_db_timer(self._token)
+            except ValueError:
+                pass    # set in another context
+        if getattr(_local, "rerun", None) is self:
+            _local.rerun = None
+
+    def abandon(self):
+        # Stop profiling a rerun that never reached finish() (st.rerun, st.stop)
+        if self._profiler is not None:
+            self._profiler.disable()
+        self._current = None
+        self._profiler = None
+        self.finish()
+
+    # ---------- results ----------
+
+    def breakdown(self):
+        # One dict per section plus a total row, times in ms
+        rows = []
+        totals = {"section": "Total", "wall_ms": 0.0, "db_ms": 0.0, "queries": 0, "python_ms": 0.0, "render_ms": 0.0}
+        for section in self.sections:
+            row = {"section": section.name, "wall_ms": section.wall * 1000, "db_ms": section.db * 1000,
+                   "queries": section.queries, "python_ms": section.python * 1000,
+                   "render_ms": section.render * 1000}
+            rows.append(row)
+            for key in ("wall_ms", "db_ms", "queries", "python_ms", "render_ms"):
+                totals[key] += row[key]
+        rows.append(totals)
+        return rows
+
+    def stats(self):
+        # The sections' profiles merged into one pstats.Stats
+        merged = None
+        for section in self.sections:
+            if section.stats is None:
+                continue
+            if merged is None:
+                merged = pstats.Stats(stream=io.StringIO())
+            merged.add(section.stats)
+        return merged
+
+    def top_functions(self, limit=15, sort="tottime"):
+        # (function, calls, self ms, cumulative ms), most expensive first
+        merged = self.stats()
+        if merged is None:
+            return []
+        key = 2 if sort == "tottime" else 3
+        items = sorted(merged.stats.items(), key=lambda item: item[1][key], reverse=True)
+        return [(pstats.func_std_string(func), nc, tt * 1000, ct * 1000)
+                for func, (cc, nc, tt, ct, callers) in items[:limit]]
+
+    def dump_bytes(self):
+        # The merged profile in the .prof format written by cProfile
+        merged = self.stats()
+        return marshal.dumps(merged.stats if merged is not None else {})
+
+    def dump(self, directory=None):
+        # Write the profile to the dump directory; returns the path, or None
+        # when no directory is configured
+        directory = directory or settings["profiling"]["dump_dir"]
+        if not directory:
+            return None
+        os.makedirs(directory, exist_ok=True)
+        label = re.sub(r"[^0-9A-Za-z]+", "-", self.label or "rerun").strip("-").lower()
+        path = os.path.join(directory, f"{datetime.now():%Y%m%d-%H%M%S-%f}-{label}.prof")
+        with open(path, "wb") as f:
+            f.write(self.dump_bytes())
+        return path
+
+
+def start_rerun(label=None, enabled=True):
+    # Begin profiling a rerun in this thread; returns None when not enabled.
+    # A previous rerun that was cut short by st.rerun() or st.stop() is
+    # wound up first.
+    previous = getattr(_local, "rerun", None)
+    if previous is not None:
+        previous.abandon()
+    if not enabled:
+        return None
+    rerun = RerunProfile(label)
+    _local.rerun = rerun
+    return rerun
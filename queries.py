@@ -0,0 +1,129 @@
+# SQL shared by the blocking models (customers.py, products.py, sales.py,
+# sales_items.py) and their asyncio twins (async_models.py). Both layers run
+# on psycopg2, so a statement is written once here and the two can't drift
+# apart. Statements take %s parameters; the builders return (sql, params).
+
+from records import CustomerRecord, ProductRecord, SaleItemRecord, SaleRecord, columns
+
+# Leaderboard windows: days before today to include
+TOP_SELLING_WINDOWS = {"today": 0, "7d": 6, "30d": 29}
+
+
+def update_query(table, fields, key):
+    # "UPDATE <table> SET a = %s, ... WHERE id = %s RETURNING id" for the
+    # (column, value) fields that were given (truthy), and its params; None
+    # when there is nothing to set. Columns are trusted names.
+    given = [(column, value) for column, value in fields if value]
+    if not given:
+        return None, []
+    assignments = ", ".join(f"{column} = %s" for column, _ in given)
+    return (f'UPDATE {table} SET {assignments} WHERE id = %s RETURNING id',
+            [value for _, value in given] + [key])
+
+
+def date_range(column, start_date=None, end_date=None):
+    # WHERE conditions (joined with AND, '' for none) and params for an
+    # optional inclusive date range
+    conditions = []
+    params = []
+    if start_date is not None:
+        conditions.append(f'{column} >= %s')
+        params.append(start_date)
+    if end_date is not None:
+        conditions.append(f'{column} <= %s')
+        params.append(end_date)
+    return ' AND '.join(conditions), params
+
+
+#----------Customers----------#
+INSERT_CUSTOMER = '''INSERT INTO customers (name, contact)
+                     VALUES (%s, %s) RETURNING id'''
+DELETE_CUSTOMER = 'DELETE FROM customers WHERE id = %s'
+SELECT_CUSTOMERS = f'SELECT {columns(CustomerRecord)} FROM customers'
+SELECT_CUSTOMER = f'{SELECT_CUSTOMERS} WHERE id = %s'
+SEARCH_CUSTOMERS = f'{SELECT_CUSTOMERS} WHERE name ILIKE %s'
+CUSTOMERS_PAGE = f'SELECT {columns(CustomerRecord, "c")} FROM customers c'    # for page_query
+
+#----------Products----------#
+INSERT_PRODUCT = '''INSERT INTO products (name, description, price, quantity)
+                    VALUES (%s, %s, %s, %s) RETURNING id'''
+DELETE_PRODUCT = 'DELETE FROM products WHERE id = %s'
+SELECT_PRODUCTS = f'SELECT {columns(ProductRecord)} FROM products'
+SELECT_PRODUCT = f'{SELECT_PRODUCTS} WHERE id = %s'
+PRODUCTS_PAGE = f'SELECT {columns(ProductRecord, "p")} FROM products p'       # for page_query
+STOCK_LEVELS = 'SELECT id, quantity FROM products WHERE id = ANY(%s)'
+# Row locks for a cart, taken in id order before DECREMENT_STOCK: the UPDATE's
+# join order is up to the planner, so it can't be relied on to lock in order
+LOCK_PRODUCTS = 'SELECT id FROM products WHERE id = ANY(%s) ORDER BY id FOR UPDATE'
+# Params: product ids and quantities (int arrays). Decrements only the rows
+# with enough stock; returns their id, price and remaining quantity.
+DECREMENT_STOCK = '''UPDATE products p SET quantity = p.quantity - c.quantity
+                     FROM unnest(%s::int[], %s::int[]) AS c (product_id, quantity)
+                     WHERE p.id = c.product_id AND p.quantity >= c.quantity
+                     RETURNING p.id, p.price, p.quantity'''
+
+#----------Sale items----------#
+INSERT_SALE_ITEM = '''INSERT INTO sale_items (sale_id, product_id, quantity, price)
+                      VALUES (%s, %s, %s, %s) RETURNING id'''
+# Params: sale id, then product ids, quantities and prices as arrays; one
+# statement for a whole cart, ids returned in line order
+INSERT_SALE_ITEMS = '''INSERT INTO sale_items (sale_id, product_id, quantity, price)
+                       SELECT %s, product_id, quantity, price
+                       FROM unnest(%s::int[], %s::int[], %s::numeric[]) AS l (product_id, quantity, price)
+                       RETURNING id'''
+SELECT_SALE_ITEMS = f'SELECT {columns(SaleItemRecord)} FROM sale_items WHERE sale_id = %s'
+
+
+def sale_items_params(sale_id, lines):
+    # INSERT_SALE_ITEMS params for (product_id, quantity, price) lines
+    return (sale_id, [line[0] for line in lines], [line[1] for line in lines], [line[2] for line in lines])
+
+
+#----------Sales----------#
+INSERT_SALE = '''INSERT INTO sales (customer_id, date, total_amount)
+                 VALUES (%s, %s, %s) RETURNING id'''
+SELECT_SALE = f'SELECT {columns(SaleRecord)} FROM sales WHERE id = %s'
+SALES_BY_CUSTOMER = f'SELECT {columns(SaleRecord)} FROM sales WHERE customer_id = %s'
+SALES_PAGE = '''SELECT s.id, c.name, s.date, s.total_amount
+                FROM sales s JOIN customers c ON s.customer_id = c.id'''           # for page_query
+
+# These read the sales_daily rollup (migration 6); params are the start date
+# twice, then the end date twice (either may be None)
+SALES_SUMMARY = '''SELECT COALESCE(SUM(sale_count), 0), COALESCE(SUM(revenue), 0),
+                          COALESCE(SUM(items_sold), 0)
+                   FROM sales_daily
+                   WHERE (%s::date IS NULL OR day >= %s::date)
+                     AND (%s::date IS NULL OR day <= %s::date)'''
+DAILY_SALES = '''SELECT day, sale_count, revenue, items_sold, customer_count
+                 FROM sales_daily
+                 WHERE (%s::date IS NULL OR day >= %s::date)
+                   AND (%s::date IS NULL OR day <= %s::date)
+                   AND sale_count > 0
+                 ORDER BY day'''
+
+
+def rollup_range_params(start_date=None, end_date=None):
+    return (start_date, start_date, end_date, end_date)
+
+
+def top_sellers_query(limit, window=None):
+    # Best sellers (product_id, name, units_sold, revenue). window is None for
+    # all time (the product_sales counters, migration 7), or one of
+    # TOP_SELLING_WINDOWS (the per-day buckets).
+    if window is None:
+        return ('''SELECT ps.product_id, p.name, ps.units_sold, ps.revenue
+                   FROM product_sales ps
+                   LEFT JOIN products p ON p.id = ps.product_id
+                   WHERE ps.units_sold > 0
+                   ORDER BY ps.units_sold DESC, ps.product_id
+                   LIMIT %s''', (limit,))
+    if window not in TOP_SELLING_WINDOWS:
+        raise ValueError(f"Unknown window {window!r}; choose one of {', '.join(TOP_SELLING_WINDOWS)}")
+    return ('''SELECT d.product_id, p.name, SUM(d.units_sold) AS units, SUM(d.revenue)
+               FROM product_sales_daily d
+               LEFT JOIN products p ON p.id = d.product_id
+               WHERE d.day >= current_date - %s
+               GROUP BY d.product_id, p.name
+               HAVING SUM(d.units_sold) > 0
+               ORDER BY units DESC, d.product_id
+               LIMIT %s''', (TOP_SELLING_WINDOWS[window], limit))
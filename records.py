@@ -0,0 +1,118 @@
+# Typed row records returned by the model read methods.
+# Records are NamedTuples: fields are read by name (product.price) but they
+# are still tuples, so they cost no more per row than the driver's plain
+# tuples, unpack and index the same way, and pickle for the query cache.
+#
+# RecordCursor turns each fetched row into a record with a single
+# tuple.__new__ (no per-field Python calls); select columns in record order
+# with columns(Record, alias). It is an InstrumentedCursor, so record queries
+# are timed like any other.
+
+from datetime import date
+from decimal import Decimal
+from typing import NamedTuple, Optional
+
+from instrumentation import InstrumentedCursor
+
+
+class CustomerRecord(NamedTuple):
+    id: int
+    name: str
+    contact: str
+
+
+class ProductRecord(NamedTuple):
+    id: int
+    name: str
+    description: Optional[str]
+    price: Decimal
+    quantity: int
+    sku: Optional[str]
+
+
+class SaleRecord(NamedTuple):
+    id: int
+    customer_id: int
+    date: date
+    total_amount: Decimal
+
+
+class SaleItemRecord(NamedTuple):
+    id: int
+    sale_id: int
+    product_id: int
+    quantity: int
+    price: Decimal
+
+
+class SaleListing(NamedTuple):
+    # A sale with its customer's name, for listings
+    id: int
+    customer: str
+    date: date
+    total_amount: Decimal
+
+
+class SalesSummary(NamedTuple):
+    sale_count: int
+    revenue: Decimal
+    items_sold: int
+
+
+class DailySales(NamedTuple):
+    day: date
+    sale_count: int
+    revenue: Decimal
+    items_sold: int
+    customer_count: int
+
+
+class TopSeller(NamedTuple):
+    product_id: int
+    name: Optional[str]
+    units_sold: int
+    revenue: Decimal
+
+
+def columns(record, alias=None):
+    # "a.id, a.name, ..." for the record's fields
+    prefix = f"{alias}." if alias else ""
+    return ", ".join(prefix + field for field in record._fields)
+
+
+class RecordCursor(InstrumentedCursor):
+    # Cursor whose fetch methods and iteration return record instances;
+    # set cursor.record (a NamedTuple class) before fetching.
+    record = None
+
+    def _make(self, row):
+        return row if row is None or self.record is None else tuple.__new__(self.record, row)
+
+    def fetchone(self):
+        return self._make(super().fetchone())
+
+    def fetchmany(self, size=None):
+        rows = super().fetchmany(size) if size is not None else super().fetchmany()
+        return rows if self.record is None else [tuple.__new__(self.record, row) for row in rows]
+
+    def fetchall(self):
+        rows = super().fetchall()
+        return rows if self.record is None else [tuple.__new__(self.record, row) for row in rows]
+
+    def __iter__(self):
+        # next() on the driver's iterator; a for loop would re-enter __iter__
+        record = self.record
+        rows = super().__iter__()
+        while True:
+            try:
+                row = next(rows)
+            except StopIteration:
+                return
+            yield row if record is None else tuple.__new__(record, row)
+
+
+def record_cursor(conn, record, name=None):
+    # A cursor on conn returning `record` rows; name makes it server-side
+    cur = conn.cursor(name=name, cursor_factory=RecordCursor)
+    cur.record = record
+    return cur
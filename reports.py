@@ -0,0 +1,236 @@
+# Batch reports for month-end, run in parallel across processes.
+#
+#   python reports.py statements --start 2024-05-01 --end 2024-05-31 --output statements.csv
+#   python reports.py customers  --start 2024-05-01 --end 2024-05-31 --workers 8
+#   python reports.py products   --start 2024-01-01 --end 2024-12-31
+#   python reports.py revenue    --output revenue.csv
+#
+#   statements  every sale line of every customer in the period
+#   customers   per customer: sale count, total spent, first and last sale
+#   products    per product: units sold and revenue, best sellers first
+#   revenue     per day: sale count, revenue, items sold, customers
+#
+# The work is split into chunks: customer id ranges for the customer
+# reports, date ranges for the others. A pool of worker processes runs them,
+# and each worker has its own connection (Database.py opens a new pool in a
+# forked process). The chunks' rows are merged in chunk order, so the output
+# is the same whatever the number of workers. CHUNKS_PER_WORKER chunks per
+# worker keep the workers busy when some ranges are heavier than others.
+# The period defaults to the first through the last day with sales.
+
+import argparse
+import csv
+import multiprocessing
+import os
+import sys
+import time
+from datetime import date, timedelta
+
+from Database import get_connection
+
+CHUNKS_PER_WORKER = 4
+
+
+def customer_ranges(chunks):
+    # [low, high) customer id ranges of about equal width covering every id
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute('SELECT MIN(id), MAX(id) FROM customers')
+        low, high = cur.fetchone()
+        cur.close()
+    if low is None:
+        return []
+    step = max(-(-(high - low + 1) // chunks), 1)
+    return [(start, min(start + step, high + 1)) for start in range(low, high + 1, step)]
+
+
+def date_ranges(start_date, end_date, chunks):
+    # [first, last] day ranges of about equal length covering the period
+    days = (end_date - start_date).days + 1
+    if days <= 0:
+        return []
+    step = max(-(-days // chunks), 1)
+    ranges = []
+    for offset in range(0, days, step):
+        first = start_date + timedelta(days=offset)
+        ranges.append((first, min(first + timedelta(days=step - 1), end_date)))
+    return ranges
+
+
+def sales_period():
+    # First and last day with sales, from the daily rollup
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute('SELECT MIN(day), MAX(day) FROM sales_daily WHERE sale_count > 0')
+        period = cur.fetchone()
+        cur.close()
+    return period
+
+
+#----------Chunk queries----------#
+# Each takes the chunk's range and the report period and returns its rows in
+# report order; run in the worker processes.
+
+def statement_lines(low, high, start_date, end_date):
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute('''SELECT c.id, c.name, c.contact, s.id, s.date, s.total_amount,
+                              si.product_id, p.name, si.quantity, si.price, si.quantity * si.price
+                       FROM customers c
+                       JOIN sales s ON s.customer_id = c.id
+                       LEFT JOIN sale_items si ON si.sale_id = s.id
+                       LEFT JOIN products p ON p.id = si.product_id
+                       WHERE c.id >= %s AND c.id < %s AND s.date BETWEEN %s AND %s
+                       ORDER BY c.id, s.date, s.id, si.id''',
+                    (low, high, start_date, end_date))
+        rows = cur.fetchall()
+        cur.close()
+        return rows
+
+
+def customer_totals(low, high, start_date, end_date):
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute('''SELECT c.id, c.name, c.contact, COUNT(*), SUM(s.total_amount), MIN(s.date), MAX(s.date)
+                       FROM customers c
+                       JOIN sales s ON s.customer_id = c.id
+                       WHERE c.id >= %s AND c.id < %s AND s.date BETWEEN %s AND %s
+                       GROUP BY c.id, c.name, c.contact
+                       ORDER BY c.id''',
+                    (low, high, start_date, end_date))
+        rows = cur.fetchall()
+        cur.close()
+        return rows
+
+
+def product_totals(first, last, start_date, end_date):
+    # Reads the product_sales_daily counters (migration 7)
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute('''SELECT d.product_id, p.name, SUM(d.units_sold), SUM(d.revenue)
+                       FROM product_sales_daily d
+                       LEFT JOIN products p ON p.id = d.product_id
+                       WHERE d.day BETWEEN %s AND %s
+                       GROUP BY d.product_id, p.name
+                       ORDER BY d.product_id''',
+                    (first, last))
+        rows = cur.fetchall()
+        cur.close()
+        return rows
+
+
+def daily_revenue(first, last, start_date, end_date):
+    # Reads the sales_daily rollup (migration 6)
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute('''SELECT day, sale_count, revenue, items_sold, customer_count
+                       FROM sales_daily
+                       WHERE day BETWEEN %s AND %s AND sale_count > 0
+                       ORDER BY day''',
+                    (first, last))
+        rows = cur.fetchall()
+        cur.close()
+        return rows
+
+
+def merge_products(rows):
+    # The date chunks each have a total per product; add them up and put
+    # the best sellers first (ties by product id)
+    totals = {}
+    for product_id, name, units, revenue in rows:
+        if product_id in totals:
+            entry = totals[product_id]
+            entry[2] += units
+            entry[3] += revenue
+        else:
+            totals[product_id] = [product_id, name, units, revenue]
+    return sorted((tuple(entry) for entry in totals.values() if entry[2] > 0),
+                  key=lambda entry: (-entry[2], entry[0]))
+
+
+# report -> (split by, chunk query, merge or None to concatenate, CSV header)
+REPORTS = {
+    "statements": ("customers", statement_lines, None,
+                   ["customer_id", "customer", "contact", "sale_id", "date", "sale_total",
+                    "product_id", "product", "quantity", "price", "line_total"]),
+    "customers": ("customers", customer_totals, None,
+                  ["customer_id", "customer", "contact", "sales", "total_spent", "first_sale", "last_sale"]),
+    "products": ("dates", product_totals, merge_products,
+                 ["product_id", "product", "units_sold", "revenue"]),
+    "revenue": ("dates", daily_revenue, None,
+                ["day", "sales", "revenue", "items_sold", "customers"]),
+}
+
+
+def _run_chunk(task):
+    index, name, low, high, start_date, end_date = task
+    return index, REPORTS[name][1](low, high, start_date, end_date)
+
+
+def run_report(name, start_date=None, end_date=None, workers=None, chunks=None):
+    # Rows of a report over [start_date, end_date]. workers=1 runs the chunks
+    # in this process.
+    if name not in REPORTS:
+        raise ValueError(f"Unknown report {name!r}; choose one of {', '.join(REPORTS)}")
+    split, _, merge, _ = REPORTS[name]
+    workers = workers or min(os.cpu_count() or 1, 8)
+    chunks = chunks or workers * CHUNKS_PER_WORKER
+
+    if start_date is None or end_date is None:
+        first, last = sales_period()
+        if first is None:
+            return []
+        start_date = start_date or first
+        end_date = end_date or last
+    ranges = customer_ranges(chunks) if split == "customers" else date_ranges(start_date, end_date, chunks)
+    tasks = [(index, name, low, high, start_date, end_date) for index, (low, high) in enumerate(ranges)]
+
+    results = [None] * len(tasks)
+    if workers == 1 or len(tasks) <= 1:
+        for task in tasks:
+            index, rows = _run_chunk(task)
+            results[index] = rows
+    else:
+        with multiprocessing.Pool(min(workers, len(tasks))) as pool:
+            for index, rows in pool.imap_unordered(_run_chunk, tasks):
+                results[index] = rows
+
+    rows = [row for chunk in results for row in chunk]
+    return merge(rows) if merge else rows
+
+
+def write_csv(name, rows, output=None):
+    header = REPORTS[name][3]
+    f = open(output, "w", newline="", encoding="utf-8") if output else sys.stdout
+    try:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        writer.writerows(rows)
+    finally:
+        if output:
+            f.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a batch report across worker processes.")
+    parser.add_argument("report", choices=list(REPORTS))
+    parser.add_argument("--start", type=date.fromisoformat, help="first day (default: first day with sales)")
+    parser.add_argument("--end", type=date.fromisoformat, help="last day (default: last day with sales)")
+    parser.add_argument("--workers", type=int, help="processes (default: CPU count, at most 8)")
+    parser.add_argument("--chunks", type=int, help=f"work units (default: {CHUNKS_PER_WORKER} per worker)")
+    parser.add_argument("--output", help="CSV file (default: stdout)")
+    args = parser.parse_args()
+
+    if args.start and args.end and args.start > args.end:
+        print("--start must not be after --end")
+        return 1
+    started = time.perf_counter()
+    rows = run_report(args.report, args.start, args.end, args.workers, args.chunks)
+    write_csv(args.report, rows, args.output)
+    if args.output:
+        print(f"{len(rows)} rows written to {args.output} in {time.perf_counter() - started:.1f} s.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,85 +1,245 @@
 #Sales -> Columns: id, customer_id, date, total_amount
 import psycopg2
-from Database import conn
+from datetime import date as date_type
+from decimal import Decimal
+from Database import get_connection, iter_query
+from cache import cached_query, invalidate
+from pagination import DEFAULT_PAGE_SIZE, check_sort_key, fetch_page, page_query, print_pages, split_page
+from products import Product, InsufficientStock
+from queries import (DAILY_SALES, INSERT_SALE, SALES_BY_CUSTOMER, SALES_PAGE, SALES_SUMMARY, SELECT_SALE,
+                     TOP_SELLING_WINDOWS, date_range, rollup_range_params, top_sellers_query)
+from records import DailySales, SaleListing, SaleRecord, SalesSummary, TopSeller, columns, record_cursor
+from sales_items import SaleItem
+from billing import get_bill
 class Sale:
-    def __init__(self, customer_id, date, total_amount):
-        self.customer_id = customer_id
-        self.date = date
-        self.total_amount = total_amount
+    SORT_KEYS = ("id", "date", "total_amount")
+    TOP_SELLING_WINDOWS = TOP_SELLING_WINDOWS
+
     def create_table():
-        cur = conn.cursor()
-        cur.execute('''CREATE TABLE IF NOT EXISTS sales (
-                        id SERIAL PRIMARY KEY,
-                        customer_id INTEGER NOT NULL,
-                        date DATE NOT NULL,
-                        total_amount DECIMAL(10, 2) NOT NULL
-                    )''')
-        conn.commit()
-        cur.close()
+        with get_connection() as conn:
+            cur = conn.cursor()
+            cur.execute('''CREATE TABLE IF NOT EXISTS sales (
+                            id SERIAL PRIMARY KEY,
+                            customer_id INTEGER NOT NULL,
+                            date DATE NOT NULL,
+                            total_amount DECIMAL(10, 2) NOT NULL
+                        )''')
+            conn.commit()
+            cur.close()
     def insert_sale(customer_id, date, total_amount):
-        cur = conn.cursor()
-        cur.execute('''INSERT INTO sales (customer_id, date, total_amount)
-                       VALUES (%s, %s, %s)''',
-                    (customer_id, date, total_amount))
-        conn.commit()
-        cur.close()
-
-    def view_sales(self):
-        cur = conn.cursor()
-        cur.execute('SELECT * FROM sales')
-        sales = cur.fetchall()
-        for sale in sales:
+        with get_connection() as conn:
+            cur = conn.cursor()
+            cur.execute(INSERT_SALE, (customer_id, date, total_amount))
+            sale_id = cur.fetchone()[0]
+            conn.commit()
+            cur.close()
+        invalidate("sales")
+        return sale_id
+
+    def checkout(customer_id, lines, sale_date=None):
+        # lines: (product_id, quantity) or (product_id, quantity, price) tuples.
+        # Price defaults to the catalog price. The sale header, its items, the
+        # stock decrements and the total are written in a single transaction.
+        cart = Sale.prepare_cart(lines)
+        if sale_date is None:
+            sale_date = date_type.today()
+
+        with get_connection() as conn:
+            # Conditional stock decrement; also returns the catalog prices
+            updated, failed = Product.decrement_stock([(product_id, quantity) for product_id, quantity, _ in cart], conn)
+            if failed:
+                conn.rollback()
+                raise InsufficientStock(failed)
+            items, total_amount = Sale.price_cart(cart, updated)
+
+            cur = conn.cursor()
+            cur.execute(INSERT_SALE, (customer_id, sale_date, total_amount))
+            sale_id = cur.fetchone()[0]
+            cur.close()
+            SaleItem.add_items(sale_id, items, conn)
+            conn.commit()
+        invalidate("products", "sales", "sale_items")
+        return sale_id, total_amount
+
+    def prepare_cart(lines):
+        # Validated (product_id, quantity, price or None) lines for checkout
+        cart = []
+        for line in lines:
+            product_id, quantity = int(line[0]), int(line[1])
+            price = line[2] if len(line) > 2 else None
+            if quantity <= 0:
+                raise ValueError(f"Quantity for product {product_id} must be positive")
+            cart.append((product_id, quantity, None if price is None else Decimal(str(price))))
+        if not cart:
+            raise ValueError("Cart is empty")
+        return cart
+
+    def price_cart(cart, updated):
+        # updated is decrement_stock's {product_id: (price, remaining)}; returns
+        # the (product_id, quantity, price) items and the sale total
+        items = [(product_id, quantity, updated[product_id][0] if price is None else price)
+                 for product_id, quantity, price in cart]
+        total_amount = sum(quantity * price for _, quantity, price in items).quantize(Decimal("0.01"))
+        return items, total_amount
+
+    def iter_sales(start_date=None, end_date=None, itersize=None):
+        # Streams sales (optionally within a date range) in (date, id) order
+        # with constant memory
+        where, params = date_range('date', start_date, end_date)
+        query = f'SELECT {columns(SaleRecord)} FROM sales'
+        if where:
+            query += ' WHERE ' + where
+        query += ' ORDER BY date, id'
+        return iter_query(query, params, itersize=itersize, record=SaleRecord)
+
+    @cached_query("sales", "customers")
+    def get_sales_page(page_size=DEFAULT_PAGE_SIZE, after=None, sort_key="date", descending=True,
+                       start_date=None, end_date=None):
+        # Rows are SaleListing (id, customer name, date, total_amount), newest first by default,
+        # optionally limited to a date range.
+        # Returns (rows, next_after); pass next_after back for the next page
+        check_sort_key(sort_key, Sale.SORT_KEYS)
+        where, params = date_range('s.date', start_date, end_date)
+        return fetch_page(SALES_PAGE, "s", sort_key, after, page_size, descending,
+                          where, params, record=SaleListing)
+
+    def view_sales():
+        print_pages(Sale.get_sales_page)
+    def view_sale_by_id(sale_id):
+        with get_connection() as conn:
+            cur = record_cursor(conn, SaleRecord)
+            cur.execute(SELECT_SALE, (sale_id,))
+            sale = cur.fetchone()
             print(sale)
-        cur.close()
-    def view_sale_by_id(self, sale_id):
-        cur = conn.cursor()
-        cur.execute('SELECT * FROM sales WHERE id = %s', (sale_id,))
-        sale = cur.fetchone()
-        print(sale)
-        cur.close()
+            cur.close()
+            return sale
     
     def generate_bill(sale_id):
-        cur = conn.cursor()
-        cur.execute('SELECT * FROM sale_items WHERE sale_id = %s', (sale_id,))
-        sale_items = cur.fetchall()
-        print("Bill for Sale ID:", sale_id)
-        total_amount = 0
-        for item in sale_items:
-            print("Product ID:", item[2], "Quantity:", item[3], "Price:", item[4])
-            total_amount += item[4] * item[3]
-        print("Total Amount:", total_amount)
-        cur.close()
-        return total_amount
+        # Prints the (cached) bill and returns the sum of its line totals
+        bill = get_bill(sale_id)
+        if bill is None:
+            print("Sale not found")
+            return 0
+        print(bill["text"])
+        return bill["items_total"]
     
 #----------Analytical Queries----------#
+# These read the sales_daily rollup (migration 6), which triggers keep current,
+# so they cost O(days) instead of O(sales).
+    @cached_query("sales", "sale_items")
     def get_total_sales_by_date(start_date, end_date):
-        cur = conn.cursor()
-        cur.execute('''SELECT SUM(total_amount) FROM sales
-                       WHERE date BETWEEN %s AND %s''',
-                    (start_date, end_date))
-        total_sales = cur.fetchone()[0]
-        cur.close()
-        return total_sales
+        with get_connection() as conn:
+            cur = conn.cursor()
+            cur.execute('''SELECT SUM(revenue) FROM sales_daily
+                           WHERE day BETWEEN %s AND %s''',
+                        (start_date, end_date))
+            total_sales = cur.fetchone()[0]
+            cur.close()
+            return total_sales
+
+    @cached_query("sales", "sale_items")
+    def get_sales_summary(start_date=None, end_date=None):
+        # SalesSummary (sale count, revenue, items sold) over a date range, default all days
+        with get_connection() as conn:
+            cur = record_cursor(conn, SalesSummary)
+            cur.execute(SALES_SUMMARY, rollup_range_params(start_date, end_date))
+            summary = cur.fetchone()
+            cur.close()
+            return summary
+
+    @cached_query("sales", "sale_items")
+    def get_daily_sales(start_date=None, end_date=None):
+        # DailySales rows (day, sale_count, revenue, items_sold, customer_count)
+        with get_connection() as conn:
+            cur = record_cursor(conn, DailySales)
+            cur.execute(DAILY_SALES, rollup_range_params(start_date, end_date))
+            days = cur.fetchall()
+            cur.close()
+            return days
     
-    def get_top_selling_products():
-        cur = conn.cursor()
-        cur.execute('''SELECT product_id, SUM(quantity) as total_quantity
-                       FROM sale_items
-                       GROUP BY product_id
-                       ORDER BY total_quantity DESC
-                       LIMIT 5''')
-        top_products = cur.fetchall()
-        cur.close()
-        return top_products
+    @cached_query("sales", "sale_items", "products")
+    def get_top_selling_products(limit=5, window=None):
+        # TopSeller rows (product_id, name, units_sold, revenue), best sellers first.
+        # window is None for all time, or one of TOP_SELLING_WINDOWS. Reads the
+        # product_sales counters (migration 7) instead of scanning sale_items.
+        query, params = top_sellers_query(limit, window)
+        with get_connection() as conn:
+            cur = record_cursor(conn, TopSeller)
+            cur.execute(query, params)
+            top_products = cur.fetchall()
+            cur.close()
+            return top_products
     
     def get_sales_by_customer(customer_id):
-        cur = conn.cursor()
-        cur.execute('SELECT * FROM sales WHERE customer_id = %s', (customer_id,))
-        sales = cur.fetchall()
-        for sale in sales:
-            print(sale)
-        cur.close()
-        return sales
+        with get_connection() as conn:
+            cur = record_cursor(conn, SaleRecord)
+            cur.execute(SALES_BY_CUSTOMER, (customer_id,))
+            sales = cur.fetchall()
+            for sale in sales:
+                print(sale)
+            cur.close()
+            return sales
+
+    @cached_query("sales", "sale_items", "products")
+    def get_customer_statement(customer_id, start_date=None, end_date=None,
+                               page_size=DEFAULT_PAGE_SIZE, after=None):
+        # One page of a customer's sales (newest first) with their line items,
+        # plus the count and total over the whole filtered range. Two queries
+        # regardless of how many sales or items the customer has.
+        dates, date_params = date_range('s.date', start_date, end_date)
+        where = ' AND '.join(['s.customer_id = %s'] + ([dates] if dates else []))
+        params = [customer_id] + date_params
+        page_sql, page_args = page_query('SELECT s.id, s.date, s.total_amount FROM sales s', "s",
+                                         "date", after, page_size, True, where, params)
+        with get_connection() as conn:
+            cur = conn.cursor()
+            cur.execute(f'''SELECT s.id, s.date, s.total_amount,
+                                  array_agg(si.product_id ORDER BY si.id) FILTER (WHERE si.id IS NOT NULL),
+                                  array_agg(p.name ORDER BY si.id) FILTER (WHERE si.id IS NOT NULL),
+                                  array_agg(si.quantity ORDER BY si.id) FILTER (WHERE si.id IS NOT NULL),
+                                  array_agg(si.price ORDER BY si.id) FILTER (WHERE si.id IS NOT NULL),
+                                  COALESCE(SUM(si.quantity * si.price), 0)
+                           FROM ({page_sql}) s
+                           LEFT JOIN sale_items si ON si.sale_id = s.id
+                           LEFT JOIN products p ON p.id = si.product_id
+                           GROUP BY s.id, s.date, s.total_amount
+                           ORDER BY s.date DESC, s.id DESC''', page_args)
+            rows, next_after = split_page(cur.fetchall(), page_size, 1)
+            cur.execute(f'SELECT COUNT(*), COALESCE(SUM(total_amount), 0) FROM sales s WHERE {where}', params)
+            sale_count, total_spent = cur.fetchone()
+            cur.close()
+
+        sales = []
+        for sale_id, sale_date, total_amount, product_ids, names, quantities, prices, items_total in rows:
+            lines = [{"product_id": product_id,
+                      "product": name if name is not None else f"Product #{product_id}",
+                      "quantity": quantity,
+                      "price": price,
+                      "total": quantity * price}
+                     for product_id, name, quantity, price in zip(product_ids or [], names or [],
+                                                                  quantities or [], prices or [])]
+            sales.append({"sale_id": sale_id, "date": sale_date, "total_amount": total_amount,
+                          "items_total": items_total, "lines": lines})
+        return {"customer_id": customer_id, "sale_count": sale_count, "total_spent": total_spent,
+                "sales": sales, "next_after": next_after}
+
+    def print_customer_statement(customer_id, start_date=None, end_date=None):
+        after = None
+        while True:
+            statement = Sale.get_customer_statement(customer_id, start_date, end_date, after=after)
+            if after is None:
+                print("Sales for Customer ID:", customer_id, "-", statement["sale_count"],
+                      "sales, Total Spent:", statement["total_spent"])
+            for sale in statement["sales"]:
+                print("Sale", sale["sale_id"], sale["date"], "Total Amount:", sale["total_amount"])
+                for line in sale["lines"]:
+                    print("   ", line["product"], "Quantity:", line["quantity"], "Price:", line["price"],
+                          "Total:", line["total"])
+            after = statement["next_after"]
+            if after is None:
+                break
+            if input("Press Enter for the next page, q to stop: ").strip().lower() == "q":
+                break
     
     def sale_menu():
         while True:
@@ -93,6 +253,7 @@ class Sale:
             print("8. Get Total Sales by Date")
             print("9. Get Top Selling Products")
             print("10. Get Sales by Customer")
+            print("11. Checkout (New Sale with Items)")
             print("0. Exit")
             choice = input("Enter choice: ")
             if choice == '1':
@@ -102,8 +263,8 @@ class Sale:
                 customer_id = int(input("Enter customer id: "))
                 date = input("Enter date: ")
                 total_amount = float(input("Enter total amount: "))
-                Sale.insert_sale(customer_id, date, total_amount)
-                print("Sale inserted")
+                sale_id = Sale.insert_sale(customer_id, date, total_amount)
+                print("Sale inserted with ID:", sale_id)
 
             elif choice == '3':
                 Sale.view_sales()
@@ -116,17 +277,25 @@ class Sale:
 
             elif choice == '5':
                 sale_id = int(input("Enter sale id: "))
-                product_id = int(input("Enter product id: "))
-                quantity = int(input("Enter quantity: "))
-                price = float(input("Enter price: "))
-                Sale.add_sale_items(sale_id, product_id, quantity, price)
-                print("Sale item added")
+                lines = []
+                while True:
+                    product_id = input("Enter product id (blank to finish): ")
+                    if not product_id:
+                        break
+                    quantity = int(input("Enter quantity: "))
+                    price = float(input("Enter price: "))
+                    lines.append((int(product_id), quantity, price))
+                item_ids = SaleItem.add_items(sale_id, lines)
+                print("Sale items added:", item_ids)
             
             elif choice == '6':
                 product_id = int(input("Enter product id: "))
                 quantity_sold = int(input("Enter quantity sold: "))
-                Sale.update_inventory(product_id, quantity_sold)
-                print("Inventory updated")
+                _, failed = Product.decrement_stock([(product_id, quantity_sold)])
+                if failed:
+                    print(InsufficientStock(failed))
+                else:
+                    print("Inventory updated")
             elif choice == '7':
                 sale_id = int(input("Enter sale id: "))
                 total_amount = Sale.generate_bill(sale_id)
@@ -140,15 +309,28 @@ class Sale:
                 top_products = Sale.get_top_selling_products()
                 print("Top Selling Products:")
                 for product in top_products:
-                    print("Product ID:", product[0], "Total Quantity Sold:", product[1])
+                    print("Product ID:", product.product_id, "Name:", product.name, "Total Quantity Sold:", product.units_sold)
             elif choice == '10':
                 customer_id = int(input("Enter customer id: "))
-                sales = Sale.get_sales_by_customer(customer_id)
-                print("Sales for Customer ID:", customer_id)
-                for sale in sales:
-                    print(sale)
-                    print("Total Amount:", Sale.generate_bill(sale[0]))
+                start_date = input("Enter start date (YYYY-MM-DD, blank for all): ") or None
+                end_date = input("Enter end date (YYYY-MM-DD, blank for all): ") or None
+                Sale.print_customer_statement(customer_id, start_date, end_date)
             
+            elif choice == '11':
+                customer_id = int(input("Enter customer id: "))
+                lines = []
+                while True:
+                    product_id = input("Enter product id (blank to finish): ")
+                    if not product_id:
+                        break
+                    quantity = int(input("Enter quantity: "))
+                    lines.append((int(product_id), quantity))
+                try:
+                    sale_id, total_amount = Sale.checkout(customer_id, lines)
+                    print("Sale", sale_id, "completed. Total Amount:", total_amount)
+                except (ValueError, InsufficientStock) as e:
+                    print("Checkout failed:", e)
+
             elif choice == '0':
                 print("Exiting...")
                 break
@@ -4,56 +4,88 @@
 
 # add_item(sale_id, product_id, quantity, price) → Add a product to a sale
 
+# add_items(sale_id, lines) → Add a whole cart to a sale in one statement
+
 # # get_items_by_sale(sale_id) → Fetch all products for a specific sale
 
 import psycopg2
-from Database import conn
+from Database import get_connection, iter_query
+from billing import invalidate_bill
+from cache import invalidate
+from queries import INSERT_SALE_ITEM, INSERT_SALE_ITEMS, SELECT_SALE_ITEMS, sale_items_params
+from records import SaleItemRecord, columns, record_cursor
 
 class SaleItem:
-    def __init__(self, sale_id, product_id, quantity, price):
-        self.sale_id = sale_id
-        self.product_id = product_id
-        self.quantity = quantity
-        self.price = price
-        
     def create_table():
-        cur = conn.cursor()
-        cur.execute('''CREATE TABLE IF NOT EXISTS sale_items (
-                        id SERIAL PRIMARY KEY,
-                        sale_id INTEGER NOT NULL,
-                        product_id INTEGER NOT NULL,
-                        quantity INTEGER NOT NULL,
-                        price DECIMAL(10, 2) NOT NULL
-                    )''')
-        conn.commit()
-        cur.close()
-    def add_item(self,sale_id, product_id, quantity, price):
-        cur = conn.cursor()
-        cur.execute('''INSERT INTO sale_items (sale_id, product_id, quantity, price)
-                       VALUES (%s, %s, %s, %s)''',
-                    (sale_id, product_id, quantity, price))
-        conn.commit()
-        cur.close()
-        print("Item added to sale")
+        with get_connection() as conn:
+            cur = conn.cursor()
+            cur.execute('''CREATE TABLE IF NOT EXISTS sale_items (
+                            id SERIAL PRIMARY KEY,
+                            sale_id INTEGER NOT NULL,
+                            product_id INTEGER NOT NULL,
+                            quantity INTEGER NOT NULL,
+                            price DECIMAL(10, 2) NOT NULL
+                        )''')
+            conn.commit()
+            cur.close()
+    def add_item(sale_id, product_id, quantity, price):
+        with get_connection() as conn:
+            cur = conn.cursor()
+            cur.execute(INSERT_SALE_ITEM, (sale_id, product_id, quantity, price))
+            item_id = cur.fetchone()[0]
+            conn.commit()
+            cur.close()
+            invalidate_bill(sale_id)
+            invalidate("sale_items")
+            print("Item added to sale")
+            return item_id
         
-    def get_items_by_sale(self,sale_id):
-        cur = conn.cursor()
-        cur.execute('SELECT * FROM sale_items WHERE sale_id = %s', (sale_id,))
-        items = cur.fetchall()
-        cur.close()
-        return items
-    def view_sale_items(self, sale_id):
+    def add_items(sale_id, lines, conn=None):
+        # lines: (product_id, quantity, price) tuples. All lines go in with a
+        # single INSERT over arrays; returns the new item ids in line order.
+        # When conn is given the caller owns the transaction and must call
+        # invalidate_bill(sale_id) and invalidate("sale_items") after committing.
+        if conn is None:
+            with get_connection() as conn:
+                item_ids = SaleItem.add_items(sale_id, lines, conn)
+                conn.commit()
+            invalidate_bill(sale_id)
+            invalidate("sale_items")
+            return item_ids
+        if not lines:
+            return []
         cur = conn.cursor()
-        cur.execute('SELECT * FROM sale_items WHERE sale_id = %s', (sale_id,))
-        items = cur.fetchall()
-        for item in items:
-            print(item)
+        cur.execute(INSERT_SALE_ITEMS, sale_items_params(sale_id, lines))
+        item_ids = [row[0] for row in cur.fetchall()]
         cur.close()
-        total_amount = 0
-        for item in items:
-            total_amount += item[3] * item[4]  # quantity * price
-        print("Total Amount for Sale ID", sale_id, ":", total_amount)
-        return total_amount
+        return item_ids
+
+    def iter_sale_items(after_id=None, itersize=None):
+        # Streams sale items in id order (optionally only those after an id)
+        # with constant memory
+        return iter_query(f'SELECT {columns(SaleItemRecord)} FROM sale_items WHERE id > %s ORDER BY id',
+                          (after_id or 0,), itersize=itersize, record=SaleItemRecord)
+
+    def get_items_by_sale(sale_id):
+        with get_connection() as conn:
+            cur = record_cursor(conn, SaleItemRecord)
+            cur.execute(SELECT_SALE_ITEMS, (sale_id,))
+            items = cur.fetchall()
+            cur.close()
+            return items
+    def view_sale_items(sale_id):
+        with get_connection() as conn:
+            cur = record_cursor(conn, SaleItemRecord)
+            cur.execute(SELECT_SALE_ITEMS, (sale_id,))
+            items = cur.fetchall()
+            for item in items:
+                print(item)
+            cur.close()
+            total_amount = 0
+            for item in items:
+                total_amount += item.quantity * item.price
+            print("Total Amount for Sale ID", sale_id, ":", total_amount)
+            return total_amount
     def sale_item_menu():
         while True:
             print("1. Create Table")